@@ -122,12 +122,16 @@ class SystemLauncher:
         """Инициализация оптимизации производительности"""
         try:
             # Оптимизация баз данных
-            databases = ['security.db', 'advanced_security.db', 'performance.db']
+            databases = ['security.db', 'advanced_security.db', 'performance.db', 'cyberlab.db']
             for db in databases:
                 if os.path.exists(db):
-                    optimizations = performance_optimizer.optimize_database(db)
+                    # Онлайн-режим: порциями в фоне, не останавливая запись
+                    optimizations = performance_optimizer.optimize_database(db, online=True)
                     print(f"  ⚡ Оптимизирована БД {db}: {len(optimizations)} улучшений")
             
+            # Кэш аналитики сбрасывают процессы, которые пишут события (servise, simple_server):
+            # лаунчер событий не пишет, его собственный хук не сработал бы
+            
             # Очистка кэша
             cleanup_result = performance_optimizer.cleanup_cache()
             print(f"  🧹 Очищен кэш: {cleanup_result['memory_cleaned']} записей")
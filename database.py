@@ -1,77 +1,941 @@
+import asyncio
+import functools
 import sqlite3
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Размер пула соединений и ожидание свободного соединения (сек)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Размер кэша подготовленных выражений на соединение
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+# Повторы записи при SQLITE_BUSY/SQLITE_LOCKED сверх busy_timeout и начальная задержка (мс)
+DB_BUSY_RETRIES = int(os.getenv("DB_BUSY_RETRIES", "3"))
+DB_BUSY_BACKOFF_MS = int(os.getenv("DB_BUSY_BACKOFF_MS", "20"))
+# Общий срок одной записи (сек) вместе с повторами: ожидание блокировки всех попыток в сумме
+DB_WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", str(DB_POOL_TIMEOUT)))
+# Партиционирование событий по времени: none | day | week
+DB_PARTITION = os.getenv("DB_PARTITION", "none")
+# Срок хранения партиций в днях (0 — бессрочно) и период фоновой проверки (сек)
+DB_RETENTION_DAYS = int(os.getenv("DB_RETENTION_DAYS", "0"))
+DB_RETENTION_INTERVAL = float(os.getenv("DB_RETENTION_INTERVAL", "3600"))
+
+DAY_MS = 86400000
+PARTITION_DAYS = {"day": 1, "week": 7}
+
+# Значения severity/type, которые получают свой счётчик в агрегатах /api/stats (остальные — "other").
+# Поля приходят от клиента: без ограничения каждое новое значение добавляло бы строку агрегатов.
+# Сервис заменяет их ключами весов политики риска (Database.set_stats_labels)
+STATS_SEVERITIES = ("low", "medium", "high", "critical")
+STATS_TYPES = (
+    "login_failure", "login_attempt", "unauthorized_access", "data_export", "file_access",
+    "network_scan", "malware_detected", "system_event", "brute_force", "scan_then_access",
+)
+
+# Версия схемы (PRAGMA user_version):
+# 1 — время в epoch-ms (INTEGER) и индексы для выборок по времени/полям
+# 2 — инкрементальные агрегаты для /api/stats
+# 3 — каталог партиций событий event_partitions
+# 4 — агрегаты по партициям partition_stats (удаление партиции без сканирования)
+# 5 — индекс ленты idx_<таблица>_listing только по (timestamp, id)
+# 6 — колонка ip (участник события, ключ корреляции) в events и партициях
+SCHEMA_VERSION = 6
+
+EVENTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        source TEXT NOT NULL,
+        severity TEXT NOT NULL,
+        message TEXT NOT NULL,
+        risk_score INTEGER DEFAULT 0,
+        ip TEXT
+    )
+'''
+
+INCIDENTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        risk_score INTEGER NOT NULL,
+        event_data TEXT NOT NULL,
+        status TEXT DEFAULT 'open'
+    )
+'''
+
+# Индексы таблицы событий (events и каждой партиции)
+EVENT_INDEXES = (
+    # Лента дашборда и выборки по времени: страница id берётся из индекса (см. SELECT_PAGE_TEMPLATE)
+    "CREATE INDEX IF NOT EXISTS idx_{table}_listing ON {table}(timestamp, id)",
+    "CREATE INDEX IF NOT EXISTS idx_{table}_severity ON {table}(severity, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{table}_type ON {table}(type, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{table}_source ON {table}(source, timestamp)",
+)
+
+INDEXES = tuple(statement.format(table="events") for statement in EVENT_INDEXES) + (
+    "CREATE INDEX IF NOT EXISTS idx_incidents_timestamp ON incidents(timestamp, id, risk_score, status)",
+)
+
+# Каталог партиций: таблица events_<дата> хранит события за [start_ms, end_ms)
+PARTITIONS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS event_partitions (
+        name TEXT PRIMARY KEY,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL
+    )
+'''
+
+STATS_SCHEMA = (
+    # Счётчики: events, incidents, risk_sum/risk_count (risk_score > 0), severity:<x>, type:<x>
+    '''
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    # Те же счётчики событий по каждой партиции — их вычитают при её удалении
+    '''
+    CREATE TABLE IF NOT EXISTS partition_stats (
+        partition TEXT NOT NULL,
+        name TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (partition, name)
+    ) WITHOUT ROWID
+    ''',
+    # Поминутные корзины: minute = timestamp // 60000
+    '''
+    CREATE TABLE IF NOT EXISTS stats_minutes (
+        minute INTEGER PRIMARY KEY,
+        events INTEGER NOT NULL DEFAULT 0,
+        incidents INTEGER NOT NULL DEFAULT 0,
+        risk_sum INTEGER NOT NULL DEFAULT 0,
+        risk_count INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+)
+
+UPSERT_COUNTER_SQL = '''
+    INSERT INTO stats_counters (name, value) VALUES (?, ?)
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+'''
+
+UPSERT_PARTITION_STAT_SQL = '''
+    INSERT INTO partition_stats (partition, name, value) VALUES (?, ?, ?)
+    ON CONFLICT(partition, name) DO UPDATE SET value = value + excluded.value
+'''
+
+UPSERT_MINUTE_SQL = '''
+    INSERT INTO stats_minutes (minute, events, incidents, risk_sum, risk_count) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(minute) DO UPDATE SET
+        events = events + excluded.events,
+        incidents = incidents + excluded.incidents,
+        risk_sum = risk_sum + excluded.risk_sum,
+        risk_count = risk_count + excluded.risk_count
+'''
+
+def now_ms():
+    """Текущее время в epoch-ms"""
+    return int(time.time() * 1000)
+
+def to_epoch_ms(value):
+    """epoch-ms из int/float (мс) или строки ISO 8601 (наивное время — локальное)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if text.lstrip("-").isdigit():
+        return int(text)
+    return int(datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp() * 1000)
+
+def partition_bounds(timestamp, scheme):
+    """Имя и границы [start_ms, end_ms) партиции (сутки или ISO-неделя, UTC) для метки времени"""
+    day = timestamp // DAY_MS
+    if scheme == "week":
+        day -= (day + 3) % 7  # 1970-01-01 — четверг, недели начинаются с понедельника
+    start = day * DAY_MS
+    date = datetime.fromtimestamp(start / 1000, tz=timezone.utc).strftime("%Y%m%d")
+    prefix = "events_w" if scheme == "week" else "events_"
+    return prefix + date, start, start + PARTITION_DAYS[scheme] * DAY_MS
+
+def contention_kind(error):
+    """'busy' / 'locked' для ошибок конкуренции за блокировку SQLite, иначе None"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return None
+    text = str(error).lower()
+    if "locked" in text:
+        return "locked"
+    if "busy" in text:
+        return "busy"
+    return None
+
+def _legacy_timestamp(value):
+    """Конвертер старых TEXT-меток для миграции; нечитаемые — 0"""
+    try:
+        return to_epoch_ms(value)
+    except (TypeError, ValueError):
+        return 0
+
+INSERT_EVENT_TEMPLATE = '''
+    INSERT INTO {table} (timestamp, type, source, severity, message, risk_score, ip)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_EVENT_SQL = INSERT_EVENT_TEMPLATE.format(table="events")
+
+INSERT_INCIDENT_SQL = '''
+    INSERT INTO incidents (timestamp, risk_score, event_data)
+    VALUES (?, ?, ?)
+'''
+
+# Сквозная нумерация id: перед вставкой в партицию её последовательность подтягивается
+# до общего максимума — запоздавшие строки в старую партицию не повторяют выданные id
+SYNC_PARTITION_SEQ_SQL = '''
+    UPDATE sqlite_sequence SET seq = (
+        SELECT MAX(seq) FROM sqlite_sequence
+        WHERE name = 'events' OR name IN (SELECT name FROM event_partitions)
+    ) WHERE name = ?
+'''
+
+# Страница событий: сначала limit id по индексу без чтения строк (COVERING INDEX),
+# затем по rowid читаются только строки страницы — с message и прочими полями
+SELECT_PAGE_TEMPLATE = '''
+    SELECT * FROM {table} WHERE id IN (
+        SELECT id FROM {table} {where} ORDER BY {order} LIMIT ?
+    ) ORDER BY {order}
+'''
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений SQLite.
+    Соединения создаются лениво (после fork воркеры не делят дескрипторы),
+    работают в WAL с synchronous=NORMAL и переиспользуют подготовленные выражения.
+    """
+    def __init__(self, db_path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 cached_statements=DB_STATEMENT_CACHE):
+        self.db_path = db_path
+        # Каждое соединение с :memory: — отдельная база, поэтому одно соединение
+        self.size = 1 if db_path == ":memory:" else max(1, size)
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        # Для новой базы: освобождение страниц порциями (PRAGMA incremental_vacuum).
+        # Установка ждёт блокировку записи, поэтому только если режим ещё не тот
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("connection pool exhausted")
+    
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+    
+    def discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+    
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except sqlite3.ProgrammingError:
+            # Закрытое соединение не возвращаем в пул
+            self.discard(conn)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+    
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
 
 class Database:
-    def __init__(self, db_path="cyberlab.db"):
+    def __init__(self, db_path="cyberlab.db", pool_size=DB_POOL_SIZE, partition=DB_PARTITION,
+                 retention_days=DB_RETENTION_DAYS):
+        if partition not in ("none", *PARTITION_DAYS):
+            raise ValueError(f"Неизвестная схема партиционирования: {partition}")
         self.db_path = db_path
+        self.partition = partition
+        self.retention_days = retention_days
+        self._known_partitions = set()
+        self.stats_labels = {"severity": frozenset(STATS_SEVERITIES), "type": frozenset(STATS_TYPES)}
+        self.pool = ConnectionPool(db_path, size=pool_size)
+        self.busy_retries = DB_BUSY_RETRIES
+        self.write_timeout = DB_WRITE_TIMEOUT
+        self.contention = {"busy": 0, "locked": 0, "retries": 0, "failures": 0}
+        self._contention_lock = threading.Lock()
+        self._write_observers = []
+        self._invalidation_hooks = []
         self.init_db()
     
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Events table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                type TEXT NOT NULL,
-                source TEXT NOT NULL,
-                severity TEXT NOT NULL,
-                message TEXT NOT NULL,
-                risk_score INTEGER DEFAULT 0
-            )
-        ''')
-        
-        # Incidents table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS incidents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                risk_score INTEGER NOT NULL,
-                event_data TEXT NOT NULL,
-                status TEXT DEFAULT 'open'
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < 1:
+                    self._migrate_epoch_ms(conn)
+                conn.execute(EVENTS_SCHEMA.format(table="events"))
+                conn.execute(INCIDENTS_SCHEMA.format(table="incidents"))
+                for statement in INDEXES + STATS_SCHEMA + (PARTITIONS_SCHEMA,):
+                    conn.execute(statement)
+                if 0 < version < 5:
+                    self._narrow_listing_indexes(conn)
+                if version < 6:
+                    self._add_ip_column(conn)
+                if version < 2:
+                    self._rebuild_stats(conn)
+                elif version < 4:
+                    for (name,) in conn.execute("SELECT name FROM event_partitions").fetchall():
+                        self._rebuild_partition_stats(conn, name)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        # Соединения не переживают fork воркеров: следующие откроются лениво
+        if self.db_path != ":memory:":
+            self.pool.close()
     
-    def log_event(self, event_data):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO events (timestamp, type, source, severity, message, risk_score)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            datetime.now().isoformat(),
+    def _migrate_epoch_ms(self, conn):
+        """Миграция 0 → 1: TEXT ISO-метки времени в INTEGER epoch-ms (пересборка таблиц)"""
+        conn.create_function("legacy_ts", 1, _legacy_timestamp, deterministic=True)
+        for table, schema, columns in (
+            ("events", EVENTS_SCHEMA, "id, timestamp, type, source, severity, message, risk_score"),
+            ("incidents", INCIDENTS_SCHEMA, "id, timestamp, risk_score, event_data, status"),
+        ):
+            info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+            if not info or any(col[1] == "timestamp" and col[2].upper() == "INTEGER" for col in info):
+                continue
+            print(f"[i] Миграция {table}: метки времени в epoch-ms...")
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            conn.execute(schema.format(table=table))
+            select = columns.replace("timestamp", "legacy_ts(timestamp)", 1)
+            conn.execute(f"INSERT INTO {table} ({columns}) SELECT {select} FROM {table}_legacy")
+            conn.execute(f"DROP TABLE {table}_legacy")
+    
+    @staticmethod
+    def _narrow_listing_indexes(conn):
+        """Миграция 4 → 5: прежний индекс ленты копировал почти всю строку, не покрывая SELECT *"""
+        tables = ["events"] + [row[0] for row in conn.execute("SELECT name FROM event_partitions")]
+        for table in tables:
+            conn.execute(f"DROP INDEX IF EXISTS idx_{table}_listing")
+            conn.execute(EVENT_INDEXES[0].format(table=table))
+    
+    @staticmethod
+    def _add_ip_column(conn):
+        """Миграция 5 → 6: колонка ip в events и существующих партициях"""
+        tables = ["events"] + [row[0] for row in conn.execute("SELECT name FROM event_partitions")]
+        for table in tables:
+            if "ip" not in {col[1] for col in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN ip TEXT")
+    
+    def connection(self):
+        """Соединение из пула (контекстный менеджер)"""
+        return self.pool.connection()
+    
+    @contextmanager
+    def transaction(self):
+        """Соединение из пула внутри транзакции: commit при успехе, rollback при ошибке"""
+        with self.pool.connection() as conn:
+            with conn:
+                yield conn
+    
+    @contextmanager
+    def _write_transaction(self, deadline):
+        """
+        Транзакция записи, ждущая блокировку не дольше остатка общего срока deadline
+        (time.monotonic), а не полный busy_timeout соединения на каждую попытку
+        """
+        with self.pool.connection() as conn:
+            remaining_ms = max(1, int((deadline - time.monotonic()) * 1000))
+            conn.execute(f"PRAGMA busy_timeout = {remaining_ms}")
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.execute(f"PRAGMA busy_timeout = {int(self.pool.timeout * 1000)}")
+    
+    def fetch_all(self, query, params=()):
+        with self.pool.connection() as conn:
+            return conn.execute(query, params).fetchall()
+    
+    def fetch_one(self, query, params=()):
+        with self.pool.connection() as conn:
+            return conn.execute(query, params).fetchone()
+    
+    def close(self):
+        self.pool.close()
+    
+    @staticmethod
+    def _event_row(event_data, timestamp):
+        return (
+            timestamp,
             event_data.get('type', 'unknown'),
             event_data.get('source', 'unknown'),
             event_data.get('severity', 'low'),
             event_data.get('message', ''),
-            event_data.get('risk_score', 0)
-        ))
-        
-        conn.commit()
-        conn.close()
+            event_data.get('risk_score', 0),
+            event_data.get('ip')
+        )
     
-    def log_incident(self, incident_data):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO incidents (timestamp, risk_score, event_data)
-            VALUES (?, ?, ?)
-        ''', (
-            datetime.now().isoformat(),
+    @staticmethod
+    def _incident_row(incident_data, timestamp):
+        return (
+            timestamp,
             incident_data.get('risk_score', 0),
             str(incident_data)
-        ))
-        
-        conn.commit()
-        conn.close()
+        )
+    
+    def event_row(self, event_data, timestamp=None):
+        """Строка для вставки в events (время приёма фиксируется здесь)"""
+        return self._event_row(event_data, timestamp or now_ms())
+    
+    def incident_row(self, incident_data, timestamp=None):
+        """Строка для вставки в incidents"""
+        return self._incident_row(incident_data, timestamp or now_ms())
+    
+    def log_event(self, event_data):
+        self.insert_rows([self.event_row(event_data)])
+    
+    def log_incident(self, incident_data):
+        self.insert_rows([], [self.incident_row(incident_data)])
+    
+    def log_batch(self, events, incidents=()):
+        """Запись пачки событий и инцидентов одной транзакцией"""
+        now = now_ms()
+        self.insert_rows(
+            [self._event_row(e, now) for e in events],
+            [self._incident_row(i, now) for i in incidents],
+        )
+    
+    def add_write_observer(self, observer):
+        """Наблюдатель записи: observer(seconds, events, incidents) после каждого коммита"""
+        self._write_observers.append(observer)
+    
+    def add_invalidation_hook(self, hook):
+        """Хук сброса кэшей: hook("events") / hook("incidents") после записи соответствующих строк"""
+        self._invalidation_hooks.append(hook)
+    
+    def _count_contention(self, kind, retried):
+        with self._contention_lock:
+            self.contention[kind] += 1
+            self.contention["retries" if retried else "failures"] += 1
+    
+    def insert_rows(self, event_rows, incident_rows=()):
+        """
+        Вставка готовых строк (см. event_row/incident_row) и агрегатов одной транзакцией.
+        При занятой базе транзакция повторяется до busy_retries раз с растущей задержкой;
+        все попытки вместе укладываются в write_timeout секунд.
+        """
+        deadline = time.monotonic() + self.write_timeout
+        for attempt in range(self.busy_retries + 1):
+            start = time.perf_counter()
+            try:
+                created = self._insert(event_rows, incident_rows, deadline)
+            except sqlite3.OperationalError as e:
+                kind = contention_kind(e)
+                delay = DB_BUSY_BACKOFF_MS / 1000.0 * (2 ** attempt)
+                if kind is None or attempt == self.busy_retries or time.monotonic() + delay >= deadline:
+                    if kind is not None:
+                        self._count_contention(kind, retried=False)
+                    raise
+                self._count_contention(kind, retried=True)
+                # Откат мог отменить создание партиции — проверим заново
+                self._known_partitions.clear()
+                time.sleep(delay)
+                continue
+            break
+        elapsed = time.perf_counter() - start
+        for observer in self._write_observers:
+            observer(elapsed, len(event_rows), len(incident_rows))
+        for hook in self._invalidation_hooks:
+            if event_rows:
+                hook("events")
+            if incident_rows:
+                hook("incidents")
+        return created
+    
+    def _insert(self, event_rows, incident_rows, deadline):
+        with self._write_transaction(deadline) as conn:
+            created = False
+            routed = self._route_events(event_rows)
+            for table, rows in routed.items():
+                if table != "events":
+                    if table not in self._known_partitions:
+                        created |= self._ensure_partition(conn, *partition_bounds(rows[0][0], self.partition))
+                    conn.execute(SYNC_PARTITION_SEQ_SQL, (table,))
+                conn.executemany(INSERT_EVENT_TEMPLATE.format(table=table), rows)
+            conn.executemany(INSERT_INCIDENT_SQL, incident_rows)
+            self._update_stats(conn, routed, incident_rows)
+        return created
+    
+    def _route_events(self, event_rows):
+        """Раскладка строк событий по таблицам-партициям"""
+        if self.partition == "none":
+            return {"events": event_rows}
+        routed = {}
+        for row in event_rows:
+            name = partition_bounds(row[0], self.partition)[0]
+            routed.setdefault(name, []).append(row)
+        return routed
+    
+    def _ensure_partition(self, conn, name, start_ms, end_ms):
+        """Создание партиции с индексами и записью в каталоге; True, если она новая"""
+        conn.execute(EVENTS_SCHEMA.format(table=name))
+        for statement in EVENT_INDEXES:
+            conn.execute(statement.format(table=name))
+        created = conn.execute(
+            "INSERT OR IGNORE INTO event_partitions (name, start_ms, end_ms) VALUES (?, ?, ?)",
+            (name, start_ms, end_ms),
+        ).rowcount > 0
+        if created:
+            # Строка последовательности партиции; значение выставляет SYNC_PARTITION_SEQ_SQL
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, 0)", (name,))
+        self._known_partitions.add(name)
+        return created
+    
+    def partitions(self):
+        """Каталог партиций: [(name, start_ms, end_ms)] по возрастанию времени"""
+        return self.fetch_all("SELECT name, start_ms, end_ms FROM event_partitions ORDER BY start_ms")
+    
+    def apply_retention(self, days=None):
+        """
+        Удаление партиций старше срока хранения (дни); возвращает имена удалённых.
+        Вызывается из RetentionWorker или CLI (python database.py apply-retention), не из записи.
+        """
+        days = self.retention_days if days is None else days
+        if not days:
+            return []
+        return self.drop_partitions_before(now_ms() - days * DAY_MS)
+    
+    def drop_partitions_before(self, cutoff_ms):
+        """
+        Удаление партиций, целиком лежащих до cutoff_ms: DROP TABLE вместо построчного DELETE.
+        Агрегаты /api/stats уменьшаются на счётчики партиции из partition_stats — без сканирования.
+        """
+        dropped = []
+        with self.transaction() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = conn.execute(
+                "SELECT name, start_ms, end_ms FROM event_partitions WHERE end_ms <= ?", (cutoff_ms,)
+            ).fetchall()
+            for name, start_ms, end_ms in expired:
+                self._subtract_stats(conn, name, start_ms, end_ms)
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                conn.execute("DELETE FROM event_partitions WHERE name = ?", (name,))
+                dropped.append(name)
+        self._known_partitions.difference_update(dropped)
+        return dropped
+    
+    @staticmethod
+    def _subtract_stats(conn, table, start_ms, end_ms):
+        """Вычитание счётчиков партиции: число строк partition_stats ограничено числом severity/type"""
+        counters = conn.execute("SELECT name, value FROM partition_stats WHERE partition = ?", (table,)).fetchall()
+        conn.executemany(UPSERT_COUNTER_SQL, [(name, -value) for name, value in counters])
+        conn.executemany(
+            "DELETE FROM stats_counters WHERE name = ? AND value = 0",
+            [(name,) for name, _ in counters if ":" in name],
+        )
+        conn.execute("DELETE FROM partition_stats WHERE partition = ?", (table,))
+        minutes = (start_ms // 60000, end_ms // 60000)
+        conn.execute(
+            "UPDATE stats_minutes SET events = 0, risk_sum = 0, risk_count = 0 WHERE minute >= ? AND minute < ?",
+            minutes,
+        )
+        conn.execute("DELETE FROM stats_minutes WHERE minute >= ? AND minute < ? AND incidents = 0", minutes)
+    
+    def set_stats_labels(self, severities=None, types=None):
+        """Допустимые значения severity/type в агрегатах; None — оставить прежние"""
+        labels = dict(self.stats_labels)
+        if severities is not None:
+            labels["severity"] = frozenset(severities)
+        if types is not None:
+            labels["type"] = frozenset(types)
+        self.stats_labels = labels
+    
+    def _stats_label(self, kind, value):
+        """Метка агрегата: известное значение или "other" (также SQL-функция stats_label)"""
+        return value if value in self.stats_labels[kind] else "other"
+    
+    def _event_counters(self, event_rows, minutes):
+        """Счётчики по строкам событий; поминутные корзины накапливаются в minutes"""
+        counters = {}
+        severities, types = self.stats_labels["severity"], self.stats_labels["type"]
+        for timestamp, event_type, _source, severity, _message, risk_score, _ip in event_rows:
+            bucket = minutes.setdefault(timestamp // 60000, [0, 0, 0, 0])
+            bucket[0] += 1
+            severity = severity if severity in severities else "other"
+            event_type = event_type if event_type in types else "other"
+            counters["events"] = counters.get("events", 0) + 1
+            counters[f"severity:{severity}"] = counters.get(f"severity:{severity}", 0) + 1
+            counters[f"type:{event_type}"] = counters.get(f"type:{event_type}", 0) + 1
+            if risk_score and risk_score > 0:
+                bucket[2] += risk_score
+                bucket[3] += 1
+                counters["risk_sum"] = counters.get("risk_sum", 0) + risk_score
+                counters["risk_count"] = counters.get("risk_count", 0) + 1
+        return counters
+    
+    def _update_stats(self, conn, routed, incident_rows):
+        """Инкремент агрегатов по вставленным строкам (пачка сворачивается заранее); routed — см. _route_events"""
+        counters = {}
+        minutes = {}
+        for table, rows in routed.items():
+            table_counters = self._event_counters(rows, minutes)
+            for name, value in table_counters.items():
+                counters[name] = counters.get(name, 0) + value
+            if table != "events":
+                conn.executemany(UPSERT_PARTITION_STAT_SQL, [(table, *item) for item in table_counters.items()])
+        for timestamp, _risk_score, _data in incident_rows:
+            minutes.setdefault(timestamp // 60000, [0, 0, 0, 0])[1] += 1
+            counters["incidents"] = counters.get("incidents", 0) + 1
+        conn.executemany(UPSERT_COUNTER_SQL, counters.items())
+        conn.executemany(UPSERT_MINUTE_SQL, [(minute, *bucket) for minute, bucket in minutes.items()])
+    
+    def _rebuild_stats(self, conn):
+        """Пересчёт агрегатов по сырым событиям (все партиции) и инцидентам"""
+        conn.create_function("stats_label", 2, self._stats_label)
+        tables = ["events"] + [row[0] for row in conn.execute("SELECT name FROM event_partitions")]
+        events = "(" + " UNION ALL ".join(
+            f"SELECT timestamp, type, severity, risk_score FROM {table}" for table in tables
+        ) + ")"
+        conn.execute("DELETE FROM stats_counters")
+        conn.execute("DELETE FROM stats_minutes")
+        conn.execute("DELETE FROM partition_stats")
+        for table in tables[1:]:
+            self._rebuild_partition_stats(conn, table)
+        conn.execute(f'''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'events', COUNT(*) FROM {events}
+            UNION ALL SELECT 'incidents', COUNT(*) FROM incidents
+            UNION ALL SELECT 'risk_sum', COALESCE(SUM(risk_score), 0) FROM {events} WHERE risk_score > 0
+            UNION ALL SELECT 'risk_count', COUNT(*) FROM {events} WHERE risk_score > 0
+        ''')
+        conn.execute(f'''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'severity:' || stats_label('severity', severity), COUNT(*) FROM {events}
+            GROUP BY stats_label('severity', severity)
+            UNION ALL SELECT 'type:' || stats_label('type', type), COUNT(*) FROM {events}
+            GROUP BY stats_label('type', type)
+        ''')
+        conn.execute(f'''
+            INSERT INTO stats_minutes (minute, events, risk_sum, risk_count)
+            SELECT timestamp / 60000, COUNT(*),
+                   SUM(CASE WHEN risk_score > 0 THEN risk_score ELSE 0 END),
+                   SUM(risk_score > 0)
+            FROM {events} GROUP BY timestamp / 60000
+        ''')
+        conn.execute('''
+            INSERT INTO stats_minutes (minute, incidents)
+            SELECT timestamp / 60000, COUNT(*) FROM incidents WHERE true GROUP BY timestamp / 60000
+            ON CONFLICT(minute) DO UPDATE SET incidents = excluded.incidents
+        ''')
+    
+    def _rebuild_partition_stats(self, conn, table):
+        """Счётчики одной партиции по её строкам (миграция и rebuild_stats)"""
+        conn.create_function("stats_label", 2, self._stats_label)
+        conn.execute("DELETE FROM partition_stats WHERE partition = ?", (table,))
+        conn.execute(f'''
+            INSERT INTO partition_stats (partition, name, value)
+            SELECT ?, 'events', COUNT(*) FROM {table}
+            UNION ALL SELECT ?, 'risk_sum', COALESCE(SUM(risk_score), 0) FROM {table} WHERE risk_score > 0
+            UNION ALL SELECT ?, 'risk_count', COUNT(*) FROM {table} WHERE risk_score > 0
+            UNION ALL SELECT ?, 'severity:' || stats_label('severity', severity), COUNT(*) FROM {table}
+            GROUP BY stats_label('severity', severity)
+            UNION ALL SELECT ?, 'type:' || stats_label('type', type), COUNT(*) FROM {table}
+            GROUP BY stats_label('type', type)
+        ''', (table,) * 5)
+    
+    def rebuild_stats(self):
+        """Полный пересчёт агрегатов /api/stats из сырых данных"""
+        with self.transaction() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._rebuild_stats(conn)
+    
+    def get_stats(self, minutes=0):
+        """Статистика из агрегатов за O(1); minutes > 0 — ещё и поминутная динамика"""
+        with self.pool.connection() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM stats_counters").fetchall())
+            timeline = []
+            if minutes > 0:
+                since = now_ms() // 60000 - minutes + 1
+                timeline = [
+                    {"minute": minute * 60000, "events": events, "incidents": incidents,
+                     "average_risk_score": round(risk_sum / risk_count, 2) if risk_count else 0}
+                    for minute, events, incidents, risk_sum, risk_count in conn.execute(
+                        "SELECT * FROM stats_minutes WHERE minute >= ? ORDER BY minute", (since,)
+                    )
+                ]
+        risk_count = counters.get("risk_count", 0)
+        stats = {
+            "total_events": counters.get("events", 0),
+            "total_incidents": counters.get("incidents", 0),
+            "average_risk_score": round(counters.get("risk_sum", 0) / risk_count, 2) if risk_count else 0,
+            "by_severity": {k.split(":", 1)[1]: v for k, v in counters.items() if k.startswith("severity:")},
+            "by_type": {k.split(":", 1)[1]: v for k, v in counters.items() if k.startswith("type:")},
+        }
+        if minutes > 0:
+            stats["per_minute"] = timeline
+        return stats
+
+    @staticmethod
+    def _time_filters(start_ms, end_ms):
+        clauses, params = [], []
+        if start_ms is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start_ms)
+        if end_ms is not None:
+            clauses.append("timestamp < ?")
+            params.append(end_ms)
+        return clauses, params
+    
+    @staticmethod
+    def _keyset_filter(clauses, params, before):
+        """Keyset-пагинация: строки строго после курсора (timestamp, id) в порядке DESC"""
+        if before is not None:
+            clauses.append("(timestamp, id) < (?, ?)")
+            params.extend(before)
+    
+    def _event_sources(self, conn, start_ms=None, end_ms=None):
+        """
+        Таблицы событий, пересекающие [start_ms, end_ms): [(name, lo, hi)] по убыванию времени.
+        Непартиционированная events участвует с фактическим диапазоном своих меток.
+        """
+        sources = []
+        lo, hi = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM events").fetchone()
+        if lo is not None:
+            sources.append(("events", lo, hi + 1))
+        sources.extend(conn.execute("SELECT name, start_ms, end_ms FROM event_partitions").fetchall())
+        sources = [
+            source for source in sources
+            if (start_ms is None or source[2] > start_ms) and (end_ms is None or source[1] < end_ms)
+        ]
+        sources.sort(key=lambda source: (source[2], source[1]), reverse=True)
+        return sources
+    
+    @staticmethod
+    def _select_events(conn, sources, where, params, order, limit):
+        """
+        Выборка по нескольким таблицам событий. Непересекающиеся по времени партиции
+        читаются по очереди до набора limit; при пересечении — слияние через UNION ALL.
+        """
+        disjoint = all(newer[1] >= older[2] for newer, older in zip(sources, sources[1:]))
+        if disjoint:
+            ordered = sources if "DESC" in order else sources[::-1]
+            rows = []
+            for name, _, _ in ordered:
+                rows.extend(conn.execute(
+                    SELECT_PAGE_TEMPLATE.format(table=name, where=where, order=order),
+                    (*params, limit - len(rows)),
+                ).fetchall())
+                if len(rows) >= limit:
+                    break
+            return rows
+        branches = " UNION ALL ".join(
+            f"SELECT * FROM ({SELECT_PAGE_TEMPLATE.format(table=name, where=where, order=order)})"
+            for name, _, _ in sources
+        )
+        return conn.execute(
+            f"SELECT * FROM ({branches}) ORDER BY {order} LIMIT ?",
+            (*[value for _ in sources for value in (*params, limit)], limit),
+        ).fetchall()
+    
+    def query_events(self, start_ms=None, end_ms=None, severity=None, event_type=None,
+                     source=None, limit=100, before=None):
+        """События за [start_ms, end_ms) с фильтрами, новые первыми; before — курсор (timestamp, id)"""
+        clauses, params = self._time_filters(start_ms, end_ms)
+        for column, value in (("severity", severity), ("type", event_type), ("source", source)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        self._keyset_filter(clauses, params, before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.pool.connection() as conn:
+            sources = self._event_sources(conn, start_ms, end_ms)
+            if before is not None:
+                sources = [s for s in sources if s[1] <= before[0]]
+            return self._select_events(conn, sources, where, params, "timestamp DESC, id DESC", limit)
+    
+    EVENT_COLUMNS = ("id", "timestamp", "type", "source", "severity", "message", "risk_score", "ip")
+    
+    def iter_events(self, start_ms=None, end_ms=None, severity=None, event_type=None,
+                    batch_size=1000):
+        """
+        Потоковая выборка событий по возрастанию (timestamp, id) для выгрузки.
+        Читает короткими keyset-запросами по batch_size строк: память постоянна,
+        соединение не удерживается между пачками и не тормозит checkpoint WAL.
+        """
+        after = None
+        while True:
+            clauses, params = self._time_filters(start_ms, end_ms)
+            for column, value in (("severity", severity), ("type", event_type)):
+                if value is not None:
+                    clauses.append(f"{column} = ?")
+                    params.append(value)
+            if after is not None:
+                clauses.append("(timestamp, id) > (?, ?)")
+                params.extend(after)
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            with self.pool.connection() as conn:
+                sources = self._event_sources(conn, after[0] if after else start_ms, end_ms)
+                rows = self._select_events(conn, sources, where, params, "timestamp, id", batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][1], rows[-1][0])
+    
+    def query_incidents(self, start_ms=None, end_ms=None, limit=50, before=None):
+        """Инциденты за [start_ms, end_ms), новые первыми; before — курсор (timestamp, id)"""
+        clauses, params = self._time_filters(start_ms, end_ms)
+        self._keyset_filter(clauses, params, before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.fetch_all(
+            f"SELECT * FROM incidents {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (*params, limit),
+        )
+
+class RetentionWorker:
+    """
+    Фоновое применение срока хранения (DB_RETENTION_DAYS) раз в interval секунд —
+    вне пути записи: удаление партиций не задерживает приём событий.
+    """
+
+    def __init__(self, database, interval=DB_RETENTION_INTERVAL):
+        self.database = database
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        try:
+            dropped = self.database.apply_retention()
+        except sqlite3.Error as e:
+            print(f"[!] Срок хранения не применён: {e}")
+            return []
+        if dropped:
+            print(f"[i] Удалены партиции по сроку хранения: {dropped}")
+        return dropped
+
+    def _run(self):
+        self.run_once()
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+
+class AsyncDatabase:
+    """
+    asyncio-доступ к Database без блокировки цикла событий.
+    Запись идёт через один выделенный поток (его очередь сериализует транзакции
+    и снимает конкуренцию за блокировку SQLite), чтение — через пул потоков
+    размером с пул соединений.
+    """
+    def __init__(self, database):
+        self.db = database
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=database.pool.size, thread_name_prefix="db-reader")
+    
+    async def _run(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    
+    async def log_batch(self, events, incidents=()):
+        return await self._run(self._writer, self.db.log_batch, events, incidents)
+    
+    async def insert_rows(self, event_rows, incident_rows=()):
+        return await self._run(self._writer, self.db.insert_rows, event_rows, incident_rows)
+    
+    async def query_events(self, **filters):
+        return await self._run(self._readers, self.db.query_events, **filters)
+    
+    async def query_incidents(self, **filters):
+        return await self._run(self._readers, self.db.query_incidents, **filters)
+    
+    async def get_stats(self, minutes=0):
+        return await self._run(self._readers, self.db.get_stats, minutes)
+    
+    async def partitions(self):
+        return await self._run(self._readers, self.db.partitions)
+    
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
 
 # Global instance
-db = Database()
\ No newline at end of file
+db = Database()
+async_db = AsyncDatabase(db)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Обслуживание базы Cyber Security Laboratory")
+    parser.add_argument("command", choices=["rebuild-stats", "apply-retention"])
+    parser.add_argument("--db", default=db.db_path, help="путь к базе (по умолчанию cyberlab.db)")
+    parser.add_argument("--days", type=int, default=db.retention_days, help="срок хранения партиций, дней")
+    args = parser.parse_args()
+
+    target = db if args.db == db.db_path else Database(args.db)
+    if args.command == "rebuild-stats":
+        target.rebuild_stats()
+        print(f"✅ Агрегаты пересчитаны: {target.get_stats()}")
+    elif args.command == "apply-retention":
+        dropped = target.apply_retention(args.days)
+        print(f"✅ Удалено партиций: {len(dropped)} {dropped}")
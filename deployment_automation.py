@@ -38,6 +38,7 @@ class DeploymentManager:
                 "director_system.db", 
                 "general_system.db",
                 "enhanced_security.py",
+                "password_hashing.py",
                 "simple_director_server.py"
             ]
             
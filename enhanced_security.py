@@ -1,19 +1,86 @@
 """
 Усиленная система безопасности с многофакторной аутентификацией
 """
-import hashlib
 import secrets
 import time
 import json
 import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import base64
+from password_hashing import HashingOverloadedError, PasswordHashingService, legacy_hash
+
+class SessionCache:
+    """
+    Кэш проверенных сессий: LRU на max_entries токенов.
+    Запись живёт не дольше ttl секунд и не дольше expires_at самой сессии;
+    неизвестные и неактивные токены кэшируются как None на negative_ttl.
+    """
+    
+    def __init__(self, max_entries=10000, ttl=60.0, negative_ttl=5.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "flushes": 0}
+    
+    def get(self, token):
+        """(найдено, данные сессии или None)"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= self.clock():
+                if entry is not None:
+                    del self._entries[token]
+                self.stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(token)
+            self.stats["hits" if entry[0] is not None else "negative_hits"] += 1
+            return True, entry[0]
+    
+    def put(self, token, session, expires_in=None):
+        """Положительная запись с TTL, урезанным до expires_in; session=None — отрицательная"""
+        ttl = self.ttl if session is not None else self.negative_ttl
+        if expires_in is not None:
+            ttl = min(ttl, expires_in)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (session, self.clock() + ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+    
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats["flushes"] += 1
+    
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries)}
 
 class EnhancedSecurity:
-    def __init__(self):
+    def __init__(self, session_cache_size=10000, session_cache_ttl=60.0, negative_ttl=5.0, version_check_interval=1.0,
+                 hash_workers=2, hash_queue=64, hash_per_ip=4):
+        # Проверка паролей — в отдельном пуле с ограниченной очередью, не в потоке запроса
+        self.password_hasher = PasswordHashingService(hash_workers, hash_queue, hash_per_ip)
+        # Проверенные сессии кэшируются в процессе; версия в session_version
+        # (меняется при каждой инвалидации) опрашивается не чаще version_check_interval
+        self.session_cache = SessionCache(session_cache_size, session_cache_ttl, negative_ttl)
+        self.version_check_interval = version_check_interval
+        self._session_version = None
+        self._version_checked_at = 0.0
         self.setup_database()
         self.cipher = self._init_encryption()
         self.failed_attempts = {}
@@ -79,8 +146,22 @@ class EnhancedSecurity:
         # Создание администратора по умолчанию
         self._create_default_admin()
         
+        # Версия сессий: растёт при каждой инвалидации, по ней процессы сбрасывают кэш
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS session_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO session_version (id, version) VALUES (1, 0)")
+        
         conn.commit()
         conn.close()
+        
+        # База могла быть пересоздана — кэш сессий больше не соответствует ей
+        self.session_cache.clear()
+        self._session_version = None
+        self._version_checked_at = 0.0
     
     def _create_default_admin(self):
         """Создание администратора по умолчанию"""
@@ -89,21 +170,21 @@ class EnhancedSecurity:
         
         cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'director'")
         if cursor.fetchone()[0] == 0:
-            salt = secrets.token_hex(32)
-            password_hash = self._hash_password("admin2024", salt)
+            # Сразу текущая схема: соль и параметры в самом хеше, миграция при входе не нужна
+            password_hash = self.password_hasher.hash("admin2024")
             mfa_secret = secrets.token_hex(16)
             
             cursor.execute('''
                 INSERT INTO users (username, password_hash, salt, role, mfa_secret, created_at)
                 VALUES (?, ?, ?, ?, ?, ?)
-            ''', ("director", password_hash, salt, "admin", mfa_secret, datetime.now().isoformat()))
+            ''', ("director", password_hash, None, "admin", mfa_secret, datetime.now().isoformat()))
         
         conn.commit()
         conn.close()
     
     def _hash_password(self, password, salt):
-        """Хеширование пароля"""
-        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000).hex()
+        """Хеширование пароля в прежнем формате PBKDF2 (для совместимости; новые хеши — password_hasher)"""
+        return legacy_hash(password, salt)
     
     def authenticate(self, username, password, ip_address, user_agent):
         """Аутентификация пользователя"""
@@ -130,18 +211,26 @@ class EnhancedSecurity:
             return {"success": False, "error": "Invalid credentials"}
         
         user_id, stored_hash, salt, role, failed_attempts = user
-        password_hash = self._hash_password(password, salt)
+        try:
+            valid, upgraded_hash = self.password_hasher.verify(password, stored_hash, salt, ip_address)
+        except HashingOverloadedError as e:
+            conn.close()
+            self.log_audit(user_id, "login_throttled", "authentication", ip_address, user_agent, False, str(e))
+            return {"success": False, "error": "Too many requests"}
         
-        if password_hash == stored_hash:
+        if valid:
             # Успешная аутентификация
             session_token = self._create_session(user_id, ip_address)
             cursor.execute("UPDATE users SET last_login = ?, failed_attempts = 0 WHERE id = ?", 
                          (datetime.now().isoformat(), user_id))
-            
-            self.log_audit(user_id, "login_success", "authentication", ip_address, user_agent, True, "Successful login")
+            if upgraded_hash:
+                # Пароль пересчитан в текущей схеме; соль хранится в самом хеше
+                cursor.execute("UPDATE users SET password_hash = ?, salt = NULL WHERE id = ?", (upgraded_hash, user_id))
             conn.commit()
             conn.close()
             
+            self.log_audit(user_id, "login_success", "authentication", ip_address, user_agent, True, "Successful login")
+            
             return {
                 "success": True, 
                 "session_token": session_token,
@@ -159,11 +248,11 @@ class EnhancedSecurity:
             
             cursor.execute("UPDATE users SET failed_attempts = ?, locked_until = ? WHERE id = ?", 
                          (failed_attempts, locked_until, user_id))
-            
-            self.log_audit(user_id, "login_failed", "authentication", ip_address, user_agent, False, f"Failed attempt {failed_attempts}")
             conn.commit()
             conn.close()
             
+            self.log_audit(user_id, "login_failed", "authentication", ip_address, user_agent, False, f"Failed attempt {failed_attempts}")
+            
             return {"success": False, "error": "Invalid credentials"}
     
     def _create_session(self, user_id, ip_address):
@@ -182,10 +271,31 @@ class EnhancedSecurity:
         conn.commit()
         conn.close()
         
+        self.session_cache.discard(session_token)
         return session_token
     
+    def _check_session_version(self):
+        """Сброс кэша, если другой процесс инвалидировал сессии; опрос не чаще version_check_interval"""
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        conn = sqlite3.connect('security.db')
+        try:
+            version = conn.execute("SELECT version FROM session_version WHERE id = 1").fetchone()[0]
+        finally:
+            conn.close()
+        if version != self._session_version:
+            self.session_cache.clear()
+            self._session_version = version
+        self._version_checked_at = now
+    
     def validate_session(self, session_token):
-        """Валидация сессии"""
+        """Валидация сессии; в установившемся режиме — поиск в кэше без обращения к БД"""
+        self._check_session_version()
+        found, session = self.session_cache.get(session_token)
+        if found:
+            return dict(session) if session is not None else None
+        
         conn = sqlite3.connect('security.db')
         cursor = conn.cursor()
         
@@ -200,22 +310,37 @@ class EnhancedSecurity:
         conn.close()
         
         if not result:
+            self.session_cache.put(session_token, None)
             return None
         
         user_id, expires_at, username, role = result
-        if datetime.now() > datetime.fromisoformat(expires_at):
+        expires_in = (datetime.fromisoformat(expires_at) - datetime.now()).total_seconds()
+        if expires_in < 0:
             self._invalidate_session(session_token)
             return None
         
-        return {"user_id": user_id, "username": username, "role": role}
+        session = {"user_id": user_id, "username": username, "role": role}
+        self.session_cache.put(session_token, session, expires_in)
+        return dict(session)
     
     def _invalidate_session(self, session_token):
-        """Инвалидация сессии"""
+        """Инвалидация сессии; версия в session_version сообщает о ней остальным процессам"""
         conn = sqlite3.connect('security.db')
         cursor = conn.cursor()
         cursor.execute("UPDATE sessions SET active = 0 WHERE session_token = ?", (session_token,))
+        cursor.execute("UPDATE session_version SET version = version + 1 WHERE id = 1")
+        cursor.execute("SELECT version FROM session_version WHERE id = 1")
+        version = cursor.fetchone()[0]
         conn.commit()
         conn.close()
+        
+        self.session_cache.put(session_token, None)
+        if self._session_version is not None and version == self._session_version + 1:
+            # Только наша инвалидация — остальной кэш актуален
+            self._session_version = version
+        else:
+            self.session_cache.clear()
+            self._session_version = version
     
     def encrypt_data(self, data):
         """Шифрование данных"""
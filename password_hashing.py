@@ -0,0 +1,212 @@
+"""
+Сервис хеширования паролей с ограниченной стоимостью.
+Медленные KDF считаются фиксированным пулом потоков (hashlib отпускает GIL),
+очередь ограничена по размеру и по числу заданий с одного IP, IP-адреса
+обслуживаются по кругу — всплеск подбора паролей с нескольких адресов не
+занимает воркеры веб-сервера и не вытесняет остальных пользователей.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+try:
+    import argon2
+except ImportError:  # без argon2-cffi используется scrypt из hashlib
+    argon2 = None
+
+# Прежний формат: hex PBKDF2-SHA256, соль в отдельной колонке users.salt
+LEGACY_ITERATIONS = 100000
+SCRYPT_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1}
+
+class HashingOverloadedError(Exception):
+    """Очередь хеширования переполнена (в целом или для одного IP)"""
+
+def legacy_hash(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), LEGACY_ITERATIONS).hex()
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+def preferred_scheme():
+    if argon2 is not None:
+        return "argon2"
+    return "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2"
+
+def scheme_of(stored_hash):
+    if stored_hash.startswith("$argon2"):
+        return "argon2"
+    if stored_hash.startswith("scrypt$"):
+        return "scrypt"
+    return "pbkdf2"
+
+def hash_password(password, scheme=None):
+    """Хеш в текущем формате; соль и параметры хранятся в самой строке"""
+    scheme = scheme or preferred_scheme()
+    if scheme == "argon2":
+        return argon2.PasswordHasher().hash(password)
+    if scheme == "scrypt":
+        salt = secrets.token_bytes(16)
+        digest = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+        return "scrypt${n}${r}${p}$".format(**SCRYPT_PARAMS) + f"{_b64(salt)}${_b64(digest)}"
+    raise ValueError(f"схема {scheme!r} доступна только для проверки старых хешей")
+
+def verify_password(password, stored_hash, salt=None):
+    """Проверка с постоянным временем сравнения"""
+    scheme = scheme_of(stored_hash)
+    if scheme == "argon2":
+        if argon2 is None:
+            return False
+        try:
+            return argon2.PasswordHasher().verify(stored_hash, password)
+        except argon2.exceptions.VerificationError:
+            return False
+    if scheme == "scrypt":
+        _, n, r, p, salt_b64, digest_b64 = stored_hash.split("$")
+        expected = _unb64(digest_b64)
+        digest = hashlib.scrypt(password.encode(), salt=_unb64(salt_b64), n=int(n), r=int(r), p=int(p),
+                                dklen=len(expected))
+        return hmac.compare_digest(digest, expected)
+    return hmac.compare_digest(legacy_hash(password, salt or ""), stored_hash)
+
+def needs_rehash(stored_hash):
+    """Хеш не в предпочтительной схеме или с устаревшими параметрами"""
+    scheme = scheme_of(stored_hash)
+    if scheme != preferred_scheme():
+        return True
+    if scheme == "argon2":
+        return argon2.PasswordHasher().check_needs_rehash(stored_hash)
+    if scheme == "scrypt":
+        n, r, p = stored_hash.split("$")[1:4]
+        return (int(n), int(r), int(p)) != (SCRYPT_PARAMS["n"], SCRYPT_PARAMS["r"], SCRYPT_PARAMS["p"])
+    return False
+
+class _Latency:
+    """Последние window замеров (мс) для перцентилей"""
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.samples.append(seconds * 1000)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"count": 0}
+
+        def pick(q):
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+        return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+                "max_ms": round(ordered[-1], 3)}
+
+class PasswordHashingService:
+    """
+    Пул из workers потоков и очередь не длиннее max_queue заданий, из них
+    не больше per_ip_limit от одного IP; сверх лимита — HashingOverloadedError сразу,
+    без ожидания. Очереди IP обслуживаются по кругу.
+    verify возвращает (совпал, новый_хеш или None): новый хеш — пароль
+    пересчитан в предпочтительной схеме, его нужно сохранить.
+    """
+
+    def __init__(self, workers=2, max_queue=64, per_ip_limit=4, timeout=10.0):
+        self.max_queue = max_queue
+        self.per_ip_limit = per_ip_limit
+        self.timeout = timeout
+        self._queues = OrderedDict()  # ip -> deque заданий; порядок — очередь обхода
+        self._queued = 0
+        self._cond = threading.Condition()
+        self.wait_latency = _Latency()
+        self.hash_latency = _Latency()
+        self.stats = {"completed": 0, "rejected_queue": 0, "rejected_ip": 0, "rehashed": 0, "timeouts": 0}
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"password-hash-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, ip, func, *args):
+        """Future с результатом func(*args), посчитанным в пуле"""
+        ip = ip or "unknown"
+        future = Future()
+        with self._cond:
+            if self._queued >= self.max_queue:
+                self.stats["rejected_queue"] += 1
+                raise HashingOverloadedError("очередь хеширования переполнена")
+            queue = self._queues.get(ip)
+            if queue is not None and len(queue) >= self.per_ip_limit:
+                self.stats["rejected_ip"] += 1
+                raise HashingOverloadedError(f"слишком много попыток входа с {ip}")
+            if queue is None:
+                queue = self._queues[ip] = deque()
+            queue.append((future, func, args, time.perf_counter()))
+            self._queued += 1
+            self._cond.notify()
+        return future
+
+    def _next_job(self):
+        with self._cond:
+            while not self._queued:
+                self._cond.wait()
+            ip, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            self._queued -= 1
+            # Круговой обход: IP уходит в конец, пустая очередь удаляется
+            if queue:
+                self._queues.move_to_end(ip)
+            else:
+                del self._queues[ip]
+            return job
+
+    def _worker(self):
+        while True:
+            future, func, args, queued_at = self._next_job()
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            self.wait_latency.add(started - queued_at)
+            try:
+                future.set_result(func(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            finally:
+                self.hash_latency.add(time.perf_counter() - started)
+                with self._cond:
+                    self.stats["completed"] += 1
+
+    def _result(self, future):
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._cond:
+                self.stats["timeouts"] += 1
+            raise HashingOverloadedError("хеширование не уложилось в таймаут")
+
+    def hash(self, password, ip=None):
+        return self._result(self.submit(ip, hash_password, password))
+
+    def verify(self, password, stored_hash, salt=None, ip=None):
+        return self._result(self.submit(ip, self._verify_and_upgrade, password, stored_hash, salt))
+
+    def _verify_and_upgrade(self, password, stored_hash, salt):
+        if not verify_password(password, stored_hash, salt):
+            return False, None
+        if not needs_rehash(stored_hash):
+            return True, None
+        with self._cond:
+            self.stats["rehashed"] += 1
+        return True, hash_password(password)
+
+    def metrics(self):
+        with self._cond:
+            stats = {**self.stats, "queued": self._queued, "queued_ips": len(self._queues),
+                     "workers": len(self._workers)}
+        return {**stats, "queue_wait": self.wait_latency.summary(), "hashing": self.hash_latency.summary()}
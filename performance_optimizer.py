@@ -5,32 +5,837 @@ import sqlite3
 import json
 import time
 import threading
-from datetime import datetime, timedelta
+import atexit
+import cProfile
+import io
+import pickle
+import pstats
+import random
+import re
+import tracemalloc
+from collections import Counter
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from functools import wraps
 import hashlib
 
-class PerformanceOptimizer:
+try:
+    import msgpack
+except ImportError:  # кодек msgpack доступен только при установленном пакете
+    msgpack = None
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в духе HDR: логарифмические корзины по 2**SUB_BITS
+    на октаву (погрешность квантилей ~12%), запись O(1), память — только
+    занятые корзины. Значения в наносекундах.
+    """
+    SUB_BITS = 3
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    @classmethod
+    def bucket_of(cls, value_ns):
+        exp = value_ns.bit_length() - 1
+        if exp < cls.SUB_BITS:
+            return value_ns
+        return ((exp - cls.SUB_BITS + 1) << cls.SUB_BITS) + (value_ns >> (exp - cls.SUB_BITS)) - (1 << cls.SUB_BITS)
+
+    @classmethod
+    def bucket_value(cls, index):
+        """Середина корзины в наносекундах"""
+        block = index >> cls.SUB_BITS
+        if block == 0:
+            return index
+        low = ((1 << cls.SUB_BITS) + (index & ((1 << cls.SUB_BITS) - 1))) << (block - 1)
+        return low + ((1 << (block - 1)) >> 1)
+
+    def record(self, value_ns):
+        index = self.bucket_of(max(1, value_ns))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_ns += value_ns
+        if self.min_ns is None or value_ns < self.min_ns:
+            self.min_ns = value_ns
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * p / 100.0))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        """Сводка в миллисекундах"""
+        ms = 1e-6
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ns / self.count * ms, 3) if self.count else 0,
+            "p50_ms": round(self.percentile(50) * ms, 3),
+            "p95_ms": round(self.percentile(95) * ms, 3),
+            "p99_ms": round(self.percentile(99) * ms, 3),
+            "max_ms": round(self.max_ns * ms, 3),
+        }
+
+class MemoryCacheTier:
+    """
+    Ограниченный LRU-кэш в памяти с TTL на запись.
+    Лимиты — по числу записей и по суммарному размеру (байты сериализованного
+    значения); просроченные записи удаляются лениво при обращении, а записи
+    с stale_ttl ещё столько же секунд доступны через get_stale.
+    Потокобезопасен: cache_result вызывается из рабочих потоков Flask/uvicorn.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> [value, expires_at, size, access_count, stale_until] (monotonic)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "rejected": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+        return entry
+
+    def get(self, key, count=True):
+        """Значение или None (нет записи или она просрочена)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count:
+                    self.stats["misses"] += 1
+                return None
+            now = time.monotonic()
+            if now >= entry[1]:
+                # Устаревшее значение ещё может пригодиться для stale-while-revalidate
+                if now >= entry[4]:
+                    self._remove(key)
+                    self.stats["expirations"] += 1
+                if count:
+                    self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            entry[3] += 1
+            if count:
+                self.stats["hits"] += 1
+            return entry[0]
+
+    def get_stale(self, key):
+        """Просроченное, но ещё не вышедшее из окна stale_ttl значение, иначе None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry[1] <= time.monotonic() < entry[4]:
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl, size=0, access_count=1, stale_ttl=0):
+        """Запись с вытеснением самых давних по использованию сверх лимитов"""
+        if size > self.max_bytes:
+            with self._lock:
+                self.stats["rejected"] += 1
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expires_at = time.monotonic() + ttl
+            self._entries[key] = [value, expires_at, size, access_count, expires_at + stale_ttl]
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def purge_expired(self):
+        """Полный проход по просроченным записям; возвращает число удалённых"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if now >= entry[4]]
+            for key in expired:
+                self._remove(key)
+            self.stats["expirations"] += len(expired)
+        return len(expired)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+def _canonical(obj):
+    """Каноническая строка значения: не зависит от порядка ключей/элементов множеств и от PYTHONHASHSEED"""
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        return f"{type(obj).__name__}:{obj!r}"
+    if isinstance(obj, (list, tuple)):
+        return f"{type(obj).__name__}[" + ",".join(_canonical(x) for x in obj) + "]"
+    if isinstance(obj, dict):
+        items = sorted((_canonical(k), _canonical(v)) for k, v in obj.items())
+        return "dict{" + ",".join(f"{k}={v}" for k, v in items) + "}"
+    if isinstance(obj, (set, frozenset)):
+        return "set{" + ",".join(sorted(_canonical(x) for x in obj)) + "}"
+    return f"{type(obj).__qualname__}:{obj!r}"
+
+def stable_key_digest(obj):
+    """Устойчивый между процессами хэш ключа (для L2 и нехэшируемых аргументов)"""
+    return hashlib.blake2b(_canonical(obj).encode(), digest_size=16).hexdigest()
+
+def tuple_key_builder(func_name, args, kwargs):
+    """
+    Ключ по умолчанию: кортеж (имя, args, kwargs) — без форматирования и хэширования
+    строк. Если аргументы нехэшируемы (dict, list...), ключ — stable_key_digest.
+    Как и в functools.lru_cache, 1 и 1.0 дают один ключ.
+    """
+    key = (func_name, args, tuple(sorted(kwargs.items())) if kwargs else ())
+    try:
+        hash(key)
+    except TypeError:
+        return stable_key_digest(key)
+    return key
+
+class JsonCodec:
+    name = "json"
+
+    @staticmethod
+    def encode(value):
+        return json.dumps(value).encode()
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data)
+
+class PickleCodec:
+    """
+    pickle protocol 5; только по явному выбору (cache_result(codec="pickle")) и для
+    доверенного файла кэша: запись в performance.db означает выполнение кода при чтении
+    """
+    name = "pickle"
+
+    @staticmethod
+    def encode(value):
+        return pickle.dumps(value, protocol=5)
+
+    @staticmethod
+    def decode(data):
+        return pickle.loads(data)
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    @staticmethod
+    def encode(value):
+        if msgpack is None:
+            raise RuntimeError("msgpack не установлен")
+        return msgpack.packb(value, use_bin_type=True)
+
+    @staticmethod
+    def decode(data):
+        if msgpack is None:
+            raise RuntimeError("msgpack не установлен")
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+class RawCodec:
+    """Готовые байты без преобразования"""
+    name = "raw"
+
+    @staticmethod
+    def encode(value):
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            raise TypeError(f"raw-кодек принимает только байты, получено {type(value).__name__}")
+        return bytes(value)
+
+    @staticmethod
+    def decode(data):
+        return bytes(data)
+
+CODECS = {codec.name: codec for codec in (JsonCodec, PickleCodec, MsgpackCodec, RawCodec)}
+
+def get_codec(codec):
+    """Кодек по имени или сам объект кодека (encode/decode/name)"""
+    if isinstance(codec, str):
+        try:
+            return CODECS[codec]
+        except KeyError:
+            raise ValueError(f"Неизвестный кодек кэша: {codec}") from None
+    return codec
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+class WriteLatencyTracker:
+    """
+    Скользящая (EWMA) задержка записи. Совместим с Database.add_write_observer:
+    tracker.observe(seconds, events, incidents). Без новых замеров дольше
+    idle_after секунд нагрузка считается спавшей.
+    """
+
+    def __init__(self, alpha=0.2, idle_after=5.0):
+        self.alpha = alpha
+        self.idle_after = idle_after
+        self._ewma_ms = 0.0
+        self._updated = 0.0
+
+    def observe(self, seconds, *_):
+        value = seconds * 1000.0
+        self._ewma_ms = value if not self._updated else self._ewma_ms + self.alpha * (value - self._ewma_ms)
+        self._updated = time.monotonic()
+
+    def latency_ms(self):
+        if not self._updated or time.monotonic() - self._updated > self.idle_after:
+            return 0.0
+        return self._ewma_ms
+
+class OnlineMaintenance:
+    """
+    Онлайн-обслуживание SQLite маленькими порциями вместо VACUUM/ANALYZE целиком:
+    ANALYZE по одной таблице с analysis_limit, PRAGMA optimize и
+    incremental_vacuum(vacuum_pages) до опустошения freelist. Каждая порция —
+    отдельное короткое соединение с малым busy_timeout; при занятой базе или
+    росте задержки записи выше max_write_latency_ms порция пропускается,
+    а интервал между порциями растёт (до max_backoff раз).
+    """
+
+    def __init__(self, db_path, vacuum_pages=128, analysis_limit=400, interval=0.5,
+                 max_write_latency_ms=50.0, latency_source=None, busy_timeout_ms=50, max_backoff=16):
+        self.db_path = db_path
+        self.vacuum_pages = vacuum_pages
+        self.analysis_limit = analysis_limit
+        self.interval = interval
+        self.max_write_latency_ms = max_write_latency_ms
+        self.latency_source = latency_source
+        self.busy_timeout = busy_timeout_ms / 1000.0
+        self.max_backoff = max_backoff
+        self.tasks = None
+        self.notes = []
+        self.stats = {"slices": 0, "yielded": 0, "analyzed": 0, "pages_freed": 0}
+        self._backoff = 1
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def done(self):
+        return self.tasks is not None and not self.tasks
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+
+    def _plan(self, conn):
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        tasks = deque(("analyze", table) for table in tables)
+        tasks.append(("optimize", None))
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            tasks.append(("vacuum", None))
+        else:
+            # Переключение режима вступает в силу только после полного VACUUM
+            self.notes.append("auto_vacuum не INCREMENTAL: нужен однократный optimize_database(online=False)")
+        return tasks
+
+    def _write_latency_ms(self, conn):
+        if self.latency_source is not None:
+            return self.latency_source()
+        # Без внешнего источника — время захвата блокировки записи
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.rollback()
+        return (time.perf_counter() - start) * 1000.0
+
+    def _run_task(self, conn, kind, table):
+        """Одна порция; True, если задача завершена"""
+        if kind == "analyze":
+            conn.execute(f"PRAGMA analysis_limit = {int(self.analysis_limit)}")
+            conn.execute(f'ANALYZE "{table}"')
+            conn.commit()
+            self.stats["analyzed"] += 1
+            return True
+        if kind == "optimize":
+            conn.execute(f"PRAGMA analysis_limit = {int(self.analysis_limit)}")
+            conn.execute("PRAGMA optimize")
+            conn.commit()
+            return True
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before:
+            # Через execute модуль sqlite3 делает один шаг — одну страницу; executescript доводит до конца
+            conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        self.stats["pages_freed"] += before - after
+        return after == 0 or after >= before
+
+    def _yield(self):
+        self.stats["yielded"] += 1
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def step(self):
+        """Одна порция работы; False, когда обслуживание закончено"""
+        if self.done:
+            return False
+        conn = self._connect()
+        try:
+            if self.tasks is None:
+                self.tasks = self._plan(conn)
+            if self._write_latency_ms(conn) > self.max_write_latency_ms:
+                # Запись и так тормозит — уступаем и ждём дольше
+                self._yield()
+                return True
+            kind, table = self.tasks[0]
+            if self._run_task(conn, kind, table):
+                self.tasks.popleft()
+            self.stats["slices"] += 1
+            self._backoff = 1
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            self._yield()
+        finally:
+            conn.close()
+        return not self.done
+
+    def run_until_done(self, max_slices=None):
+        """Синхронный прогон (CLI, тесты)"""
+        slices = 0
+        while self.step():
+            slices += 1
+            if max_slices is not None and slices >= max_slices:
+                break
+        return self.report()
+
+    def _run(self):
+        while not self._stop.wait(self.interval * self._backoff):
+            try:
+                if not self.step():
+                    return
+            except sqlite3.Error as e:
+                print(f"[✘] Онлайн-обслуживание {self.db_path} остановлено: {e}")
+                return
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def report(self):
+        return {
+            "db_path": self.db_path,
+            "done": self.done,
+            "pending_tasks": len(self.tasks) if self.tasks is not None else None,
+            "backoff": self._backoff,
+            "notes": list(self.notes),
+            **self.stats,
+        }
+
+class _NullParams(dict):
+    """Именованные параметры для EXPLAIN: любое имя — NULL"""
+
+    def __missing__(self, key):
+        return None
+
+def _params_json(params):
+    """Параметры запроса для query_performance.params; несериализуемые — NULL"""
+    if params is None:
+        return None
+    try:
+        return json.dumps(params)
+    except (TypeError, ValueError):
+        return None
+
+def _explain_params(query, params=None):
+    """Параметры для EXPLAIN QUERY PLAN: переданные при записи или NULL на каждый плейсхолдер"""
+    if params is not None:
+        return params
+    text = re.sub(r"'(?:[^']|'')*'", "''", query)
+    if re.search(r"[:@$][A-Za-z_]\w*", text):
+        return _NullParams()
+    return [None] * text.count("?")
+
+SQL_CLAUSE_END = r"(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bHAVING\b|\bUNION\b|$)"
+
+class IndexAdvisor:
+    """
+    Советник по индексам на основе реальной нагрузки.
+    Для каждого записанного запроса смотрит EXPLAIN QUERY PLAN; по полным
+    просмотрам (SCAN) и сортировкам через временное B-дерево строит составной
+    индекс: сначала колонки равенства, затем одна колонка диапазона или
+    ORDER BY, при небольшом числе колонок — покрывающий. Кандидат проверяется
+    на копии схемы в памяти (со статистикой sqlite_stat1): если план с ним не
+    меняется, он отбрасывается. Оценка — выигрыш чтения по нагрузке против
+    цены записи (ещё одно B-дерево на каждую вставку).
+    """
+
+    EQUALITY_OPS = ("=", "==", "IN", "IS")
+    MAX_COVERING_COLUMNS = 5
+    SAMPLE_ROWS = 10000
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    @staticmethod
+    def _plan(conn, query, params=None):
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, _explain_params(query, params))]
+
+    @staticmethod
+    def _aliases(query):
+        """alias -> таблица для FROM/JOIN"""
+        aliases = {}
+        stop = {"WHERE", "JOIN", "ON", "INNER", "LEFT", "CROSS", "ORDER", "GROUP", "LIMIT", "USING", "NATURAL",
+                "SET", "VALUES", "HAVING", "UNION", "OUTER"}
+        for match in re.finditer(r'\b(?:FROM|JOIN|UPDATE)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(\w+))?', query, re.I):
+            table, alias = match.group(1), match.group(2)
+            aliases[table] = table
+            if alias and alias.upper() not in stop:
+                aliases[alias] = table
+        return aliases
+
+    @staticmethod
+    def _column_refs(text, alias, table, columns):
+        """Колонки таблицы из text: alias.col или просто col, если он есть в таблице"""
+        refs = []
+        for qualifier, name in re.findall(r"(?:\b(\w+)\.)?\b(\w+)\b", text):
+            if name in columns and (not qualifier or qualifier in (alias, table)) and name not in refs:
+                refs.append(name)
+        return refs
+
+    def _candidate(self, conn, query, alias, table):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+        if not columns:
+            return None
+        where = re.search(r"\b(?:WHERE|ON)\b(.*?)" + SQL_CLAUSE_END, query, re.I | re.S)
+        equality, ranges, joins = [], [], []
+        if where:
+            pattern = (r"(?:\b(\w+)\.)?\b(\w+)\s*(==|=|>=|<=|<>|!=|>|<|\bIN\b|\bIS\b|\bBETWEEN\b|\bLIKE\b)"
+                       r"\s*(\w+\.\w+)?")
+            for qualifier, name, op, other in re.findall(pattern, where.group(1), re.I):
+                if name not in columns or (qualifier and qualifier not in (alias, table)):
+                    continue
+                if other:
+                    # Условие соединения полезно, только если таблица во внутреннем цикле
+                    if name not in joins:
+                        joins.append(name)
+                elif op.upper() in self.EQUALITY_OPS:
+                    if name not in equality:
+                        equality.append(name)
+                elif op not in ("<>", "!=") and name not in ranges:
+                    ranges.append(name)
+            if not equality:
+                equality = joins
+        order = re.search(r"\bORDER\s+BY\b(.*?)(?=\bLIMIT\b|$)", query, re.I | re.S)
+        order_cols = self._column_refs(order.group(1), alias, table, columns) if order else []
+        keys = list(equality)
+        tail = [c for c in ranges if c not in keys][:1]
+        if not tail or (order_cols and order_cols[0] == tail[0]):
+            tail = [c for c in order_cols if c not in keys] or tail
+        keys += tail
+        if not keys:
+            return None
+        # Покрывающий индекс, если запросу нужно немного колонок этой таблицы
+        select = re.search(r"\bSELECT\b(.*?)\bFROM\b", query, re.I | re.S)
+        if select and "*" not in select.group(1):
+            used = self._column_refs(query, alias, table, columns)
+            rest = [c for c in used if c not in keys and c != "id"]
+            if len(keys) + len(rest) <= self.MAX_COVERING_COLUMNS:
+                keys += rest
+        return table, tuple(keys), tuple(equality), tuple(ranges)
+
+    @staticmethod
+    def _index_sql(table, keys):
+        name = f"idx_{table}_" + "_".join(keys)
+        return name, f'CREATE INDEX IF NOT EXISTS {name} ON "{table}"(' + ", ".join(keys) + ")"
+
+    def _existing_prefixes(self, conn, table):
+        prefixes = []
+        for index in conn.execute(f'PRAGMA index_list("{table}")'):
+            prefixes.append(tuple(row[2] for row in conn.execute(f'PRAGMA index_info("{index[1]}")')))
+        return prefixes
+
+    def _schema_clone(self, conn):
+        """Схема (без данных) и статистика планировщика в памяти — для гипотетических индексов"""
+        clone = sqlite3.connect(":memory:")
+        for (sql,) in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'table' DESC"
+        ):
+            try:
+                clone.execute(sql)
+            except sqlite3.Error:
+                pass
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            clone.execute("ANALYZE")
+            clone.execute("DELETE FROM sqlite_stat1")
+            clone.executemany("INSERT INTO sqlite_stat1 VALUES (?, ?, ?)",
+                              conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1"))
+            clone.commit()
+            clone.execute("ANALYZE sqlite_master")  # перечитать статистику
+        return clone
+
+    def _row_count(self, conn, table):
+        stat = conn.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)
+        ).fetchone() if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() else None
+        if stat:
+            return int(stat[0].split()[0])
+        return conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM "{table}" LIMIT {self.SAMPLE_ROWS * 10})').fetchone()[0]
+
+    def _estimate(self, conn, table, keys, equality, ranges, calls, avg_ms, existing):
+        """Выигрыш чтения (строк на вызов и мс по нагрузке) и цена записи индекса"""
+        rows = self._row_count(conn, table)
+        selectivity = 1.0
+        for column in equality:
+            distinct = conn.execute(
+                f'SELECT COUNT(DISTINCT {column}) FROM (SELECT {column} FROM "{table}" LIMIT {self.SAMPLE_ROWS})'
+            ).fetchone()[0]
+            selectivity /= max(1, distinct)
+        if any(c in keys for c in ranges):
+            selectivity *= 0.25
+        rows_after = max(1, round(rows * selectivity))
+        width = conn.execute(
+            "SELECT " + " + ".join(f"COALESCE(AVG(LENGTH({c})), 0)" for c in keys)
+            + f' FROM (SELECT {", ".join(keys)} FROM "{table}" LIMIT 1000)'
+        ).fetchone()[0] or 0
+        saved = calls * avg_ms * (1 - rows_after / rows) if rows else 0.0
+        return {
+            "read_gain": {
+                "calls": calls,
+                "avg_ms": round(avg_ms, 3),
+                "rows_examined_before": rows,
+                "rows_examined_after": rows_after,
+                "est_saved_ms": round(max(0.0, saved), 3),
+            },
+            "write_cost": {
+                "btrees_per_insert": f"{1 + existing} -> {2 + existing}",
+                "est_index_bytes": int(rows * (width + 8)),
+            },
+        }
+
+    def advise(self, workload, top_n=10):
+        """
+        workload: [(query, calls, avg_ms, params)] — рекомендации по убыванию est_saved_ms.
+        Запросы, ссылающиеся на таблицы, которых нет в базе, пропускаются целиком.
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            clone = self._schema_clone(conn)
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            candidates = {}
+            for query, calls, avg_ms, params in workload:
+                aliases = self._aliases(query)
+                # Нагрузка общая на процесс: запросы к другим базам сюда не относятся
+                if not aliases or not set(aliases.values()) <= tables:
+                    continue
+                try:
+                    plan = self._plan(conn, query, params)
+                except sqlite3.Error:
+                    continue
+                for step in plan:
+                    match = re.match(r"SCAN (\w+)(?! USING (?:COVERING )?INDEX)", step)
+                    if match is None and not step.startswith("USE TEMP B-TREE FOR ORDER BY"):
+                        continue
+                    targets = [match.group(1)] if match else [a for a in aliases if aliases[a] == a][:1]
+                    for alias in targets:
+                        table = aliases.get(alias, alias)
+                        candidate = self._candidate(conn, query, alias, table)
+                        if candidate is None:
+                            continue
+                        entry = candidates.setdefault(candidate[:2], {
+                            "candidate": candidate, "queries": [], "calls": 0, "total_ms": 0.0, "plans": [],
+                        })
+                        entry["queries"].append(query)
+                        entry["calls"] += calls
+                        entry["total_ms"] += calls * avg_ms
+                        entry["plans"].append(plan)
+
+            recommendations = []
+            for (table, keys), entry in candidates.items():
+                _, _, equality, ranges = entry["candidate"]
+                existing = self._existing_prefixes(conn, table)
+                if any(prefix[:len(keys)] == keys for prefix in existing):
+                    continue
+                name, sql = self._index_sql(table, keys)
+                # Проверка на копии схемы: планировщик действительно возьмёт индекс?
+                clone.execute("SAVEPOINT hypothetical")
+                try:
+                    clone.execute(sql)
+                    after = [self._plan(clone, q) for q in entry["queries"]]
+                finally:
+                    clone.execute("ROLLBACK TO hypothetical")
+                    clone.execute("RELEASE hypothetical")
+                if not any(name in step for plan in after for step in plan):
+                    continue
+                calls = entry["calls"]
+                avg_ms = entry["total_ms"] / calls if calls else 0.0
+                recommendations.append({
+                    "table": table,
+                    "columns": list(keys),
+                    "name": name,
+                    "sql": sql,
+                    "queries": entry["queries"],
+                    "plan_before": entry["plans"][0],
+                    "plan_after": after[0],
+                    **self._estimate(conn, table, keys, equality, ranges, calls, avg_ms, len(existing)),
+                    "applied": False,
+                })
+            clone.close()
+        finally:
+            conn.close()
+        recommendations.sort(key=lambda r: r["read_gain"]["est_saved_ms"], reverse=True)
+        return recommendations[:top_n]
+
+    def apply(self, recommendations):
+        """Создание рекомендованных индексов и ANALYZE по ним"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for recommendation in recommendations:
+                conn.execute(recommendation["sql"])
+                conn.execute(f'ANALYZE "{recommendation["name"]}"')
+                conn.commit()
+                recommendation["applied"] = True
+        finally:
+            conn.close()
+        return recommendations
+
+class _Flight:
+    """Одно выполнение функции, результат которого ждут все конкурентные вызовы по ключу"""
+
+    __slots__ = ("done", "result", "error")
+
     def __init__(self):
-        self.cache = {}
-        self.cache_stats = {"hits": 0, "misses": 0}
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+# cProfile и tracemalloc — на весь процесс: одновременно профилируется один вызов
+_PROFILER_LOCK = threading.Lock()
+
+class PerformanceOptimizer:
+    def __init__(self, db_path='performance.db', slow_threshold=1.0, flush_batch=100, flush_interval=5.0,
+                 profile_slow=False, profile_sample_rate=0.01, cache_max_entries=10000,
+                 cache_max_bytes=64 * 1024 * 1024, key_builder=tuple_key_builder, codec="json",
+                 l2_flush_interval=1.0, l2_max_pending=10000, sweep_interval=30.0, sweep_batch=500):
+        self.db_path = db_path
+        self.key_builder = key_builder
+        self.codec = get_codec(codec)
+        self.cache = MemoryCacheTier(max_entries=cache_max_entries, max_bytes=cache_max_bytes)
+        self.cache_stats = {
+            "hits": 0, "misses": 0, "coalesced": 0, "stale_served": 0, "refreshes": 0, "refresh_errors": 0,
+        }
+        # Single-flight: ключ -> выполняющийся пересчёт; фоновые обновления для stale-while-revalidate
+        self._inflight = {}
+        self._flight_lock = threading.Lock()
+        self._refresher = None
         self.query_stats = {}
+        # Инструментирование: гистограммы по местам вызова, пакетная запись в query_performance
+        self.slow_threshold = slow_threshold
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self.profile_slow = profile_slow
+        self.profile_sample_rate = profile_sample_rate
+        self.slow_call_hooks = []
+        self._pending_queries = []
+        self._last_flush = time.monotonic()
+        self._suspect_sites = set()
+        self._stats_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # L2 (cache_entries): отложенная пакетная запись, счётчики обращений в памяти,
+        # инкрементальная очистка просроченного — всё в одном фоновом потоке
+        self.l2_flush_interval = l2_flush_interval
+        self.l2_max_pending = l2_max_pending
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._l2_pending = OrderedDict()  # storage_key -> строка для INSERT OR REPLACE
+        self._l2_access = Counter()
+        self._l2_lock = threading.Lock()
+        self._l2_wakeup = threading.Event()
+        self._l2_thread = None
+        self._last_sweep = time.monotonic()
+        self._local = threading.local()
+        self.l2_stats = {"written": 0, "batches": 0, "dropped": 0, "swept": 0, "errors": 0}
+        # Теги кэша: версия тега входит в ключ, invalidate_tag её увеличивает.
+        # Версии хранятся в cache_tags и опрашиваются фоновым потоком — сброс виден другим процессам
+        self._tag_versions = {}
+        self._tag_deltas = Counter()
+        self.invalidations = Counter()
+        # Онлайн-обслуживание баз: db_path -> OnlineMaintenance
+        self.maintenance = {}
         self.setup_optimization_db()
+        atexit.register(self.flush_query_stats)
+        atexit.register(self.flush_cache_writes)
         
     def setup_optimization_db(self):
         """База данных для оптимизации"""
-        conn = sqlite3.connect('performance.db')
+        conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # Таблица кэша
+        # WAL: фоновая запись L2 не блокирует чтения
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
+        # Таблица кэша: время в epoch-ms (INTEGER) с индексом для очистки просроченного.
+        # Старый формат (TEXT) пересоздаётся — кэш восстановим
+        columns = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(cache_entries)")}
+        if columns and (columns.get("expires_at", "").upper() != "INTEGER" or "codec" not in columns):
+            cursor.execute("DROP TABLE cache_entries")
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS cache_entries (
                 key TEXT PRIMARY KEY,
-                value TEXT,
-                created_at TEXT,
-                expires_at TEXT,
+                value BLOB,
+                codec TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                expires_at INTEGER NOT NULL,
                 access_count INTEGER DEFAULT 0
             )
         ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at ON cache_entries(expires_at)")
+        
+        # Версии тегов кэша
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        ''')
+        self._tag_versions.update(cursor.execute("SELECT tag, version FROM cache_tags"))
         
         # Таблица статистики запросов
         cursor.execute('''
@@ -40,139 +845,336 @@ class PerformanceOptimizer:
                 query_text TEXT,
                 execution_time REAL,
                 timestamp TEXT,
-                result_count INTEGER
+                result_count INTEGER,
+                params TEXT
             )
         ''')
+        # Параметры запроса (JSON) — для EXPLAIN советника индексов после перезапуска
+        if "params" not in {row[1] for row in cursor.execute("PRAGMA table_info(query_performance)")}:
+            cursor.execute("ALTER TABLE query_performance ADD COLUMN params TEXT")
         
         conn.commit()
         conn.close()
     
-    def cache_result(self, ttl=300):
-        """Декоратор для кэширования результатов"""
+    def cache_result(self, ttl=300, stale_ttl=0, key_builder=None, codec=None, tags=()):
+        """
+        Декоратор для кэширования результатов.
+        Промах пересчитывает только один вызов на ключ (single-flight), остальные
+        ждут его результат. При stale_ttl > 0 просроченное значение ещё stale_ttl
+        секунд отдаётся сразу, а пересчёт идёт в фоне.
+        key_builder(func_name, args, kwargs) и codec (json | pickle | msgpack | raw
+        или объект с encode/decode) переопределяют настройки оптимизатора; строка L2,
+        записанная другим кодеком, считается промахом.
+        tags — зависимости результата (events, incidents, users...): invalidate_tag
+        делает все такие записи недоступными, поэтому TTL можно держать длинным.
+        Попадание в память возвращает тот же объект, а не копию: изменять результат
+        нельзя — изменится кэш для всех вызывающих; нужна изменяемая копия — копируйте.
+        """
+        build_key = key_builder or self.key_builder
+        value_codec = get_codec(codec) if codec is not None else None
+        tags = tuple(tags)
+        if tags:
+            # Фоновый поток подхватывает сбросы тегов из других процессов
+            self._start_l2_writer()
+
         def decorator(func):
             @wraps(func)
             def wrapper(*args, **kwargs):
                 # Создание ключа кэша
-                cache_key = self._generate_cache_key(func.__name__, args, kwargs)
+                cache_key = build_key(func.__name__, args, kwargs)
+                if tags:
+                    versions = self._tag_versions
+                    cache_key = (cache_key, tuple(versions.get(tag, 0) for tag in tags))
                 
                 # Проверка кэша
-                cached_result = self.get_from_cache(cache_key)
+                cached_result = self.get_from_cache(cache_key, codec=value_codec)
                 if cached_result is not None:
-                    self.cache_stats["hits"] += 1
+                    self._count_cache("hits")
                     return cached_result
                 
-                # Выполнение функции
-                self.cache_stats["misses"] += 1
-                result = func(*args, **kwargs)
+                def compute():
+                    # Пока ждали очереди, значение мог положить предыдущий пересчёт
+                    fresh = self.cache.get(cache_key, count=False)
+                    if fresh is not None:
+                        return fresh
+                    result = func(*args, **kwargs)
+                    # Сохранение в кэш
+                    self.set_cache(cache_key, result, ttl, stale_ttl, codec=value_codec)
+                    return result
                 
-                # Сохранение в кэш
-                self.set_cache(cache_key, result, ttl)
+                if stale_ttl:
+                    stale = self.cache.get_stale(cache_key)
+                    if stale is not None:
+                        self._count_cache("stale_served")
+                        self._refresh_in_background(cache_key, compute)
+                        return stale
                 
-                return result
+                # Выполнение функции
+                self._count_cache("misses")
+                return self._single_flight(cache_key, compute)
             return wrapper
         return decorator
     
+    def _join_flight(self, key):
+        """(полёт, True если вызывающий — ведущий и должен выполнить его сам)"""
+        with self._flight_lock:
+            flight = self._inflight.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._inflight[key] = _Flight()
+            return flight, True
+    
+    def _run_flight(self, key, flight, compute):
+        try:
+            flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._flight_lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+        return flight
+    
+    def _single_flight(self, key, compute):
+        flight, leader = self._join_flight(key)
+        if leader:
+            self._run_flight(key, flight, compute)
+        else:
+            self._count_cache("coalesced")
+        return flight.wait()
+    
+    def _refresh_in_background(self, key, compute):
+        """Фоновый пересчёт устаревшего ключа, если он ещё не идёт"""
+        flight, leader = self._join_flight(key)
+        if not leader:
+            return
+        with self._flight_lock:
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+        self._count_cache("refreshes")
+        self._refresher.submit(self._refresh, key, flight, compute)
+    
+    def _refresh(self, key, flight, compute):
+        if self._run_flight(key, flight, compute).error is not None:
+            self._count_cache("refresh_errors")
+            print(f"[✘] Фоновое обновление кэша не удалось: {flight.error}")
+    
+    def _count_cache(self, key):
+        with self._stats_lock:
+            self.cache_stats[key] += 1
+    
     def _generate_cache_key(self, func_name, args, kwargs):
         """Генерация ключа кэша"""
-        key_data = f"{func_name}:{str(args)}:{str(sorted(kwargs.items()))}"
-        return hashlib.md5(key_data.encode()).hexdigest()
+        return self.key_builder(func_name, args, kwargs)
     
-    def get_from_cache(self, key):
-        """Получение из кэша"""
-        # Проверка памяти
-        if key in self.cache:
-            entry = self.cache[key]
-            if datetime.now() < entry["expires_at"]:
-                entry["access_count"] += 1
-                return entry["value"]
-            else:
-                del self.cache[key]
-        
-        # Проверка БД
-        conn = sqlite3.connect('performance.db')
-        cursor = conn.cursor()
+    @staticmethod
+    def _storage_key(key):
+        """Ключ строки в cache_entries: строковые ключи как есть, остальные — устойчивый хэш"""
+        return key if isinstance(key, str) else stable_key_digest(key)
+    
+    def get_from_cache(self, key, codec=None):
+        """Получение из кэша; строка L2 декодируется, только если записана кодеком codec"""
+        # Проверка памяти (просроченная запись удаляется здесь же)
+        value = self.cache.get(key)
+        if value is not None:
+            return value
         
-        cursor.execute('''
-            SELECT value, expires_at, access_count FROM cache_entries 
-            WHERE key = ? AND expires_at > datetime('now')
-        ''', (key,))
+        # Проверка L2: сначала ещё не записанные строки, затем БД
+        storage_key = self._storage_key(key)
+        now = _now_ms()
+        with self._l2_lock:
+            pending = self._l2_pending.get(storage_key)
+        if pending is not None:
+            _, data, codec_name, _, expires_at = pending
+            access_count = 1
+        else:
+            row = self._l2_connection().execute('''
+                SELECT value, codec, expires_at, access_count FROM cache_entries
+                WHERE key = ? AND expires_at > ?
+            ''', (storage_key, now)).fetchone()
+            if row is None:
+                return None
+            data, codec_name, expires_at, access_count = row
+        expected = codec or self.codec
+        if expires_at <= now or codec_name != expected.name:
+            return None
         
-        result = cursor.fetchone()
-        if result:
-            value, expires_at, access_count = result
-            
-            # Обновление счетчика
-            cursor.execute('''
-                UPDATE cache_entries SET access_count = access_count + 1 
-                WHERE key = ?
-            ''', (key,))
-            
-            # Загрузка в память
-            self.cache[key] = {
-                "value": json.loads(value),
-                "expires_at": datetime.fromisoformat(expires_at),
-                "access_count": access_count + 1
-            }
-            
-            conn.commit()
-            conn.close()
-            return json.loads(value)
+        # Счётчик обращений копится в памяти и пишется фоновым потоком
+        with self._l2_lock:
+            self._l2_access[storage_key] += 1
         
-        conn.close()
-        return None
+        # Декодирование один раз; в память — на оставшийся срок жизни
+        value = expected.decode(data)
+        self.cache.set(key, value, (expires_at - now) / 1000.0, size=len(data), access_count=access_count + 1)
+        return value
     
-    def set_cache(self, key, value, ttl):
-        """Сохранение в кэш"""
-        expires_at = datetime.now() + timedelta(seconds=ttl)
+    def set_cache(self, key, value, ttl, stale_ttl=0, codec=None):
+        """Сохранение в кэш: память сразу, L2 — пакетом из фонового потока"""
+        codec = codec or self.codec
+        serialized = codec.encode(value)
         
-        # Сохранение в память
-        self.cache[key] = {
-            "value": value,
-            "expires_at": expires_at,
-            "access_count": 1
-        }
-        
-        # Сохранение в БД
-        conn = sqlite3.connect('performance.db')
-        cursor = conn.cursor()
+        # Сохранение в память (живой объект — попадание в память без декодирования)
+        self.cache.set(key, value, ttl, size=len(serialized), stale_ttl=stale_ttl)
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO cache_entries (key, value, created_at, expires_at, access_count)
-            VALUES (?, ?, ?, ?, 1)
-        ''', (key, json.dumps(value), datetime.now().isoformat(), expires_at.isoformat()))
-        
-        conn.commit()
-        conn.close()
+        # Постановка в очередь записи L2; повторная запись ключа заменяет прежнюю
+        now = _now_ms()
+        storage_key = self._storage_key(key)
+        with self._l2_lock:
+            self._l2_pending.pop(storage_key, None)
+            self._l2_pending[storage_key] = (storage_key, serialized, codec.name, now, now + int(ttl * 1000))
+            if len(self._l2_pending) > self.l2_max_pending:
+                self._l2_pending.popitem(last=False)
+                self.l2_stats["dropped"] += 1
+            start = self._l2_thread is None
+        if start:
+            self._start_l2_writer()
+        if len(self._l2_pending) >= self.flush_batch:
+            self._l2_wakeup.set()
     
-    def optimize_database(self, db_path):
-        """Оптимизация базы данных"""
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
+    def invalidate_tag(self, *tags):
+        """Сброс всех записей с любым из тегов: новая версия тега — новые ключи"""
+        with self._l2_lock:
+            for tag in tags:
+                self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+                self._tag_deltas[tag] += 1
+                self.invalidations[tag] += 1
+            start = self._l2_thread is None
+        if start:
+            self._start_l2_writer()
+    
+    def bind_database(self, database):
+        """Сброс тегов events/incidents при каждой записи в database.Database"""
+        database.add_invalidation_hook(self.invalidate_tag)
+    
+    def _sync_tags(self, conn):
+        """Запись локальных сбросов тегов в cache_tags и подхват чужих"""
+        with self._l2_lock:
+            deltas = list(self._tag_deltas.items())
+            self._tag_deltas.clear()
+        with conn:
+            conn.executemany('''
+                INSERT INTO cache_tags (tag, version) VALUES (?, ?)
+                ON CONFLICT(tag) DO UPDATE SET version = version + excluded.version
+            ''', deltas)
+        stored = conn.execute("SELECT tag, version FROM cache_tags").fetchall()
+        with self._l2_lock:
+            for tag, version in stored:
+                if version > self._tag_versions.get(tag, 0):
+                    self._tag_versions[tag] = version
+    
+    def _l2_connection(self):
+        """Соединение с performance.db для чтения L2 — одно на поток"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path)
+        return conn
+    
+    def _start_l2_writer(self):
+        with self._l2_lock:
+            if self._l2_thread is not None:
+                return
+            self._l2_thread = threading.Thread(target=self._l2_writer_loop, name="cache-l2-writer", daemon=True)
+        self._l2_thread.start()
+    
+    def _l2_writer_loop(self):
+        conn = sqlite3.connect(self.db_path)
+        while True:
+            self._l2_wakeup.wait(self.l2_flush_interval)
+            self._l2_wakeup.clear()
+            try:
+                self._flush_l2(conn)
+                self._sync_tags(conn)
+                if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                    self._sweep_expired(conn, max_slices=10)
+            except sqlite3.Error as e:
+                self.l2_stats["errors"] += 1
+                print(f"[✘] Ошибка записи L2-кэша: {e}")
+    
+    def _flush_l2(self, conn):
+        """Запись накопленных строк и счётчиков обращений одной транзакцией"""
+        with self._l2_lock:
+            rows = list(self._l2_pending.values())
+            access = list(self._l2_access.items())
+            self._l2_access.clear()
+        if not rows and not access:
+            return 0
+        with conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO cache_entries (key, value, codec, created_at, expires_at, access_count)
+                VALUES (?, ?, ?, ?, ?, 1)
+            ''', rows)
+            conn.executemany(
+                "UPDATE cache_entries SET access_count = access_count + ? WHERE key = ?",
+                [(count, key) for key, count in access],
+            )
+        with self._l2_lock:
+            # Строки, перезаписанные за время коммита, остаются в очереди
+            for row in rows:
+                if self._l2_pending.get(row[0]) is row:
+                    del self._l2_pending[row[0]]
+            self.l2_stats["written"] += len(rows)
+            self.l2_stats["batches"] += 1
+        return len(rows)
+    
+    def _sweep_expired(self, conn, max_slices=None):
+        """Удаление просроченных строк короткими транзакциями по sweep_batch (по индексу expires_at)"""
+        removed = 0
+        slices = 0
+        while max_slices is None or slices < max_slices:
+            with conn:
+                deleted = conn.execute('''
+                    DELETE FROM cache_entries WHERE key IN (
+                        SELECT key FROM cache_entries WHERE expires_at <= ? LIMIT ?
+                    )
+                ''', (_now_ms(), self.sweep_batch)).rowcount
+            removed += deleted
+            slices += 1
+            if deleted < self.sweep_batch:
+                break
+        self._last_sweep = time.monotonic()
+        with self._l2_lock:
+            self.l2_stats["swept"] += removed
+        return removed
+    
+    def flush_cache_writes(self):
+        """Синхронная запись очереди L2 и версий тегов (тесты, остановка процесса)"""
+        with self._l2_lock:
+            if not self._l2_pending and not self._l2_access and not self._tag_deltas:
+                return 0
+        conn = sqlite3.connect(self.db_path)
+        try:
+            written = self._flush_l2(conn)
+            self._sync_tags(conn)
+            return written
+        finally:
+            conn.close()
+    
+    def optimize_database(self, db_path, online=False, latency_source=None, **maintenance_options):
+        """
+        Оптимизация базы данных.
+        online=True — без долгих блокировок: фоновое OnlineMaintenance порциями
+        (ANALYZE с analysis_limit, PRAGMA optimize, incremental_vacuum), уступающее
+        записи. latency_source() -> мс задержки записи, например
+        WriteLatencyTracker.latency_ms, подключённый к Database.add_write_observer.
+        """
+        if online:
+            return self._optimize_online(db_path, latency_source, **maintenance_options)
         optimizations = []
         
-        # Анализ таблиц
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
+        # Индексы — по записанной нагрузке (EXPLAIN QUERY PLAN), а не по именам колонок
+        for recommendation in self.advise_indexes(db_path, apply=True):
+            gain = recommendation["read_gain"]
+            optimizations.append(
+                f"Создан индекс: {recommendation['name']} "
+                f"(строк на вызов {gain['rows_examined_before']} -> {gain['rows_examined_after']})"
+            )
         
-        for table in tables:
-            table_name = table[0]
-            
-            # Создание индексов
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = cursor.fetchall()
-            
-            for column in columns:
-                column_name = column[1]
-                if column_name.endswith('_id') or column_name in ['timestamp', 'created_at']:
-                    index_name = f"idx_{table_name}_{column_name}"
-                    try:
-                        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name}({column_name})")
-                        optimizations.append(f"Создан индекс: {index_name}")
-                    except:
-                        pass
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
         
-        # VACUUM для дефрагментации
+        # VACUUM для дефрагментации; заодно перевод в auto_vacuum=INCREMENTAL для онлайн-режима
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.commit()
         cursor.execute("VACUUM")
         optimizations.append("Выполнена дефрагментация")
         
@@ -185,41 +1187,198 @@ class PerformanceOptimizer:
         
         return optimizations
     
+    def query_workload(self):
+        """Нагрузка для советника: [(query, calls, avg_ms, params)] из памяти и query_performance"""
+        self.flush_query_stats()
+        workload = {}
+        with self._stats_lock:
+            for stats in self.query_stats.values():
+                histogram = stats["histogram"]
+                avg_ms = histogram.total_ns / histogram.count / 1e6 if histogram.count else 0.0
+                workload[stats["query"]] = [histogram.count, avg_ms, stats.get("params")]
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT query_text, COUNT(*), AVG(execution_time) * 1000, MAX(params) FROM query_performance
+                GROUP BY query_text
+            ''').fetchall()
+        finally:
+            conn.close()
+        for query, calls, avg_ms, params_json in rows:
+            # Записанное в БД включает вызовы этого процесса — берём большее
+            if query not in workload or workload[query][0] < calls:
+                params = workload[query][2] if query in workload else None
+                if params is None and params_json is not None:
+                    params = json.loads(params_json)
+                workload[query] = [calls, avg_ms, params]
+        return [(query, calls, avg_ms, params) for query, (calls, avg_ms, params) in workload.items()]
+    
+    def advise_indexes(self, db_path, queries=None, apply=False, top_n=10):
+        """
+        Рекомендации индексов для db_path по записанной нагрузке (или по списку
+        queries: строки SQL либо кортежи (query, calls, avg_ms, params)).
+        Учитываются только запросы, все таблицы которых есть в db_path.
+        apply=True — сразу создаёт рекомендованные индексы.
+        """
+        if queries is None:
+            workload = self.query_workload()
+        else:
+            workload = [(q, 1, 0.0, None) if isinstance(q, str) else tuple(q) for q in queries]
+        advisor = IndexAdvisor(db_path)
+        recommendations = advisor.advise(workload, top_n=top_n)
+        if apply:
+            advisor.apply(recommendations)
+        return recommendations
+    
+    def _optimize_online(self, db_path, latency_source=None, **options):
+        current = self.maintenance.get(db_path)
+        if current is not None and not current.done:
+            return [f"Онлайн-обслуживание уже идёт: {current.report()['pending_tasks']} задач в очереди"]
+        maintenance = OnlineMaintenance(db_path, latency_source=latency_source, **options)
+        self.maintenance[db_path] = maintenance
+        maintenance.start()
+        return [f"Запущено онлайн-обслуживание {db_path} (порции по {maintenance.vacuum_pages} страниц)"]
+    
     def monitor_query_performance(self, query, params=None):
-        """Мониторинг производительности запросов"""
+        """
+        Мониторинг производительности запросов.
+        Время — perf_counter_ns в гистограмму места вызова; строки query_performance
+        копятся в памяти и пишутся пачкой (flush_query_stats). Медленные вызовы
+        передаются хукам add_slow_call_hook; при profile_slow часть вызовов
+        (и все следующие за медленным) снимается cProfile/tracemalloc.
+        """
+        query_hash = hashlib.md5(query.encode()).hexdigest()
+
         def decorator(func):
+            site = f"{func.__module__}.{func.__qualname__}"
+
             @wraps(func)
             def wrapper(*args, **kwargs):
-                start_time = time.time()
-                result = func(*args, **kwargs)
-                execution_time = time.time() - start_time
-                
-                # Логирование производительности
-                query_hash = hashlib.md5(query.encode()).hexdigest()
-                
-                conn = sqlite3.connect('performance.db')
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT INTO query_performance (query_hash, query_text, execution_time, timestamp, result_count)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (query_hash, query[:100], execution_time, datetime.now().isoformat(), 
-                     len(result) if isinstance(result, list) else 1))
-                
-                conn.commit()
-                conn.close()
-                
-                # Предупреждение о медленных запросах
-                if execution_time > 1.0:
-                    print(f"⚠️ Медленный запрос ({execution_time:.2f}s): {query[:50]}...")
-                
-                return result
+                if self.profile_slow and (site in self._suspect_sites or random.random() < self.profile_sample_rate):
+                    return self._profiled_call(site, query, query_hash, params, func, args, kwargs)
+                return self._timed_call(site, query, query_hash, params, func, args, kwargs)
             return wrapper
         return decorator
+
+    def add_slow_call_hook(self, hook):
+        """Хук медленного вызова: hook(record), record — dict с site, query, execution_time, profile"""
+        self.slow_call_hooks.append(hook)
+
+    def _timed_call(self, site, query, query_hash, params, func, args, kwargs):
+        start_ns = time.perf_counter_ns()
+        result = func(*args, **kwargs)
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        self._record_call(site, query, query_hash, params, elapsed_ns, result)
+        return result
+
+    def _profiled_call(self, site, query, query_hash, params, func, args, kwargs):
+        """
+        Вызов под cProfile и tracemalloc; снимок сохраняется, только если вызов медленный.
+        Оба профилировщика общие на процесс (cProfile с Python 3.12 — один активный):
+        вызов, не получивший _PROFILER_LOCK, идёт обычным путём без профиля.
+        """
+        if not _PROFILER_LOCK.acquire(blocking=False):
+            return self._timed_call(site, query, query_hash, params, func, args, kwargs)
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # активен сторонний профилировщик
+                profiler = None
+            if profiler is not None:
+                own_tracing = not tracemalloc.is_tracing()
+                if own_tracing:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+                start_ns = time.perf_counter_ns()
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    elapsed_ns = time.perf_counter_ns() - start_ns
+                    profiler.disable()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    if own_tracing:
+                        tracemalloc.stop()
+        finally:
+            _PROFILER_LOCK.release()
+        if profiler is None:
+            return self._timed_call(site, query, query_hash, params, func, args, kwargs)
+        profile = None
+        if elapsed_ns >= self.slow_threshold * 1e9:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+            profile = {"peak_memory_bytes": peak, "stats": out.getvalue()}
+        self._record_call(site, query, query_hash, params, elapsed_ns, result, profile)
+        return result
+
+    def _record_call(self, site, query, query_hash, params, elapsed_ns, result, profile=None):
+        execution_time = elapsed_ns / 1e9
+        slow = execution_time >= self.slow_threshold
+        with self._stats_lock:
+            stats = self.query_stats.get(site)
+            if stats is None:
+                stats = self.query_stats[site] = {
+                    "query": query, "params": params, "params_json": _params_json(params),
+                    "histogram": LatencyHistogram(), "slow_calls": 0, "last_profile": None,
+                }
+            stats["histogram"].record(elapsed_ns)
+            if slow:
+                stats["slow_calls"] += 1
+                self._suspect_sites.add(site)
+                if profile is not None:
+                    stats["last_profile"] = profile
+            elif profile is None:
+                self._suspect_sites.discard(site)
+            self._pending_queries.append((
+                query_hash, query, execution_time, datetime.now().isoformat(),
+                len(result) if isinstance(result, list) else 1, stats["params_json"],
+            ))
+            flush = (len(self._pending_queries) >= self.flush_batch
+                     or time.monotonic() - self._last_flush >= self.flush_interval)
+        if flush:
+            self.flush_query_stats()
+        if slow:
+            # Предупреждение о медленных запросах
+            print(f"⚠️ Медленный запрос ({execution_time:.2f}s): {query[:50]}...")
+            record = {"site": site, "query": query, "execution_time": execution_time, "profile": profile}
+            for hook in self.slow_call_hooks:
+                hook(record)
+
+    def flush_query_stats(self):
+        """Запись накопленных замеров в query_performance одной транзакцией"""
+        with self._flush_lock:
+            with self._stats_lock:
+                rows, self._pending_queries = self._pending_queries, []
+                self._last_flush = time.monotonic()
+            if not rows:
+                return 0
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    conn.executemany('''
+                        INSERT INTO query_performance
+                            (query_hash, query_text, execution_time, timestamp, result_count, params)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', rows)
+            finally:
+                conn.close()
+            return len(rows)
+
+    def slow_call_sites(self, top_n=5):
+        """Top-N мест вызова по p99 (с последним профилем медленного вызова, если снят)"""
+        with self._stats_lock:
+            sites = [
+                {"site": site, "query": stats["query"], "slow_calls": stats["slow_calls"],
+                 **stats["histogram"].summary(), "profile": stats["last_profile"]}
+                for site, stats in self.query_stats.items()
+            ]
+        sites.sort(key=lambda s: (s["p99_ms"], s["max_ms"]), reverse=True)
+        return sites[:top_n]
     
     def get_performance_stats(self):
         """Статистика производительности"""
-        conn = sqlite3.connect('performance.db')
+        self.flush_query_stats()
+        conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         # Статистика кэша
@@ -239,7 +1398,7 @@ class PerformanceOptimizer:
         slow_queries = cursor.fetchall()
         
         # Размер кэша
-        cursor.execute("SELECT COUNT(*) FROM cache_entries WHERE expires_at > datetime('now')")
+        cursor.execute("SELECT COUNT(*) FROM cache_entries WHERE expires_at > ?", (_now_ms(),))
         cache_size = cursor.fetchone()[0]
         
         conn.close()
@@ -248,68 +1407,52 @@ class PerformanceOptimizer:
             "cache_hit_rate": round(cache_hit_rate, 2),
             "cache_size": cache_size,
             "memory_cache_size": len(self.cache),
+            "memory_cache": self.cache.snapshot(),
+            "l2_cache": {**self.l2_stats, "pending_writes": len(self._l2_pending)},
+            "tag_invalidations": dict(self.invalidations),
+            "maintenance": [m.report() for m in self.maintenance.values()],
             "slow_queries": slow_queries,
-            "total_queries": self.cache_stats["hits"] + self.cache_stats["misses"]
+            "slow_call_sites": [{k: v for k, v in site.items() if k != "profile"} for site in self.slow_call_sites()],
+            "total_queries": self.cache_stats["hits"] + self.cache_stats["misses"],
+            "coalesced_calls": self.cache_stats["coalesced"],
+            "stale_served": self.cache_stats["stale_served"],
         }
     
     def cleanup_cache(self):
         """Очистка устаревшего кэша"""
         # Очистка памяти
-        current_time = datetime.now()
-        expired_keys = [key for key, entry in self.cache.items() 
-                       if current_time >= entry["expires_at"]]
-        
-        for key in expired_keys:
-            del self.cache[key]
+        memory_cleaned = self.cache.purge_expired()
         
-        # Очистка БД
-        conn = sqlite3.connect('performance.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM cache_entries WHERE expires_at <= datetime('now')")
-        deleted_count = cursor.rowcount
-        
-        conn.commit()
-        conn.close()
+        # Очистка БД: короткими порциями, не блокируя запись надолго
+        conn = sqlite3.connect(self.db_path)
+        try:
+            deleted_count = self._sweep_expired(conn)
+        finally:
+            conn.close()
         
-        return {"memory_cleaned": len(expired_keys), "db_cleaned": deleted_count}
+        return {"memory_cleaned": memory_cleaned, "db_cleaned": deleted_count}
     
-    def optimize_large_dataset_query(self, query, params, batch_size=1000):
-        """Оптимизация запросов к большим данным"""
-        results = []
-        offset = 0
-        
-        while True:
-            # Добавление LIMIT и OFFSET к запросу
-            paginated_query = f"{query} LIMIT {batch_size} OFFSET {offset}"
-            
-            conn = sqlite3.connect('performance.db')
-            cursor = conn.cursor()
-            
-            if params:
-                cursor.execute(paginated_query, params)
-            else:
-                cursor.execute(paginated_query)
-            
-            batch_results = cursor.fetchall()
+    def optimize_large_dataset_query(self, query, params=None, batch_size=1000, db_path='performance.db'):
+        """
+        Потоковое чтение больших выборок: генератор отдаёт строки пачками fetchmany
+        по одному курсору, без OFFSET и без накопления всего результата в памяти
+        """
+        conn = sqlite3.connect(db_path)
+        try:
+            cursor = conn.execute(query, params or ())
+            while True:
+                batch_results = cursor.fetchmany(batch_size)
+                if not batch_results:
+                    break
+                yield from batch_results
+        finally:
             conn.close()
-            
-            if not batch_results:
-                break
-            
-            results.extend(batch_results)
-            offset += batch_size
-            
-            # Предотвращение блокировки
-            time.sleep(0.001)
-        
-        return results
 
 # Глобальный экземпляр
 performance_optimizer = PerformanceOptimizer()
 
 # Примеры использования декораторов
-@performance_optimizer.cache_result(ttl=600)
+@performance_optimizer.cache_result(ttl=3600, tags=("events", "incidents"))
 def get_analytics_data():
     """Пример кэшированной функции аналитики"""
     # Имитация тяжелых вычислений
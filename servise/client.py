@@ -1,23 +1,175 @@
 # servise/client.py
 
 import os
+import queue
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from .metrics import observe_send
 
-def notify_admin(message: str):
+_STOP = object()
+
+class NotificationDispatcher:
     """
-    Уведомление администратора.
-    По умолчанию — консоль. Если заданы TELEGRAM_TOKEN и TELEGRAM_CHAT_ID — отправка в Telegram.
+    Неблокирующая доставка уведомлений администратору.
+    Путь запроса только кладёт сообщение в ограниченную очередь (submit); пул
+    воркеров отправляет их через общую keep-alive сессию requests, склеивая
+    всплески в сводки (digest), с повтором и экспоненциальной задержкой.
     """
-    token = os.getenv("TELEGRAM_TOKEN", "")
-    chat_id = os.getenv("TELEGRAM_CHAT_ID", "")
-    if token and chat_id:
+
+    def __init__(self, token=None, chat_id=None, api_url=None, queue_size=1000, workers=2,
+                 coalesce_ms=500, digest_max=20, max_retries=3, backoff=0.5, timeout=5.0):
+        self.token = token if token is not None else os.getenv("TELEGRAM_TOKEN", "")
+        self.chat_id = chat_id if chat_id is not None else os.getenv("TELEGRAM_CHAT_ID", "")
+        self.api_url = (api_url or os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")).rstrip("/")
+        self.workers = workers
+        self.coalesce = coalesce_ms / 1000.0
+        self.digest_max = digest_max
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._session = None
+        self._lock = threading.Lock()
+        self._latency_total = 0.0
+        self.stats = {
+            "enqueued": 0, "dropped": 0, "sent": 0, "digests": 0,
+            "deliveries": 0, "retries": 0, "failed": 0,
+        }
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(self.workers - len(self._threads)):
+                thread = threading.Thread(target=self._run, name=f"notify-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, message: str) -> bool:
+        """Постановка уведомления в очередь; False, если очередь переполнена"""
+        if len(self._threads) < self.workers:
+            self.start()
         try:
-            url = f"https://api.telegram.org/bot{token}/sendMessage"
-            resp = requests.post(url, json={"chat_id": chat_id, "text": message}, timeout=5)
-            resp.raise_for_status()
-            print("[🔔] Уведомление отправлено в Telegram")
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                self._queue.task_done()
+                return
+            batch = [first]
+            stop_after = False
+            deadline = time.monotonic() + self.coalesce
+            while len(batch) < self.digest_max:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stop_after = True
+                    break
+                batch.append(item)
+            try:
+                self._deliver(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop_after:
+                return
+
+    @staticmethod
+    def _digest(batch):
+        shown = batch[:10]
+        lines = [f"Сводка: {len(batch)} оповещений о высоком риске"]
+        lines += [f"• {message}" for message in shown]
+        if len(batch) > len(shown):
+            lines.append(f"… и ещё {len(batch) - len(shown)}")
+        return "\n".join(lines)
+
+    def _send(self, text):
+        if not (self.token and self.chat_id):
+            print(f"[🔔] Уведомление администратору: {text}")
             return
-        except Exception as e:
-            print(f"[✘] Ошибка отправки в Telegram: {e}")
+        url = f"{self.api_url}/bot{self.token}/sendMessage"
+        resp = self._get_session().post(url, json={"chat_id": self.chat_id, "text": text}, timeout=self.timeout)
+        resp.raise_for_status()
+
+    def _deliver(self, batch):
+        text = batch[0] if len(batch) == 1 else self._digest(batch)
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self._send(text)
+            except Exception as e:
+                observe_send(time.perf_counter() - start, ok=False)
+                if attempt == self.max_retries:
+                    self._count("failed", len(batch))
+                    print(f"[✘] Уведомление не доставлено после {attempt + 1} попыток: {e}")
+                    return
+                self._count("retries")
+                time.sleep(self.backoff * (2 ** attempt))
+                continue
+            elapsed = time.perf_counter() - start
+            observe_send(elapsed, ok=True)
+            with self._lock:
+                self._latency_total += elapsed
+                self.stats["deliveries"] += 1
+                self.stats["sent"] += len(batch)
+                if len(batch) > 1:
+                    self.stats["digests"] += 1
+            return
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def metrics(self):
+        """Метрики доставки: счётчики, глубина очереди, средняя задержка отправки"""
+        with self._lock:
+            snapshot = dict(self.stats)
+            deliveries = snapshot["deliveries"]
+            snapshot["avg_send_ms"] = round(self._latency_total / deliveries * 1000, 2) if deliveries else 0
+        snapshot["queue_depth"] = self._queue.qsize()
+        return snapshot
 
-    print(f"[🔔] Уведомление администратору: {message}")
+    def stop(self, timeout=10.0):
+        """Дозакрытие: отправка уже поставленных уведомлений и остановка воркеров"""
+        with self._lock:
+            threads = [t for t in self._threads if t.is_alive()]
+        for _ in threads:
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                break
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._session is not None:
+                self._session.close()
+                self._session = None
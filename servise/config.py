@@ -8,9 +8,45 @@ AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "audit.log")
 RISK_REPORT_PATH = os.getenv("RISK_REPORT_PATH", "risk_report.json")
 INCIDENT_LOG_PATH = os.getenv("INCIDENT_LOG_PATH", "incident.log")
 
+# Период проверки файла политики на изменения (сек); 0 — без горячей перезагрузки
+POLICY_RELOAD_INTERVAL = float(os.getenv("POLICY_RELOAD_INTERVAL", "2"))
+
 # Порог реагирования
 RISK_THRESHOLD = int(os.getenv("RISK_THRESHOLD", "50"))
 
+# Подавление повторных инцидентов: не более ALERT_BURST на отпечаток за ALERT_DEDUP_WINDOW сек
+ALERT_DEDUP = os.getenv("ALERT_DEDUP", "1").lower() in ("1", "true", "yes")
+ALERT_DEDUP_WINDOW = float(os.getenv("ALERT_DEDUP_WINDOW", "60"))
+ALERT_BURST = int(os.getenv("ALERT_BURST", "5"))
+
+# Корреляция событий в скользящих окнах (правила — в разделе correlation_rules политики).
+# По умолчанию выключена: ключ CORRELATION_KEY должен указывать на поле, определяющее
+# участника, — по умолчанию ip события. Поле source этого сервиса — только internal/external,
+# и с ним любые 5 внешних login_failure за минуту дали бы инцидент brute_force.
+# События без значения ключа не коррелируются.
+CORRELATION = os.getenv("CORRELATION", "0").lower() in ("1", "true", "yes")
+CORRELATION_KEY = os.getenv("CORRELATION_KEY", "ip")
+CORRELATION_MAX_SOURCES = int(os.getenv("CORRELATION_MAX_SOURCES", "10000"))
+
+# Максимальный размер пакета для /api/events/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+
+# Отложенная запись событий (write-behind) с групповым коммитом
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "50"))
+
+# Метрики Prometheus на /metrics (нужен prometheus-client)
+METRICS = os.getenv("METRICS", "1").lower() in ("1", "true", "yes")
+
 # Уведомления (заглушки/расширяемо)
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
+
+# Диспетчер уведомлений: очередь, воркеры, склейка всплесков в сводки, повторы
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "1000"))
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "2"))
+NOTIFY_COALESCE_MS = int(os.getenv("NOTIFY_COALESCE_MS", "500"))
+NOTIFY_DIGEST_MAX = int(os.getenv("NOTIFY_DIGEST_MAX", "20"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
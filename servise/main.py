@@ -2,8 +2,11 @@
 
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from . import metrics
 from .router import router
+from .processor import dispatcher, policy_watcher, writer
+from database import RetentionWorker, async_db, db
 import os
 
 app = FastAPI(
@@ -14,10 +17,42 @@ app = FastAPI(
 
 app.include_router(router, prefix="/api")
 
+# Срок хранения партиций применяется в фоне, а не при записи
+retention = RetentionWorker(db) if db.retention_days else None
+
+@app.on_event("startup")
+def start_background_tasks():
+    if writer is not None:
+        writer.start()
+    if policy_watcher is not None:
+        policy_watcher.start()
+    if retention is not None:
+        retention.start()
+
+@app.on_event("shutdown")
+def stop_background_tasks():
+    if policy_watcher is not None:
+        policy_watcher.stop()
+    if retention is not None:
+        retention.stop()
+    # Дозапись очереди write-behind перед остановкой
+    if writer is not None:
+        writer.stop()
+    dispatcher.stop()
+    async_db.close()
+
 # Статические файлы
 if os.path.exists("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    if body is None:
+        return Response("metrics disabled or prometheus-client not installed\n", status_code=503,
+                        media_type="text/plain")
+    return Response(body, media_type=content_type)
+
 @app.get("/")
 def dashboard():
     return FileResponse("static/dashboard.html")
@@ -0,0 +1,135 @@
+# servise/metrics.py
+
+import time
+from collections import Counter as Tally
+from contextlib import nullcontext
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # без prometheus-client сервис работает, /metrics отвечает 503
+    CollectorRegistry = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+from .config import METRICS
+
+# Границы корзин (сек): горячий путь — микросекунды, запись и отправка — до секунд
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+IO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ENABLED = METRICS and CollectorRegistry is not None
+
+
+class _QueueCollector:
+    """Глубины очередей и счётчики конкуренции SQLite — считываются в момент опроса"""
+
+    def __init__(self):
+        self.queues = {}
+        self.databases = []
+
+    def collect(self):
+        depth = GaugeMetricFamily("cyberlab_queue_depth", "Глубина внутренних очередей", labels=["queue"])
+        for name, size in self.queues.items():
+            depth.add_metric([name], size())
+        yield depth
+        contention = CounterMetricFamily(
+            "cyberlab_sqlite_contention", "Конкуренция за блокировку SQLite при записи", labels=["kind"],
+        )
+        totals = Tally()
+        for database in self.databases:
+            totals.update(database.contention)
+        for kind in ("busy", "locked", "retries", "failures"):
+            contention.add_metric([kind], totals[kind])
+        yield contention
+
+
+if ENABLED:
+    registry = CollectorRegistry()
+    PROCESS_SECONDS = Histogram(
+        "cyberlab_process_event_seconds", "Обработка события или пакета целиком", ["mode"],
+        buckets=FAST_BUCKETS, registry=registry,
+    )
+    SCORING_SECONDS = Histogram(
+        "cyberlab_risk_scoring_seconds", "Оценка риска (RiskEngine)", ["mode"],
+        buckets=FAST_BUCKETS, registry=registry,
+    )
+    DB_INSERT_SECONDS = Histogram(
+        "cyberlab_db_insert_seconds", "Транзакция записи событий и инцидентов",
+        buckets=IO_BUCKETS, registry=registry,
+    )
+    NOTIFY_SEND_SECONDS = Histogram(
+        "cyberlab_notification_send_seconds", "Отправка уведомления администратору", ["outcome"],
+        buckets=IO_BUCKETS, registry=registry,
+    )
+    EVENTS_TOTAL = Counter(
+        "cyberlab_events", "Обработанные события", ["severity", "action"], registry=registry,
+    )
+    _collector = _QueueCollector()
+    registry.register(_collector)
+else:
+    registry = None
+    PROCESS_SECONDS = SCORING_SECONDS = DB_INSERT_SECONDS = NOTIFY_SEND_SECONDS = EVENTS_TOTAL = None
+
+_NOOP = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("target", "start")
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+        return False
+
+
+def timed(histogram, *labels):
+    """Замер длительности блока в гистограмму; без метрик — общий пустой контекст"""
+    if not ENABLED:
+        return _NOOP
+    return _Timer(histogram.labels(*labels) if labels else histogram)
+
+
+def observe_send(seconds, ok):
+    if ENABLED:
+        NOTIFY_SEND_SECONDS.labels("ok" if ok else "error").observe(seconds)
+
+
+def count_events(events, results, severities=()):
+    """
+    Счётчики по severity/action; пакет сначала сводится локально — одно inc на пару меток.
+    severity приходит от клиента: значения вне severities (ключи severity_weights политики)
+    считаются как "other", иначе любой клиент мог бы плодить временные ряды.
+    """
+    if not ENABLED:
+        return
+    tally = Tally(
+        (severity if (severity := event.get("severity")) in severities else "other", result["action"])
+        for event, result in zip(events, results)
+    )
+    for (severity, action), count in tally.items():
+        EVENTS_TOTAL.labels(severity, action).inc(count)
+
+
+def watch_queue(name, size):
+    """Регистрация очереди для gauge cyberlab_queue_depth: size() -> int"""
+    if ENABLED:
+        _collector.queues[name] = size
+
+
+def watch_database(database):
+    """Длительность записи и счётчики busy/locked базы"""
+    if ENABLED:
+        _collector.databases.append(database)
+        database.add_write_observer(lambda seconds, events, incidents: DB_INSERT_SECONDS.observe(seconds))
+
+
+def render():
+    """(тело, content-type) для ответа /metrics; тело None, если метрики выключены"""
+    if not ENABLED:
+        return None, CONTENT_TYPE_LATEST
+    return generate_latest(registry), CONTENT_TYPE_LATEST
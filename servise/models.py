@@ -1,5 +1,6 @@
 # servise/models.py
 
+from typing import Optional
 from pydantic import BaseModel, Field
 
 class Event(BaseModel):
@@ -7,6 +8,7 @@ class Event(BaseModel):
     source: str = Field(..., description="Источник события, напр. internal/external")
     severity: str = Field(..., description="Уровень важности: low/medium/high/critical")
     message: str = Field(..., description="Описание события")
+    ip: Optional[str] = Field(None, description="Адрес участника (IP) — ключ корреляции по умолчанию")
 
 class EventResult(BaseModel):
     status: str
@@ -1,41 +1,263 @@
 # servise/processor.py
 
-from typing import Dict
-from .config import RISK_POLICY_PATH, RISK_THRESHOLD
-from .client import notify_admin
-from tools.risk_engine import RiskEngine
-from database import db
+import asyncio
+from typing import Dict, List
+from .config import (
+    RISK_POLICY_PATH, POLICY_RELOAD_INTERVAL, RISK_THRESHOLD, WRITE_BEHIND, WRITE_BEHIND_QUEUE_SIZE,
+    WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_MS, NOTIFY_QUEUE_SIZE, NOTIFY_WORKERS,
+    NOTIFY_COALESCE_MS, NOTIFY_DIGEST_MAX, NOTIFY_MAX_RETRIES, ALERT_DEDUP, ALERT_DEDUP_WINDOW,
+    ALERT_BURST, CORRELATION, CORRELATION_KEY, CORRELATION_MAX_SOURCES,
+)
+from . import metrics
+from .client import NotificationDispatcher
+from .suppression import AlertSuppressor, alert_fingerprint
+from .writer import WriteBehindWriter
+from tools.correlation import Correlator, rules_from_policy
+from tools.risk_engine import PolicyWatcher, RiskEngine
+from database import async_db, db
+from performance_optimizer import performance_optimizer
 
 # Инициализация движка рисков один раз
 engine = RiskEngine(RISK_POLICY_PATH)
 
-def process_event(event: Dict) -> Dict:
+# Горячая перезагрузка политики без перезапуска сервиса
+policy_watcher = PolicyWatcher(engine, interval=POLICY_RELOAD_INTERVAL) if POLICY_RELOAD_INTERVAL > 0 else None
+
+# Фоновая запись с групповым коммитом (если включена)
+writer = WriteBehindWriter(
+    db,
+    max_queue=WRITE_BEHIND_QUEUE_SIZE,
+    batch_size=WRITE_BEHIND_BATCH_SIZE,
+    flush_interval_ms=WRITE_BEHIND_FLUSH_MS,
+) if WRITE_BEHIND else None
+
+# Уведомления: путь запроса только ставит их в очередь
+dispatcher = NotificationDispatcher(
+    queue_size=NOTIFY_QUEUE_SIZE,
+    workers=NOTIFY_WORKERS,
+    coalesce_ms=NOTIFY_COALESCE_MS,
+    digest_max=NOTIFY_DIGEST_MAX,
+    max_retries=NOTIFY_MAX_RETRIES,
+)
+
+# Подавление повторных инцидентов при всплесках (сканирование и т.п.)
+suppressor = AlertSuppressor(window=ALERT_DEDUP_WINDOW, burst=ALERT_BURST) if ALERT_DEDUP else None
+
+# Корреляция: производные события (перебор паролей, скан → доступ) идут в ту же обработку
+correlator = Correlator(
+    rules_from_policy(engine.policy),
+    key_field=CORRELATION_KEY,
+    max_sources=CORRELATION_MAX_SOURCES,
+) if CORRELATION else None
+if correlator is not None:
+    # Правила уже проверены validate_policy при перезагрузке
+    engine.add_reload_listener(lambda policy: correlator.set_rules(rules_from_policy(policy)))
+
+def _sync_stats_labels(policy):
+    """Свои счётчики в /api/stats — у значений из весов политики, прочие severity/type идут в "other\""""
+    db.set_stats_labels(policy.get("severity_weights") or None, policy.get("type_weights") or None)
+
+_sync_stats_labels(engine.policy)
+engine.add_reload_listener(_sync_stats_labels)
+
+# Кэш аналитики (теги events/incidents) сбрасывает процесс, который пишет события;
+# версии тегов уходят в performance.db и видны остальным процессам
+performance_optimizer.bind_database(db)
+
+# Метрики: длительность записи, конкуренция SQLite, глубины очередей
+metrics.watch_database(db)
+metrics.watch_queue("notifications", dispatcher.qsize)
+if writer is not None:
+    metrics.watch_queue("write_behind", writer.qsize)
+
+def _known_severities():
+    """Допустимые значения метки severity — ключи severity_weights текущей политики"""
+    return engine.policy.get("severity_weights", {})
+
+def _reserve(count: int) -> int:
     """
-    Принимает событие, оценивает риск, пишет аудит, при необходимости — инцидент и уведомление.
-    Возвращает статус, риск и выполненное действие.
+    Место в очереди write-behind занимается до подавления и корреляции: событие,
+    отклонённое с 429, не расходует токены подавления и не попадает в окна корреляции.
+    """
+    return writer.reserve(count) if writer is not None else 0
+
+def _release(reserved: int):
+    if reserved:
+        writer.release(reserved)
+
+def _persist(events: List[Dict], incidents: List[Dict], reserved: int = 0):
+    """Запись событий и инцидентов: сразу или через очередь write-behind (место занято _reserve)"""
+    if writer is not None:
+        writer.submit([db.event_row(e) for e in events], [db.incident_row(i) for i in incidents], reserved)
+    else:
+        db.log_batch(events, incidents)
+
+async def _persist_async(events: List[Dict], incidents: List[Dict], reserved: int = 0):
+    """Асинхронная запись: очередь write-behind или выделенный поток записи"""
+    if writer is not None:
+        _persist(events, incidents, reserved)  # только постановка в очередь
+    else:
+        await async_db.log_batch(events, incidents)
+
+def _react(event: Dict, risk: Dict):
+    """
+    Реакция на оценку: (инцидент или None, действие).
+    Повторы одного отпечатка сверх лимита подавляются; их число попадает в следующий инцидент.
     """
-    # Оценка риска
-    risk = engine.assess_event(event)
+    if risk.get("risk_score", 0) < RISK_THRESHOLD:
+        return None, "no_action"
+    if suppressor is None:
+        return risk, "incident_logged_and_notified"
+    allowed, suppressed = suppressor.check(alert_fingerprint(event))
+    if not allowed:
+        return None, "suppressed"
+    return ({**risk, "suppressed_count": suppressed} if suppressed else risk), "incident_logged_and_notified"
+
+def _suppressed_note(incident: Dict) -> str:
+    count = incident.get("suppressed_count", 0)
+    return f" (+{count} подавленных повторов)" if count else ""
+
+def _assess(event: Dict):
+    """Оценка одного события: (строка для events, инцидент или None, результат, уведомление)"""
+    with metrics.timed(metrics.SCORING_SECONDS, "single"):
+        risk = engine.assess_event(event)
     risk_score = risk.get("risk_score", 0)
-    
     # Добавляем risk_score в event для логирования
     event_with_risk = {**event, "risk_score": risk_score}
-    
-    # Запись события в БД
-    db.log_event(event_with_risk)
-
-    # Реакция на высокий риск
-    if risk_score >= RISK_THRESHOLD:
-        # Запись инцидента в БД
-        db.log_incident(risk)
-        # Уведомление
-        notify_admin(f"Высокий риск ({risk_score}): {event.get('message')}")
-        action = "incident_logged_and_notified"
-    else:
-        action = "no_action"
 
-    return {
+    incident, action = _react(event, risk)
+    message = None
+    if incident is not None:
+        message = f"Высокий риск ({risk_score}): {event.get('message')}{_suppressed_note(incident)}"
+
+    result = {
         "status": "processed",
         "risk_score": int(risk_score),
         "action": action,
     }
+    return event_with_risk, incident, result, message
+
+def _assess_batch(events: List[Dict]):
+    """Оценка пачки за один проход: (строки, инциденты, результаты, сводное уведомление)"""
+    rows = []
+    incidents = []
+    results = []
+    with metrics.timed(metrics.SCORING_SECONDS, "batch"):
+        risks = engine.assess_batch(events)
+    for event, risk in zip(events, risks):
+        risk_score = risk.get("risk_score", 0)
+        rows.append({**event, "risk_score": risk_score})
+        incident, action = _react(event, risk)
+        if incident is not None:
+            incidents.append(incident)
+        results.append({
+            "status": "processed",
+            "risk_score": int(risk_score),
+            "action": action,
+        })
+
+    message = None
+    if incidents:
+        top = max(incidents, key=lambda r: r.get("risk_score", 0))
+        suppressed = sum(i.get("suppressed_count", 0) for i in incidents)
+        message = (
+            f"Высокий риск в пакете: {len(incidents)} из {len(events)} событий, "
+            f"максимум ({top.get('risk_score')}): {top['event'].get('message')}"
+            + (f" (+{suppressed} подавленных повторов)" if suppressed else "")
+        )
+    return rows, incidents, results, message
+
+def _correlate(events: List[Dict], rows: List[Dict], incidents: List[Dict], messages: List[str]):
+    """Производные события корреляции: оцениваются и пишутся вместе с исходными"""
+    if correlator is None:
+        return
+    for derived in correlator.feed(events):
+        row, incident, _, message = _assess(derived)
+        rows.append(row)
+        if incident:
+            incidents.append(incident)
+        if message:
+            messages.append(message)
+
+def _prepare(event: Dict):
+    """Событие и его производные: (строки, инциденты, уведомления, результат)"""
+    row, incident, result, message = _assess(event)
+    rows, incidents, messages = [row], [incident] if incident else [], [message] if message else []
+    _correlate([event], rows, incidents, messages)
+    return rows, incidents, messages, result
+
+def _prepare_batch(events: List[Dict]):
+    """Пакет и его производные: (строки, инциденты, уведомления, результаты)"""
+    rows, incidents, results, message = _assess_batch(events)
+    messages = [message] if message else []
+    _correlate(events, rows, incidents, messages)
+    return rows, incidents, messages, results
+
+def process_event(event: Dict) -> Dict:
+    """
+    Принимает событие, оценивает риск, пишет аудит, при необходимости — инцидент и уведомление.
+    Возвращает статус, риск и выполненное действие.
+    """
+    with metrics.timed(metrics.PROCESS_SECONDS, "single"):
+        reserved = _reserve(1)
+        try:
+            rows, incidents, messages, result = _prepare(event)
+        except BaseException:
+            _release(reserved)
+            raise
+        # Запись события (и инцидента) в БД одной транзакцией
+        _persist(rows, incidents, reserved)
+        for message in messages:
+            dispatcher.submit(message)
+    metrics.count_events([event], [result], _known_severities())
+    return result
+
+def process_events(events: List[Dict]) -> List[Dict]:
+    """
+    Пакетная обработка: оценка риска всех событий за один проход,
+    запись событий и инцидентов одной транзакцией и одно сводное уведомление.
+    Возвращает результаты в порядке входных событий.
+    """
+    with metrics.timed(metrics.PROCESS_SECONDS, "batch"):
+        reserved = _reserve(len(events))
+        try:
+            rows, incidents, messages, results = _prepare_batch(events)
+        except BaseException:
+            _release(reserved)
+            raise
+        _persist(rows, incidents, reserved)
+        for message in messages:
+            dispatcher.submit(message)
+    metrics.count_events(events, results, _known_severities())
+    return results
+
+async def process_event_async(event: Dict) -> Dict:
+    """Асинхронный вариант process_event: БД и уведомления не блокируют цикл событий"""
+    with metrics.timed(metrics.PROCESS_SECONDS, "single"):
+        reserved = _reserve(1)
+        try:
+            rows, incidents, messages, result = _prepare(event)
+        except BaseException:
+            _release(reserved)
+            raise
+        await _persist_async(rows, incidents, reserved)
+        for message in messages:
+            dispatcher.submit(message)
+    metrics.count_events([event], [result], _known_severities())
+    return result
+
+async def process_events_async(events: List[Dict]) -> List[Dict]:
+    """Асинхронный вариант process_events; оценка пакета (до MAX_BATCH_SIZE событий) — в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    with metrics.timed(metrics.PROCESS_SECONDS, "batch"):
+        reserved = _reserve(len(events))
+        try:
+            rows, incidents, messages, results = await loop.run_in_executor(None, _prepare_batch, events)
+        except BaseException:
+            _release(reserved)
+            raise
+        await _persist_async(rows, incidents, reserved)
+        for message in messages:
+            dispatcher.submit(message)
+    metrics.count_events(events, results, _known_severities())
+    return results
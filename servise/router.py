@@ -1,65 +1,198 @@
 # servise/router.py
 
-from fastapi import APIRouter, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from .config import MAX_BATCH_SIZE
 from .models import Event, EventResult
-from .processor import process_event
-from database import db
-import sqlite3
+from .processor import dispatcher, engine, process_event_async, process_events_async, suppressor, correlator
+from .writer import QueueFullError
+from database import async_db, db, to_epoch_ms
+import base64
+import binascii
+import csv
+import io
+import json
 
 router = APIRouter(tags=["events"])
 
 @router.get("/status")
-def status():
+async def status():
     return {"status": "ok"}
 
 @router.get("/health")
-def health():
-    return {"status": "healthy", "service": "cyber-security-laboratory"}
+async def health():
+    return {
+        "status": "healthy",
+        "service": "cyber-security-laboratory",
+        "policy": engine.policy_info(),
+        "notifications": dispatcher.metrics(),
+        "suppression": suppressor.metrics() if suppressor is not None else None,
+        "correlation": correlator.metrics() if correlator is not None else None,
+    }
 
 @router.post("/event", response_model=EventResult)
-def receive_event(event: Event):
+async def receive_event(event: Event):
     try:
-        result = process_event(event.model_dump())
+        result = await process_event_async(event.model_dump())
         return EventResult(**result)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing error: {e}")
+
+def _parse_batch(body: bytes, content_type: str) -> List[dict]:
+    """Разбор тела пакета: JSON-массив или NDJSON (одно событие на строку)"""
+    text = body.decode("utf-8")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("Ожидается массив событий")
+    return items
+
+@router.post("/events/batch", response_model=List[EventResult])
+async def receive_events_batch(request: Request):
+    try:
+        items = _parse_batch(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {e}")
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: max {MAX_BATCH_SIZE} events")
+
+    events = []
+    for index, item in enumerate(items):
+        try:
+            events.append(Event.model_validate(item).model_dump())
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={"index": index, "errors": e.errors()})
+
+    try:
+        results = await process_events_async(events)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {e}")
+    return [EventResult(**result) for result in results]
+
+def _parse_time(value: Optional[str], name: str) -> Optional[int]:
+    """Граница интервала: epoch-ms или ISO 8601"""
+    try:
+        return to_epoch_ms(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid '{name}': expected epoch-ms or ISO 8601")
+
+def _encode_cursor(row) -> str:
+    """Непрозрачный курсор по последней строке страницы: (timestamp, id)"""
+    return base64.urlsafe_b64encode(f"{row[1]}:{row[0]}".encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.split(":")
+        return int(timestamp), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _page(rows, limit: int):
+    return _encode_cursor(rows[-1]) if len(rows) == limit else None
 
 @router.get("/events")
-def get_events(limit: int = 100):
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM events ORDER BY timestamp DESC LIMIT ?", (limit,))
-    events = cursor.fetchall()
-    conn.close()
-    return {"events": events}
+async def get_events(
+    limit: int = Query(100, ge=1, le=10000),
+    from_: Optional[str] = Query(None, alias="from", description="Начало интервала (epoch-ms или ISO 8601)"),
+    to: Optional[str] = Query(None, description="Конец интервала, не включительно"),
+    severity: Optional[str] = None,
+    type_: Optional[str] = Query(None, alias="type"),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+):
+    events = await async_db.query_events(
+        start_ms=_parse_time(from_, "from"),
+        end_ms=_parse_time(to, "to"),
+        severity=severity,
+        event_type=type_,
+        limit=limit,
+        before=_decode_cursor(cursor),
+    )
+    return {"events": events, "next_cursor": _page(events, limit)}
+
+def _export_ndjson(rows):
+    columns = db.EVENT_COLUMNS
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+
+def _export_csv(rows, chunk_rows: int = 1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(db.EVENT_COLUMNS)
+    pending = 1
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+@router.get("/events/export")
+def export_events(
+    format_: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    severity: Optional[str] = None,
+    type_: Optional[str] = Query(None, alias="type"),
+):
+    """Потоковая выгрузка событий (NDJSON или CSV) для передачи в SIEM"""
+    rows = db.iter_events(
+        start_ms=_parse_time(from_, "from"),
+        end_ms=_parse_time(to, "to"),
+        severity=severity,
+        event_type=type_,
+    )
+    if format_ == "csv":
+        body, media_type = _export_csv(rows), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _export_ndjson(rows), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="events.{format_}"'},
+    )
 
 @router.get("/incidents")
-def get_incidents(limit: int = 50):
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM incidents ORDER BY timestamp DESC LIMIT ?", (limit,))
-    incidents = cursor.fetchall()
-    conn.close()
-    return {"incidents": incidents}
+async def get_incidents(
+    limit: int = Query(50, ge=1, le=10000),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
+    incidents = await async_db.query_incidents(
+        start_ms=_parse_time(from_, "from"),
+        end_ms=_parse_time(to, "to"),
+        limit=limit,
+        before=_decode_cursor(cursor),
+    )
+    return {"incidents": incidents, "next_cursor": _page(incidents, limit)}
 
-@router.get("/stats")
-def get_stats():
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM events")
-    total_events = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM incidents")
-    total_incidents = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT AVG(risk_score) FROM events WHERE risk_score > 0")
-    avg_risk = cursor.fetchone()[0] or 0
-    
-    conn.close()
-    
+@router.get("/partitions")
+async def get_partitions():
+    """Партиции событий (DB_PARTITION) и срок их хранения"""
     return {
-        "total_events": total_events,
-        "total_incidents": total_incidents,
-        "average_risk_score": round(avg_risk, 2)
+        "scheme": db.partition,
+        "retention_days": db.retention_days,
+        "partitions": [
+            {"name": name, "from": start_ms, "to": end_ms} for name, start_ms, end_ms in await async_db.partitions()
+        ],
     }
+
+@router.get("/stats")
+async def get_stats(minutes: int = Query(0, ge=0, le=1440, description="Поминутная динамика за N минут")):
+    # Агрегаты обновляются при каждой вставке: без COUNT(*)/AVG по сырым таблицам
+    return await async_db.get_stats(minutes=minutes)
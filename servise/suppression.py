@@ -0,0 +1,60 @@
+# servise/suppression.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+def alert_fingerprint(event: dict) -> str:
+    """Отпечаток оповещения: тип, источник и текст события (без severity и времени)"""
+    key = "\x1f".join(str(event.get(field, "")) for field in ("type", "source", "message"))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+class AlertSuppressor:
+    """
+    Дедупликация и ограничение частоты инцидентов/уведомлений по отпечатку.
+    Для каждого отпечатка — token bucket: burst оповещений сразу, далее не чаще
+    burst за window секунд. Подавленные срабатывания считаются и передаются
+    в следующий пропущенный инцидент. Число отслеживаемых отпечатков ограничено (LRU).
+    """
+
+    def __init__(self, window: float = 60.0, burst: int = 5, max_keys: int = 10000):
+        self.window = window
+        self.burst = max(1, burst)
+        self.rate = self.burst / window if window > 0 else float("inf")
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # fp -> [tokens, updated_at, suppressed]
+        self._lock = threading.Lock()
+        self.stats = {"allowed": 0, "suppressed": 0, "evicted": 0}
+
+    def check(self, fingerprint: str, now: float = None):
+        """
+        Решение по срабатыванию: (allowed, suppressed_before).
+        suppressed_before — сколько срабатываний было подавлено с прошлого пропущенного.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(fingerprint)
+            if bucket is None:
+                bucket = [float(self.burst), now, 0]
+                self._buckets[fingerprint] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self.stats["evicted"] += 1
+            else:
+                self._buckets.move_to_end(fingerprint)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                suppressed, bucket[2] = bucket[2], 0
+                self.stats["allowed"] += 1
+                return True, suppressed
+            bucket[2] += 1
+            self.stats["suppressed"] += 1
+            return False, 0
+
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, "tracked": len(self._buckets)}
@@ -0,0 +1,160 @@
+# servise/writer.py
+
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Sequence, Tuple
+
+class QueueFullError(Exception):
+    """Очередь отложенной записи переполнена — клиенту следует повторить позже"""
+
+class WriteBehindWriter:
+    """
+    Отложенная запись событий (write-behind).
+    Запросы только кладут готовые строки в ограниченную очередь, фоновый поток
+    группирует их и коммитит пачкой каждые batch_size строк или flush_interval_ms.
+    Ёмкость считается в строках событий; пачка принимается целиком или отклоняется.
+    Место можно занять заранее (reserve) — до шагов с побочными эффектами,
+    которые не должны срабатывать для отклонённых событий.
+    """
+
+    def __init__(self, database, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval_ms: int = 50, max_retries: int = 3, autostart: bool = True):
+        self.db = database
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self.autostart = autostart
+
+        self._items: deque = deque()
+        self._pending = 0        # строк в очереди
+        self._reserved = 0       # строк, место под которые занято reserve
+        self._in_flight = 0      # строк в текущей пачке на записи
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self.stats = {"written": 0, "batches": 0, "rejected": 0, "dropped": 0, "errors": 0}
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _check_capacity(self, size: int, rejected: int):
+        if self._stopping:
+            raise QueueFullError("writer is shutting down")
+        if self._pending + self._reserved + size > self.max_queue:
+            self.stats["rejected"] += rejected
+            raise QueueFullError(f"write-behind queue is full ({self._pending}/{self.max_queue})")
+
+    def reserve(self, size: int) -> int:
+        """Занимает место под size строк до submit; QueueFullError, если места нет"""
+        size = max(size, 1)
+        with self._cond:
+            self._check_capacity(size, size)
+            self._reserved += size
+        return size
+
+    def release(self, reserved: int):
+        """Возврат места, занятого reserve, если строки так и не были поставлены"""
+        with self._cond:
+            self._reserved -= reserved
+
+    def submit(self, event_rows: Sequence[Tuple], incident_rows: Sequence[Tuple] = (), reserved: int = 0):
+        """
+        Постановка строк в очередь; QueueFullError, если места нет.
+        reserved — место, занятое reserve: такие строки принимаются и сверх него
+        (производные события корреляции уже принятого события).
+        """
+        size = max(len(event_rows), 1)
+        with self._cond:
+            self._reserved -= reserved
+            if not reserved:
+                self._check_capacity(size, len(event_rows))
+            elif self._stopping:
+                raise QueueFullError("writer is shutting down")
+            self._items.append((list(event_rows), list(incident_rows)))
+            self._pending += size
+            self._cond.notify()
+        if self.autostart and (self._thread is None or not self._thread.is_alive()):
+            self.start()
+
+    def qsize(self) -> int:
+        return self._pending
+
+    def _take_batch(self) -> Tuple[List[Tuple], List[Tuple], int]:
+        """Ожидание первой строки, затем добор до batch_size или истечения интервала"""
+        with self._cond:
+            while not self._items and not self._stopping:
+                self._cond.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while self._pending < self.batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            events, incidents, taken = [], [], 0
+            while self._items and taken < self.batch_size:
+                event_rows, incident_rows = self._items.popleft()
+                events.extend(event_rows)
+                incidents.extend(incident_rows)
+                taken += max(len(event_rows), 1)
+            self._pending -= taken
+            self._in_flight = taken
+            return events, incidents, taken
+
+    def _write(self, events, incidents):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.db.insert_rows(events, incidents)
+                self.stats["written"] += len(events)
+                self.stats["batches"] += 1
+                return
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[✘] Ошибка отложенной записи (попытка {attempt}): {e}")
+                time.sleep(0.05 * attempt)
+        self.stats["dropped"] += len(events)
+
+    def _run(self):
+        while True:
+            events, incidents, taken = self._take_batch()
+            if taken:
+                self._write(events, incidents)
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+                if self._stopping and not self._items:
+                    return
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Ожидание записи всего, что уже поставлено в очередь"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._items or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None or not self._thread.is_alive():
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        """Остановка с дозаписью очереди (вызывается при завершении сервиса)"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Поток не запускался или не успел — дописываем остаток синхронно
+        with self._cond:
+            items, self._items = list(self._items), deque()
+            self._pending = 0
+        for event_rows, incident_rows in items:
+            self._write(event_rows, incident_rows)
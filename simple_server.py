@@ -2,33 +2,15 @@
 import http.server
 import socketserver
 import json
-import sqlite3
 import os
-from datetime import datetime
 from urllib.parse import urlparse, parse_qs
+from database import db
+from performance_optimizer import performance_optimizer
+
+# Запись событий сбрасывает кэш аналитики с тегами events/incidents (и в других процессах)
+performance_optimizer.bind_database(db)
 
 class CyberLabHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.init_db()
-        super().__init__(*args, **kwargs)
-    
-    def init_db(self):
-        conn = sqlite3.connect('cyberlab.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                type TEXT NOT NULL,
-                source TEXT NOT NULL,
-                severity TEXT NOT NULL,
-                message TEXT NOT NULL,
-                risk_score INTEGER DEFAULT 0
-            )
-        ''')
-        conn.commit()
-        conn.close()
-    
     def do_GET(self):
         parsed = urlparse(self.path)
         
@@ -72,7 +54,7 @@ document.getElementById('risk').textContent=stats.avg_risk;
 const events=await fetch('/api/events').then(r=>r.json());
 document.getElementById('eventsList').innerHTML=events.events.map(e=>
 `<div style="border-left:4px solid #3498db;padding:10px;margin:10px 0;background:#f8f9fa">
-<b>${e[3]}</b> - ${e[5]} (Риск: ${e[6]})<br><small>${e[1]}</small></div>`).join('');
+<b>${e[3]}</b> - ${e[5]} (Риск: ${e[6]})<br><small>${new Date(e[1]).toLocaleString()}</small></div>`).join('');
 }
 setInterval(load,10000);load();
 </script></body></html>'''
@@ -88,22 +70,7 @@ setInterval(load,10000);load();
         try:
             event = json.loads(post_data.decode('utf-8'))
             risk_score = self.calculate_risk(event)
-            
-            conn = sqlite3.connect('cyberlab.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO events (timestamp, type, source, severity, message, risk_score)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                datetime.now().isoformat(),
-                event.get('type', 'unknown'),
-                event.get('source', 'unknown'),
-                event.get('severity', 'low'),
-                event.get('message', ''),
-                risk_score
-            ))
-            conn.commit()
-            conn.close()
+            db.log_event({**event, "risk_score": risk_score})
             
             self.send_json({
                 "status": "processed",
@@ -126,29 +93,14 @@ setInterval(load,10000);load();
         return score
     
     def send_stats(self):
-        conn = sqlite3.connect('cyberlab.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM events")
-        total = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT AVG(risk_score) FROM events WHERE risk_score > 0")
-        avg_risk = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
+        stats = db.get_stats()
         self.send_json({
-            "total_events": total,
-            "avg_risk": round(avg_risk, 1)
+            "total_events": stats["total_events"],
+            "avg_risk": round(stats["average_risk_score"], 1)
         })
     
     def send_events(self):
-        conn = sqlite3.connect('cyberlab.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM events ORDER BY timestamp DESC LIMIT 10")
-        events = cursor.fetchall()
-        conn.close()
-        
+        events = db.query_events(limit=10)
         self.send_json({"events": events})
     
     def send_json(self, data, status=200):
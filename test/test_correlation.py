@@ -0,0 +1,63 @@
+# test/test_correlation.py
+
+from tools.correlation import Correlator, DEFAULT_RULES, build_rules
+
+def make_correlator(**kwargs):
+    return Correlator(build_rules(DEFAULT_RULES), **kwargs)
+
+def test_threshold_fires_within_window_only():
+    correlator = make_correlator()
+    failure = {"type": "login_failure", "source": "10.0.0.1", "severity": "medium", "message": "fail"}
+    # Пять неудачных входов, но растянутых дольше окна — без срабатывания
+    for t in range(5):
+        assert correlator.observe(failure, now=t * 20) == []
+    derived = []
+    for t in range(5):
+        derived += correlator.observe(failure, now=1000 + t)
+    assert [d["type"] for d in derived] == ["brute_force"]
+    assert derived[0]["severity"] == "critical"
+    # Другой источник считается отдельно
+    assert correlator.observe({**failure, "source": "10.0.0.2"}, now=1005) == []
+
+def test_sequence_scan_then_access():
+    correlator = make_correlator()
+    scan = {"type": "network_scan", "source": "10.0.0.9", "message": "scan"}
+    access = {"type": "unauthorized_access", "source": "10.0.0.9", "message": "access"}
+    assert correlator.observe(access, now=0) == []
+    assert correlator.observe(scan, now=10) == []
+    assert [d["type"] for d in correlator.observe(access, now=100)] == ["scan_then_access"]
+    # Маркер сброшен после срабатывания; просроченный скан не коррелирует
+    assert correlator.observe(access, now=110) == []
+    correlator.observe(scan, now=200)
+    assert correlator.observe(access, now=600) == []
+
+def test_sources_are_bounded():
+    correlator = make_correlator(max_sources=3)
+    for i in range(10):
+        correlator.observe({"type": "login_failure", "source": f"h{i}"}, now=i)
+    metrics = correlator.metrics()
+    assert metrics["tracked_sources"] == 3
+    assert metrics["evicted"] == 7
+
+def test_events_without_key_are_not_correlated():
+    correlator = make_correlator(key_field="actor")
+    failure = {"type": "login_failure", "source": "external"}
+    assert sum((correlator.observe(failure, now=t) for t in range(10)), []) == []
+    assert correlator.metrics()["tracked_sources"] == 0
+
+def test_set_rules_replaces_rules_and_resets_windows():
+    correlator = make_correlator()
+    failure = {"type": "login_failure", "source": "10.0.0.1"}
+    for t in range(4):
+        correlator.observe(failure, now=t)
+    correlator.set_rules(build_rules([
+        {"name": "fast", "kind": "threshold", "event_type": "login_failure", "count": 2, "window": 10, "emit": "fast"},
+    ]))
+    assert correlator.observe(failure, now=5) == []
+    assert [d["type"] for d in correlator.observe(failure, now=6)] == ["fast"]
+
+def test_derived_events_carry_the_key():
+    correlator = make_correlator(key_field="ip")
+    failure = {"type": "login_failure", "source": "external", "ip": "198.51.100.4"}
+    derived = sum((correlator.observe(failure, now=t) for t in range(5)), [])
+    assert [(d["type"], d["ip"], d["source"]) for d in derived] == [("brute_force", "198.51.100.4", "external")]
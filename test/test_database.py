@@ -0,0 +1,251 @@
+# test/test_database.py
+
+import sqlite3
+import time
+import pytest
+from database import Database, RetentionWorker, SCHEMA_VERSION, SELECT_PAGE_TEMPLATE, now_ms, to_epoch_ms
+
+def test_legacy_text_timestamps_are_migrated(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, type TEXT NOT NULL,
+            source TEXT NOT NULL, severity TEXT NOT NULL, message TEXT NOT NULL, risk_score INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute(
+        "INSERT INTO events (timestamp, type, source, severity, message, risk_score) VALUES (?, ?, ?, ?, ?, ?)",
+        ("2025-09-12T10:00:00", "login_failure", "external", "high", "legacy", 55),
+    )
+    conn.commit()
+    conn.close()
+
+    database = Database(path)
+    assert database.fetch_one("PRAGMA user_version")[0] == SCHEMA_VERSION
+    row = database.fetch_one("SELECT id, timestamp, message FROM events")
+    assert row == (1, to_epoch_ms("2025-09-12T10:00:00"), "legacy")
+
+def test_ip_column_is_added_on_upgrade(tmp_path):
+    path = str(tmp_path / "v5.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp INTEGER NOT NULL, type TEXT NOT NULL,
+            source TEXT NOT NULL, severity TEXT NOT NULL, message TEXT NOT NULL, risk_score INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute("PRAGMA user_version = 5")
+    conn.commit()
+    conn.close()
+
+    database = Database(path)
+    database.log_event({"type": "login_failure", "message": "с адресом", "ip": "203.0.113.7"})
+    row = dict(zip(database.EVENT_COLUMNS, database.query_events()[0]))
+    assert (row["message"], row["ip"]) == ("с адресом", "203.0.113.7")
+
+def test_query_events_filters(tmp_path):
+    database = Database(str(tmp_path / "events.db"))
+    database.insert_rows([
+        database.event_row({"type": "network_scan", "severity": "high"}, timestamp=1000),
+        database.event_row({"type": "network_scan", "severity": "low"}, timestamp=2000),
+        database.event_row({"type": "login_failure", "severity": "high"}, timestamp=3000),
+    ])
+    assert [r[1] for r in database.query_events()] == [3000, 2000, 1000]
+    assert [r[1] for r in database.query_events(start_ms=1500, end_ms=3000)] == [2000]
+    assert [r[1] for r in database.query_events(severity="high", event_type="network_scan")] == [1000]
+
+    plan = database.fetch_all("EXPLAIN QUERY PLAN SELECT * FROM events WHERE severity = 'high' ORDER BY timestamp DESC")
+    assert "idx_events_severity" in str(plan)
+
+def test_keyset_pagination_walks_all_rows(tmp_path):
+    database = Database(str(tmp_path / "pages.db"))
+    # Одинаковые метки времени: порядок внутри страницы держится на id
+    database.insert_rows([database.event_row({"message": str(i)}, timestamp=1000 + i // 3) for i in range(10)])
+    seen, before = [], None
+    while True:
+        page = database.query_events(limit=4, before=before)
+        seen.extend(row[0] for row in page)
+        if len(page) < 4:
+            break
+        before = (page[-1][1], page[-1][0])
+    assert seen == list(range(10, 0, -1))
+
+    plan = database.fetch_all(
+        "EXPLAIN QUERY PLAN SELECT * FROM events WHERE (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT 4",
+        (1002, 7),
+    )
+    assert "idx_events_listing" in str(plan)
+
+def test_listing_page_is_chosen_from_covering_index(tmp_path):
+    database = Database(str(tmp_path / "listing.db"))
+    database.insert_rows([database.event_row({"message": str(i)}, timestamp=1000 + i) for i in range(5)])
+    page = SELECT_PAGE_TEMPLATE.format(table="events", where="WHERE (timestamp, id) < (?, ?)",
+                                       order="timestamp DESC, id DESC")
+    plan = str(database.fetch_all("EXPLAIN QUERY PLAN " + page, (1003, 4, 2)))
+    assert "USING COVERING INDEX idx_events_listing" in plan
+    assert [row[5] for row in database.fetch_all(page, (1003, 4, 2))] == ["2", "1"]
+
+def test_wide_listing_index_is_narrowed_on_upgrade(tmp_path):
+    path = str(tmp_path / "v4.db")
+    database = Database(path, partition="day")
+    database.insert_rows([database.event_row({"message": "x"}, timestamp=20000 * 86400000)])
+    conn = sqlite3.connect(path)
+    for table in ("events", "events_20241004"):
+        conn.execute(f"DROP INDEX idx_{table}_listing")
+        conn.execute(f"CREATE INDEX idx_{table}_listing ON {table}(timestamp, id, severity, type, source, risk_score)")
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    conn.close()
+
+    database = Database(path, partition="day")
+    assert database.fetch_one("PRAGMA user_version")[0] == SCHEMA_VERSION
+    for table in ("events", "events_20241004"):
+        columns = [row[2] for row in database.fetch_all(f"PRAGMA index_info(idx_{table}_listing)")]
+        assert columns == ["timestamp", "id"]
+
+def test_stats_rollup_matches_rebuild(tmp_path):
+    database = Database(str(tmp_path / "stats.db"))
+    database.log_event({"type": "network_scan", "severity": "high", "risk_score": 80})
+    database.log_event({"type": "system_event", "severity": "low", "risk_score": 0})
+    database.log_batch(
+        [{"type": "network_scan", "severity": "low", "risk_score": 20}] * 2,
+        [{"risk_score": 80}],
+    )
+    stats = database.get_stats(minutes=1)
+    assert stats["total_events"] == 4
+    assert stats["total_incidents"] == 1
+    assert stats["average_risk_score"] == 40.0
+    assert stats["by_severity"] == {"high": 1, "low": 3}
+    assert stats["by_type"] == {"network_scan": 3, "system_event": 1}
+    assert sum(bucket["events"] for bucket in stats["per_minute"]) == 4
+
+    database.rebuild_stats()
+    assert database.get_stats(minutes=1) == stats
+
+def test_stats_rollup_bounds_client_supplied_labels(tmp_path):
+    database = Database(str(tmp_path / "labels.db"))
+    database.log_batch([{"type": f"custom_{i}", "severity": f"level_{i % 7}"} for i in range(500)])
+    database.log_event({"type": "network_scan", "severity": "high"})
+    stats = database.get_stats()
+    assert stats["by_type"] == {"other": 500, "network_scan": 1}
+    assert stats["by_severity"] == {"other": 500, "high": 1}
+    assert database.fetch_one("SELECT COUNT(*) FROM stats_counters WHERE name LIKE '%:%'")[0] == 4
+
+    database.rebuild_stats()
+    assert database.get_stats() == stats
+
+    # Метки из политики: новый тип получает свой счётчик со следующей записи
+    database.set_stats_labels(types=["custom_1"])
+    database.log_event({"type": "custom_1", "severity": "high"})
+    assert database.get_stats()["by_type"] == {"other": 500, "network_scan": 1, "custom_1": 1}
+
+def test_iter_events_streams_in_time_order(tmp_path):
+    database = Database(str(tmp_path / "export.db"))
+    database.insert_rows([database.event_row({"message": str(i)}, timestamp=5000 - i // 2) for i in range(7)])
+    rows = list(database.iter_events(batch_size=2))
+    assert len(rows) == 7
+    assert [(r[1], r[0]) for r in rows] == sorted((r[1], r[0]) for r in rows)
+    assert [r[0] for r in database.iter_events(start_ms=4999, batch_size=2)] == [3, 4, 1, 2]
+
+def test_daily_partitions_fan_out_and_retention(tmp_path):
+    database = Database(str(tmp_path / "partitioned.db"), partition="day")
+    day = 86400000
+    base = 20000 * day
+    database.insert_rows([
+        database.event_row({"message": str(i), "severity": "high", "risk_score": 10}, timestamp=base + i * day // 2)
+        for i in range(6)
+    ])
+    assert [name for name, _, _ in database.partitions()] == [
+        "events_20241004", "events_20241005", "events_20241006",
+    ]
+    assert database.fetch_one("SELECT COUNT(*) FROM events")[0] == 0
+
+    # Чтение идёт по всем партициям, id сквозные
+    assert [row[0] for row in database.query_events(limit=4)] == [6, 5, 4, 3]
+    assert [row[0] for row in database.query_events(limit=4, before=(base + day, 3))] == [2, 1]
+    assert [row[0] for row in database.iter_events(batch_size=4)] == [1, 2, 3, 4, 5, 6]
+
+    assert database.fetch_one(
+        "SELECT value FROM partition_stats WHERE partition = 'events_20241004' AND name = 'events'"
+    ) == (2,)
+    assert database.drop_partitions_before(base + day) == ["events_20241004"]
+    assert [row[0] for row in database.query_events()] == [6, 5, 4, 3]
+    stats = database.get_stats()
+    assert stats["total_events"] == 4
+    assert stats["by_severity"] == {"high": 4}
+    assert database.fetch_one("SELECT COUNT(*) FROM partition_stats WHERE partition = 'events_20241004'") == (0,)
+    partition_stats = database.fetch_all("SELECT * FROM partition_stats ORDER BY partition, name")
+    database.rebuild_stats()
+    assert database.get_stats() == stats
+    assert database.fetch_all("SELECT * FROM partition_stats ORDER BY partition, name") == partition_stats
+
+def test_late_rows_in_older_partition_keep_ids_unique(tmp_path):
+    database = Database(str(tmp_path / "late.db"), partition="day")
+    today = 20000 * 86400000
+    yesterday = today - 86400000
+    # Запоздавшие строки (write-behind после полуночи, неупорядоченные метки) идут в прошлую партицию
+    for timestamp in (yesterday, today, today, yesterday, today, yesterday):
+        database.insert_rows([database.event_row({"message": str(timestamp)}, timestamp=timestamp)])
+    database.insert_rows([database.event_row({}, timestamp=t) for t in (today, yesterday, today)])
+    ids = [row[0] for row in database.iter_events()]
+    assert sorted(ids) == list(range(1, 10))
+
+def test_retention_runs_outside_the_write_path(tmp_path):
+    database = Database(str(tmp_path / "retention.db"), partition="day", retention_days=1)
+    old = now_ms() - 3 * 86400000
+    database.insert_rows([database.event_row({"message": "старое"}, timestamp=old)])
+    # Запись в новую партицию не удаляет старые — это делает RetentionWorker
+    database.log_event({"message": "новое"})
+    assert len(database.partitions()) == 2
+    assert len(RetentionWorker(database).run_once()) == 1
+    assert len(database.partitions()) == 1
+    assert database.get_stats()["total_events"] == 1
+
+def test_insert_retries_on_locked_database(tmp_path, monkeypatch):
+    database = Database(str(tmp_path / "busy.db"))
+    observed = []
+    database.add_write_observer(lambda seconds, events, incidents: observed.append((events, incidents)))
+    insert = database._insert
+    failures = iter([sqlite3.OperationalError("database is locked")])
+
+    def flaky_insert(event_rows, incident_rows, deadline):
+        for error in failures:
+            raise error
+        return insert(event_rows, incident_rows, deadline)
+
+    monkeypatch.setattr(database, "_insert", flaky_insert)
+    database.log_event({"type": "system_event", "message": "после блокировки"})
+    assert database.get_stats()["total_events"] == 1
+    assert database.contention == {"busy": 0, "locked": 1, "retries": 1, "failures": 0}
+    assert observed == [(1, 0)]
+
+    def always_busy(event_rows, incident_rows, deadline):
+        raise sqlite3.OperationalError("database is busy")
+
+    monkeypatch.setattr(database, "_insert", always_busy)
+    database.busy_retries = 1
+    with pytest.raises(sqlite3.OperationalError):
+        database.log_event({"type": "system_event"})
+    assert database.contention["busy"] == 2
+    assert database.contention["failures"] == 1
+
+def test_busy_retries_share_one_write_deadline(tmp_path):
+    path = str(tmp_path / "locked.db")
+    database = Database(path)
+    database.write_timeout = 0.3
+    database.busy_retries = 5
+    holder = sqlite3.connect(path)
+    holder.execute("BEGIN IMMEDIATE")  # блокировка записи удерживается другим соединением
+    try:
+        started = time.monotonic()
+        with pytest.raises(sqlite3.OperationalError):
+            database.log_event({"type": "system_event"})
+        # Не DB_POOL_TIMEOUT (30 с) на каждую из busy_retries попыток
+        assert time.monotonic() - started < 2
+    finally:
+        holder.rollback()
+        holder.close()
+    database.log_event({"type": "system_event"})
+    with database.connection() as conn:
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == int(database.pool.timeout * 1000)
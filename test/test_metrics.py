@@ -0,0 +1,32 @@
+# test/test_metrics.py
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from database import Database
+from servise import metrics
+
+def test_metrics_exposition():
+    if not metrics.ENABLED:
+        pytest.skip("метрики выключены (METRICS=0)")
+    database = Database(":memory:")
+    metrics.watch_database(database)
+    metrics.watch_queue("test_queue", lambda: 3)
+    database.log_event({"type": "system_event", "message": "метрики"})
+    metrics.count_events([{"severity": "low"}] * 2, [{"action": "no_action"}] * 2, {"low": 5})
+    # Произвольные severity от клиента не создают новых временных рядов
+    metrics.count_events([{"severity": f"x{i}"} for i in range(3)] + [{}], [{"action": "no_action"}] * 4, {"low": 5})
+    with metrics.timed(metrics.SCORING_SECONDS, "single"):
+        pass
+
+    body, content_type = metrics.render()
+    text = body.decode()
+    assert content_type.startswith("text/plain")
+    assert 'cyberlab_queue_depth{queue="test_queue"} 3.0' in text
+    assert 'cyberlab_events_total{action="no_action",severity="low"}' in text
+    assert 'cyberlab_events_total{action="no_action",severity="other"} 4.0' in text
+    assert 'severity="x0"' not in text
+    assert 'cyberlab_sqlite_contention_total{kind="busy"}' in text
+    assert 'cyberlab_risk_scoring_seconds_count{mode="single"}' in text
+    assert "cyberlab_db_insert_seconds_count" in text
@@ -0,0 +1,73 @@
+# test/test_notifications.py
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from servise.client import NotificationDispatcher
+
+class _StubTelegram(BaseHTTPRequestHandler):
+    """Заглушка Telegram Bot API: запоминает тексты, первые fail_first запросов — 500"""
+    received = []
+    fail_first = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        if cls.fail_first > 0:
+            cls.fail_first -= 1
+            self.send_response(500)
+            self.end_headers()
+            return
+        cls.received.append(body["text"])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"ok": true}')
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    _StubTelegram.received = []
+    _StubTelegram.fail_first = 0
+    server = HTTPServer(("127.0.0.1", 0), _StubTelegram)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+def _dispatcher(server, **kwargs):
+    return NotificationDispatcher(
+        token="test", chat_id="42", api_url=f"http://127.0.0.1:{server.server_port}", **kwargs
+    )
+
+def test_burst_is_coalesced_into_digest(stub_server):
+    dispatcher = _dispatcher(stub_server, workers=1, coalesce_ms=300, digest_max=50)
+    for i in range(5):
+        assert dispatcher.submit(f"Высокий риск #{i}")
+    dispatcher.stop()
+
+    assert len(_StubTelegram.received) == 1
+    assert "5 оповещений" in _StubTelegram.received[0]
+    metrics = dispatcher.metrics()
+    assert metrics["sent"] == 5
+    assert metrics["digests"] == 1
+    assert metrics["queue_depth"] == 0
+
+def test_failed_delivery_is_retried(stub_server):
+    _StubTelegram.fail_first = 2
+    dispatcher = _dispatcher(stub_server, workers=1, coalesce_ms=0, backoff=0.01)
+    dispatcher.submit("повтор")
+    dispatcher.stop()
+
+    assert _StubTelegram.received == ["повтор"]
+    assert dispatcher.metrics()["retries"] == 2
+
+def test_full_queue_drops_without_blocking(stub_server):
+    dispatcher = _dispatcher(stub_server, queue_size=1, workers=0)
+    assert dispatcher.submit("первое")
+    assert not dispatcher.submit("второе")
+    assert dispatcher.metrics()["dropped"] == 1
@@ -0,0 +1,48 @@
+# test/test_password_hashing.py
+
+import threading
+import pytest
+from password_hashing import HashingOverloadedError, PasswordHashingService, legacy_hash, needs_rehash, verify_password
+
+def test_legacy_hash_is_verified_and_upgraded():
+    stored = legacy_hash("admin2024", "salt")
+    assert verify_password("admin2024", stored, "salt")
+    assert not verify_password("wrong", stored, "salt")
+    assert needs_rehash(stored)
+
+    service = PasswordHashingService(workers=1)
+    valid, upgraded = service.verify("admin2024", stored, "salt", ip="10.0.0.1")
+    assert valid and upgraded and not needs_rehash(upgraded)
+    assert verify_password("admin2024", upgraded) and not verify_password("wrong", upgraded)
+    # Текущий формат повторно не пересчитывается
+    assert service.verify("admin2024", upgraded, ip="10.0.0.1") == (True, None)
+    assert service.verify("wrong", upgraded, ip="10.0.0.1") == (False, None)
+    metrics = service.metrics()
+    assert metrics["rehashed"] == 1 and metrics["completed"] == 3 and metrics["hashing"]["count"] == 3
+
+def test_admission_control_and_per_ip_fairness():
+    service = PasswordHashingService(workers=1, max_queue=5, per_ip_limit=3)
+    started, gate = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        gate.wait()
+
+    blocker = service.submit("warmup", block)
+    assert started.wait(5)  # воркер занят blocker, очередь пуста
+
+    order = []
+    futures = [service.submit("attacker", order.append, f"a{i}") for i in range(3)]
+    with pytest.raises(HashingOverloadedError):
+        service.submit("attacker", order.append, "a3")  # лимит IP
+    futures += [service.submit("user", order.append, f"u{i}") for i in range(2)]
+    with pytest.raises(HashingOverloadedError):
+        service.submit("other", order.append, "o0")  # очередь заполнена
+
+    gate.set()
+    blocker.result(5)
+    for future in futures:
+        future.result(5)
+    # IP обслуживаются по кругу: пользователь не ждёт всю серию атакующего
+    assert order == ["a0", "u0", "a1", "u1", "a2"]
+    assert service.metrics()["rejected_ip"] == 1 and service.metrics()["rejected_queue"] == 1
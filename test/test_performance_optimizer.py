@@ -0,0 +1,346 @@
+# test/test_performance_optimizer.py
+
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from performance_optimizer import (
+    IndexAdvisor, LatencyHistogram, MemoryCacheTier, OnlineMaintenance, PerformanceOptimizer, get_codec, stable_key_digest,
+    tuple_key_builder,
+)
+
+def make_optimizer(tmp_path, **kwargs):
+    return PerformanceOptimizer(db_path=str(tmp_path / "performance.db"), **kwargs)
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.record(value * 1000)
+    assert histogram.count == 1000
+    # Погрешность логарифмических корзин — не больше ширины корзины (~12%)
+    assert abs(histogram.percentile(50) - 500000) / 500000 < 0.13
+    assert abs(histogram.percentile(99) - 990000) / 990000 < 0.13
+    assert histogram.percentile(100) <= histogram.max_ns == 1000000
+
+def test_monitor_batches_rows_and_reports_slow_sites(tmp_path):
+    optimizer = make_optimizer(tmp_path, slow_threshold=0.0, flush_batch=10, flush_interval=3600,
+                               profile_slow=True, profile_sample_rate=1.0)
+    slow = []
+    optimizer.add_slow_call_hook(slow.append)
+
+    @optimizer.monitor_query_performance("SELECT * FROM users")
+    def get_users():
+        return [1, 2, 3]
+
+    for _ in range(15):
+        assert get_users() == [1, 2, 3]
+
+    conn = sqlite3.connect(optimizer.db_path)
+    # Записана только первая полная пачка, остаток ждёт следующего сброса
+    assert conn.execute("SELECT COUNT(*) FROM query_performance").fetchone()[0] == 10
+    assert optimizer.flush_query_stats() == 5
+    assert conn.execute("SELECT COUNT(*), MIN(result_count) FROM query_performance").fetchone() == (15, 3)
+    conn.close()
+
+    assert len(slow) == 15
+    top = optimizer.slow_call_sites(top_n=1)
+    assert top[0]["site"].endswith("get_users")
+    assert top[0]["count"] == 15 and top[0]["slow_calls"] == 15
+    assert "get_users" in top[0]["profile"]["stats"]
+    assert optimizer.get_performance_stats()["slow_call_sites"][0]["count"] == 15
+
+def test_overlapping_profiled_calls_fall_back_to_timing(tmp_path):
+    import tracemalloc
+    optimizer = make_optimizer(tmp_path, slow_threshold=0.0, flush_interval=3600,
+                               profile_slow=True, profile_sample_rate=1.0)
+    barrier = threading.Barrier(4)
+    errors = []
+
+    @optimizer.monitor_query_performance("SELECT * FROM sessions")
+    def lookup(i):
+        time.sleep(0.02)  # вызовы гарантированно перекрываются
+        return [i]
+
+    def worker(i):
+        try:
+            barrier.wait()
+            for _ in range(3):
+                assert lookup(i) == [i]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not tracemalloc.is_tracing()
+    site = optimizer.slow_call_sites(top_n=1)[0]
+    assert site["count"] == 12 and site["profile"] is not None
+
+def test_memory_tier_bounds_and_lazy_expiry():
+    tier = MemoryCacheTier(max_entries=3, max_bytes=100)
+    for key in "abc":
+        tier.set(key, key.upper(), ttl=60, size=10)
+    assert tier.get("a") == "A"          # "a" становится самым свежим
+    tier.set("d", "D", ttl=60, size=10)  # вытесняется "b"
+    assert tier.get("b") is None
+    tier.set("big", "X", ttl=60, size=80)  # по байтам вытесняется "c"
+    assert len(tier) == 3 and tier.get("c") is None
+    assert tier.set("huge", "Y", ttl=60, size=101) is False
+
+    tier.set("short", 1, ttl=0.01, size=1)  # 101 байт — вытесняется "a"
+    time.sleep(0.02)
+    assert tier.get("short") is None
+    stats = tier.snapshot()
+    assert stats["evictions"] == 3
+    assert stats["expirations"] == 1
+    assert stats["rejected"] == 1
+    assert stats["bytes"] == 90
+
+def test_cache_result_uses_bounded_tier(tmp_path):
+    optimizer = make_optimizer(tmp_path, cache_max_entries=2)
+    calls = []
+
+    @optimizer.cache_result(ttl=60)
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert [square(x) for x in (1, 2, 3, 3)] == [1, 4, 9, 9]
+    assert calls == [1, 2, 3]
+    memory = optimizer.get_performance_stats()["memory_cache"]
+    assert memory["entries"] == 2
+    assert memory["evictions"] == 1
+
+def test_cache_result_single_flight(tmp_path):
+    optimizer = make_optimizer(tmp_path)
+    calls = []
+    started = threading.Event()
+
+    @optimizer.cache_result(ttl=60)
+    def slow_report():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"total": 42}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(slow_report())) for _ in range(8)]
+    threads[0].start()
+    started.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{"total": 42}] * 8
+    assert len(calls) == 1
+    assert optimizer.cache_stats["coalesced"] == 7
+
+def test_cache_result_serves_stale_while_revalidating(tmp_path):
+    optimizer = make_optimizer(tmp_path)
+    version = [0]
+
+    @optimizer.cache_result(ttl=0.05, stale_ttl=60)
+    def current():
+        version[0] += 1
+        return version[0]
+
+    assert current() == 1
+    time.sleep(0.1)
+    assert current() == 1  # устаревшее значение сразу, пересчёт — в фоне
+    deadline = time.monotonic() + 2
+    while optimizer.cache_stats["refreshes"] == 0 or optimizer._inflight:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert current() == 2
+    assert optimizer.cache_stats["stale_served"] == 1
+
+def test_key_builder_fast_path_and_stable_digest():
+    assert tuple_key_builder("f", (1, "a"), {"b": 2}) == ("f", (1, "a"), (("b", 2),))
+    # Нехэшируемые аргументы — устойчивый хэш, не зависящий от порядка ключей
+    first = tuple_key_builder("f", ({"x": 1, "y": [1, 2]},), {})
+    second = tuple_key_builder("f", ({"y": [1, 2], "x": 1},), {})
+    assert isinstance(first, str) and first == second
+    assert stable_key_digest(("f", (1,), ())) != stable_key_digest(("f", ("1",), ()))
+
+def test_codecs_round_trip_through_l2(tmp_path):
+    optimizer = make_optimizer(tmp_path)
+    payload = {"rows": [(1, "a"), (2, "b")], "total": 2}
+    for codec, expected in (("pickle", payload), ("json", {"rows": [[1, "a"], [2, "b"]], "total": 2})):
+        key = ("report", (codec,), ())
+        optimizer.set_cache(key, payload, 60, codec=get_codec(codec))
+        optimizer.cache.delete(key)  # попадание только в L2
+        assert optimizer.get_from_cache(key, codec=get_codec(codec)) == expected
+
+    # По умолчанию json: строку pickle из общего файла читатель не распаковывает
+    assert optimizer.codec.name == "json"
+    optimizer.cache.delete(("report", ("pickle",), ()))
+    assert optimizer.get_from_cache(("report", ("pickle",), ())) is None
+
+    raw = PerformanceOptimizer(db_path=str(tmp_path / "raw.db"), codec="raw")
+    raw.set_cache("blob", b"\x00\x01", 60)
+    raw.cache.delete("blob")
+    assert raw.get_from_cache("blob") == b"\x00\x01"
+
+def test_l2_writes_are_batched_and_expiry_is_swept(tmp_path):
+    optimizer = make_optimizer(tmp_path, l2_flush_interval=3600, sweep_batch=2)
+    for i in range(5):
+        optimizer.set_cache(("k", i), {"n": i}, ttl=60)
+    optimizer.set_cache(("old",), "x", ttl=-1)
+    conn = sqlite3.connect(optimizer.db_path)
+    assert conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] == 0
+
+    # До записи значение видно из очереди L2
+    optimizer.cache.delete(("k", 0))
+    assert optimizer.get_from_cache(("k", 0)) == {"n": 0}
+    assert optimizer.flush_cache_writes() == 6
+    assert conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] == 6
+    assert conn.execute("SELECT typeof(expires_at) FROM cache_entries LIMIT 1").fetchone()[0] == "integer"
+
+    # Счётчик обращений копится в памяти и пишется пакетом
+    optimizer.cache.delete(("k", 1))
+    optimizer.get_from_cache(("k", 1))
+    optimizer.flush_cache_writes()
+    key = optimizer._storage_key(("k", 1))
+    assert conn.execute("SELECT access_count FROM cache_entries WHERE key = ?", (key,)).fetchone()[0] == 2
+
+    assert optimizer.cleanup_cache()["db_cleaned"] == 1
+    assert conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] == 5
+    conn.close()
+
+def test_tagged_entries_invalidate_on_database_writes(tmp_path):
+    from database import Database
+
+    optimizer = make_optimizer(tmp_path, l2_flush_interval=3600)
+    database = Database(str(tmp_path / "events.db"))
+    optimizer.bind_database(database)
+
+    @optimizer.cache_result(ttl=3600, tags=("events",))
+    def total_events():
+        return database.get_stats()["total_events"]
+
+    @optimizer.cache_result(ttl=3600, tags=("incidents",))
+    def total_incidents():
+        return database.get_stats()["total_incidents"]
+
+    assert (total_events(), total_incidents()) == (0, 0)
+    database.log_event({"type": "system_event", "message": "новое"})
+    # Сброшен только тег events
+    assert total_events() == 1
+    database.log_event({"type": "system_event", "message": "ещё"})
+    database.log_incident({"risk_score": 90})
+    assert (total_events(), total_incidents()) == (2, 1)
+    assert optimizer.cache_stats["hits"] == 0
+    assert total_events() == 2 and optimizer.cache_stats["hits"] == 1
+
+    # Версии тегов сохраняются: другой процесс (здесь — экземпляр) не увидит устаревших записей
+    optimizer.flush_cache_writes()
+    other = make_optimizer(tmp_path)
+    assert other._tag_versions == {"events": 2, "incidents": 1}
+
+def test_event_written_by_another_process_invalidates_cached_analytics(tmp_path):
+    optimizer = make_optimizer(tmp_path, l2_flush_interval=0.05)
+    calls = []
+
+    @optimizer.cache_result(ttl=3600, tags=("events",))
+    def analytics():
+        calls.append(1)
+        return len(calls)
+
+    assert analytics() == 1 and analytics() == 1
+    # Процесс-писатель (simple_server) с базой событий и performance.db в том же каталоге
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(
+        [sys.executable, "-c", "import simple_server; simple_server.db.log_event({'type': 'system_event'})"],
+        cwd=tmp_path, env={**os.environ, "PYTHONPATH": repo}, check=True, timeout=60,
+    )
+    deadline = time.monotonic() + 5
+    while analytics() == 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert analytics() == 2
+
+def test_online_maintenance_frees_pages_in_slices(tmp_path):
+    path = str(tmp_path / "bloated.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, payload TEXT)")
+    conn.executemany("INSERT INTO events (payload) VALUES (?)", [("x" * 500,) for _ in range(2000)])
+    conn.commit()
+    conn.execute("DELETE FROM events WHERE id > 400")
+    conn.commit()
+    free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    assert free_before > 0
+
+    # Высокая задержка записи — порции уступают, работа не идёт
+    busy = OnlineMaintenance(path, latency_source=lambda: 500.0)
+    busy.run_until_done(max_slices=3)
+    assert busy.stats["yielded"] == 3 and busy.stats["slices"] == 0 and busy._backoff == 8
+
+    maintenance = OnlineMaintenance(path, vacuum_pages=16, latency_source=lambda: 0.0)
+    report = maintenance.run_until_done()
+    assert report["done"] and report["analyzed"] == 1
+    assert report["pages_freed"] >= free_before - 2  # часть страниц уходит под sqlite_stat1
+    assert report["slices"] > free_before // 16
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+    conn.close()
+
+def test_index_advisor_uses_recorded_workload(tmp_path):
+    path = str(tmp_path / "app.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sessions (id INTEGER PRIMARY KEY, user_id INTEGER, session_token TEXT, expires_at TEXT)")
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, push_enabled INTEGER)")
+    conn.executemany("INSERT INTO sessions (user_id, session_token, expires_at) VALUES (?, ?, ?)",
+                     [(i % 50, f"token-{i}", "2030-01-01") for i in range(2000)])
+    conn.executemany("INSERT INTO users (username, push_enabled) VALUES (?, ?)",
+                     [(f"user{i}", i % 2) for i in range(50)])
+    conn.commit()
+
+    optimizer = make_optimizer(tmp_path)
+    lookup = ("SELECT s.user_id, u.username FROM sessions s JOIN users u ON s.user_id = u.id "
+              "WHERE s.session_token = ? AND s.expires_at > ?")
+
+    @optimizer.monitor_query_performance(lookup, ("token-1", "2026-01-01"))
+    def validate(token):
+        return conn.execute(lookup, (token, "2026-01-01")).fetchall()
+
+    for i in range(20):
+        validate(f"token-{i}")
+
+    recommendations = optimizer.advise_indexes(path)
+    assert [r["columns"] for r in recommendations] == [["session_token", "expires_at", "user_id"]]
+    best = recommendations[0]
+    assert best["table"] == "sessions" and best["read_gain"]["calls"] == 20
+    assert best["read_gain"]["rows_examined_before"] == 2000 and best["read_gain"]["rows_examined_after"] == 1
+    assert any(step.startswith("SCAN s") for step in best["plan_before"])
+    assert any(best["name"] in step for step in best["plan_after"])
+    assert best["write_cost"]["btrees_per_insert"] == "1 -> 2"
+    # Колонка, по которой не ищут, индекса не получает (в отличие от прежней эвристики по *_id)
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+
+    optimizer.advise_indexes(path, apply=True)
+    assert best["name"] in [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    # Индекс уже есть — повторно не предлагается
+    assert optimizer.advise_indexes(path) == []
+    assert IndexAdvisor(path).advise([("SELECT * FROM missing_table WHERE id = 1", 1, 0.0, None)]) == []
+    conn.close()
+
+    # Параметры сохраняются в query_performance и переживают перезапуск
+    optimizer.flush_query_stats()
+    restarted = make_optimizer(tmp_path)
+    assert [(q, calls, params) for q, calls, _, params in restarted.query_workload()] == [
+        (lookup, 20, ["token-1", "2026-01-01"]),
+    ]
+
+    # В другой базе есть только users — запрос к sessions JOIN users её не касается
+    other = str(tmp_path / "other.db")
+    other_conn = sqlite3.connect(other)
+    other_conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, push_enabled INTEGER)")
+    other_conn.executemany("INSERT INTO users (username) VALUES (?)", [(f"u{i}",) for i in range(500)])
+    other_conn.commit()
+    other_conn.close()
+    assert restarted.advise_indexes(other, apply=True) == []
@@ -1,4 +1,7 @@
-from risk_engine import RiskEngine
+import json
+import os
+import pytest
+from risk_engine import PolicyWatcher, RiskEngine
 
 def test_risk_assessment():
     engine = RiskEngine("risk_policy.json")
@@ -11,4 +14,67 @@ def test_risk_assessment():
     assert report["risk_score"] == 75
     assert "unauthorized_access" in report["tags"]
     assert "external" in report["tags"]
-    assert "high" in report["tags"]
\ No newline at end of file
+    assert "high" in report["tags"]
+
+def test_assess_batch_matches_assess_event():
+    engine = RiskEngine("risk_policy.json")
+    events = [
+        {"type": "network_scan", "source": "external", "severity": "critical", "message": "scan"},
+        {"type": "network_scan", "source": "external", "severity": "critical", "message": "scan"},
+        {"type": "unlisted", "source": "internal", "message": "без severity"},
+        {"message": "без полей"},
+    ]
+    batch = engine.assess_batch(events)
+    for event, report in zip(events, batch):
+        single = engine.assess_event(event)
+        assert report["risk_score"] == single["risk_score"]
+        assert report["tags"] == single["tags"]
+        assert report["hash"] == single["hash"]
+    assert [r["risk_score"] for r in batch] == [100, 100, 5, 0]
+    assert list(engine.compiled.score_batch(events)) == [100, 100, 5, 0]
+
+def test_policy_hot_reload(tmp_path):
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps({"type_weights": {"network_scan": 35}}))
+    engine = RiskEngine(str(path))
+    watcher = PolicyWatcher(engine, interval=0.1)
+    before = engine.policy_info()
+    assert engine.assess_event({"type": "network_scan"})["risk_score"] == 35
+
+    # Некорректная политика не применяется
+    path.write_text(json.dumps({"type_weights": {"network_scan": "много"}}))
+    os.utime(path, ns=(1, 1))
+    assert watcher.check() is False
+    assert engine.policy_info()["hash"] == before["hash"]
+
+    path.write_text(json.dumps({"type_weights": {"network_scan": 60}}))
+    os.utime(path, ns=(2, 2))
+    assert watcher.check() is True
+    assert engine.assess_event({"type": "network_scan"})["risk_score"] == 60
+    assert engine.policy_info()["version"] == before["version"] + 1
+
+def test_reload_validates_correlation_rules_and_notifies(tmp_path):
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps({"type_weights": {"login_failure": 10}}))
+    engine = RiskEngine(str(path))
+    reloaded = []
+    engine.add_reload_listener(reloaded.append)
+
+    # Ошибка в правилах корреляции отклоняется при перезагрузке, а не при следующем старте
+    for rules in ([{"name": "x", "kind": "window"}], [{"name": "x", "kind": "threshold", "count": 2}], "brute_force"):
+        path.write_text(json.dumps({"type_weights": {"login_failure": 10}, "correlation_rules": rules}))
+        assert engine.reload() is False
+    assert reloaded == []
+
+    policy = {"type_weights": {"login_failure": 10}, "correlation_rules": [
+        {"name": "fast", "kind": "threshold", "event_type": "login_failure", "count": 2, "window": 10, "emit": "fast"},
+    ]}
+    path.write_text(json.dumps(policy))
+    assert engine.reload() is True
+    assert reloaded == [policy]
+
+def test_initial_policy_is_validated(tmp_path):
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps({"type_weights": {"network_scan": 35.9}}))
+    with pytest.raises(ValueError):
+        RiskEngine(str(path))
@@ -1,5 +1,9 @@
 # test/test_service.py
 
+import asyncio
+import csv
+import io
+import json
 import pytest
 from fastapi.testclient import TestClient
 from servise.main import app
@@ -34,3 +38,144 @@ def test_event_invalid():
     }
     response = client.post("/api/event", json=payload)
     assert response.status_code == 422  # Unprocessable Entity
+
+def test_events_batch_json():
+    payload = [
+        {"type": "system_event", "source": "internal", "severity": "low", "message": "Пакет: 1"},
+        {"type": "network_scan", "source": "external", "severity": "critical", "message": "Пакет: 2"},
+    ]
+    response = client.post("/api/events/batch", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 2
+    assert data[0]["action"] == "no_action"
+    assert data[1]["action"] == "incident_logged_and_notified"
+
+def test_events_batch_ndjson():
+    lines = [
+        '{"type": "login_failure", "source": "external", "severity": "medium", "message": "NDJSON 1"}',
+        '{"type": "system_event", "source": "internal", "severity": "low", "message": "NDJSON 2"}',
+    ]
+    response = client.post(
+        "/api/events/batch",
+        content="\n".join(lines) + "\n",
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert [r["status"] for r in response.json()] == ["processed", "processed"]
+
+def test_events_batch_invalid_item():
+    payload = [
+        {"type": "system_event", "source": "internal", "severity": "low", "message": "ok"},
+        {"type": "system_event", "source": "internal", "message": "без severity"},
+    ]
+    response = client.post("/api/events/batch", json=payload)
+    assert response.status_code == 422
+    assert response.json()["detail"]["index"] == 1
+
+def test_health_reports_policy():
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    policy = response.json()["policy"]
+    assert len(policy["hash"]) == 64
+    assert "version" in policy
+
+def test_events_time_range_filters():
+    response = client.get("/api/events", params={"from": "2000-01-01T00:00:00", "severity": "high", "limit": 5})
+    assert response.status_code == 200
+    assert all(event[4] == "high" for event in response.json()["events"])
+    assert client.get("/api/events", params={"from": "вчера"}).status_code == 400
+
+def test_events_cursor_pagination():
+    for i in range(3):
+        client.post("/api/event", json={
+            "type": "system_event", "source": "internal", "severity": "low", "message": f"page {i}"
+        })
+    first = client.get("/api/events", params={"limit": 2}).json()
+    assert first["next_cursor"]
+    second = client.get("/api/events", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+    first_ids = {event[0] for event in first["events"]}
+    assert all(event[0] not in first_ids for event in second["events"])
+    assert client.get("/api/events", params={"cursor": "не-курсор"}).status_code == 400
+
+def test_events_export_formats():
+    client.post("/api/event", json={
+        "type": "data_export", "source": "internal", "severity": "medium", "message": "SIEM, выгрузка"
+    })
+    ndjson = client.get("/api/events/export", params={"type": "data_export"})
+    assert ndjson.status_code == 200
+    assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+    lines = [line for line in ndjson.text.splitlines() if line]
+    assert lines and all(json.loads(line)["type"] == "data_export" for line in lines)
+
+    exported = client.get("/api/events/export", params={"format": "csv", "type": "data_export"})
+    assert exported.status_code == 200
+    rows = list(csv.reader(io.StringIO(exported.text)))
+    assert rows[0] == ["id", "timestamp", "type", "source", "severity", "message", "risk_score", "ip"]
+    assert rows[-1][5] == "SIEM, выгрузка"
+
+def test_process_event_async_matches_sync():
+    from servise.processor import process_event, process_event_async
+    event = {"type": "login_failure", "source": "external", "severity": "low", "message": "async"}
+    assert asyncio.run(process_event_async(dict(event))) == process_event(dict(event))
+
+def test_process_events_async_scores_off_the_event_loop(monkeypatch):
+    import threading
+    from servise import processor
+    prepare = processor._prepare_batch
+    threads = []
+
+    def recording_prepare(events):
+        threads.append(threading.get_ident())
+        return prepare(events)
+
+    monkeypatch.setattr(processor, "_prepare_batch", recording_prepare)
+
+    async def run():
+        events = [{"type": "network_scan", "source": "external", "severity": "low", "message": "batch"}]
+        return threading.get_ident(), await processor.process_events_async(events)
+
+    loop_thread, results = asyncio.run(run())
+    assert results[0]["status"] == "processed"
+    assert threads and threads[0] != loop_thread
+
+def test_rejected_event_leaves_suppression_and_correlation_untouched(monkeypatch):
+    from servise import processor
+    from servise.suppression import AlertSuppressor
+    from servise.writer import QueueFullError, WriteBehindWriter
+    from tools.correlation import Correlator, rules_from_policy
+    writer = WriteBehindWriter(processor.db, max_queue=1, autostart=False)
+    writer.reserve(1)  # очередь занята
+    suppressor = AlertSuppressor(window=60, burst=1)
+    correlator = Correlator(rules_from_policy(processor.engine.policy))
+    monkeypatch.setattr(processor, "writer", writer)
+    monkeypatch.setattr(processor, "suppressor", suppressor)
+    monkeypatch.setattr(processor, "correlator", correlator)
+
+    event = {"type": "network_scan", "source": "external", "severity": "critical", "message": "отклонено"}
+    with pytest.raises(QueueFullError):
+        processor.process_event(dict(event))
+    with pytest.raises(QueueFullError):
+        asyncio.run(processor.process_events_async([dict(event)]))
+    assert suppressor.metrics() == {"allowed": 0, "suppressed": 0, "evicted": 0, "tracked": 0}
+    assert correlator.metrics()["observed"] == 0
+
+def test_correlation_keys_on_event_ip(monkeypatch):
+    from servise import processor
+    from tools.correlation import Correlator, rules_from_policy
+    # То же, что CORRELATION=1 и CORRELATION_KEY=ip
+    correlator = Correlator(rules_from_policy(processor.engine.policy), key_field="ip")
+    monkeypatch.setattr(processor, "correlator", correlator)
+
+    for i in range(5):
+        response = client.post("/api/event", json={
+            "type": "login_failure", "source": "external", "severity": "medium",
+            "message": f"неверный пароль {i}", "ip": "203.0.113.7",
+        })
+        assert response.status_code == 200
+    assert correlator.metrics() == {"observed": 5, "derived": 1, "evicted": 0, "tracked_sources": 1}
+
+    derived = processor.db.query_events(event_type="brute_force", limit=1)[0]
+    assert dict(zip(processor.db.EVENT_COLUMNS, derived))["ip"] == "203.0.113.7"
+    failure = processor.db.query_events(event_type="login_failure", limit=1)[0]
+    assert dict(zip(processor.db.EVENT_COLUMNS, failure))["ip"] == "203.0.113.7"
@@ -0,0 +1,26 @@
+# test/test_suppression.py
+
+from servise.suppression import AlertSuppressor, alert_fingerprint
+
+def test_burst_then_suppress_and_carry_count():
+    suppressor = AlertSuppressor(window=60, burst=2)
+    fp = alert_fingerprint({"type": "network_scan", "source": "external", "message": "scan 10.0.0.1"})
+    assert suppressor.check(fp, now=0) == (True, 0)
+    assert suppressor.check(fp, now=1) == (True, 0)
+    assert suppressor.check(fp, now=2) == (False, 0)
+    assert suppressor.check(fp, now=3) == (False, 0)
+    # Через window/burst секунд появляется токен — инцидент несёт счётчик подавленных
+    assert suppressor.check(fp, now=32) == (True, 2)
+    assert suppressor.metrics()["suppressed"] == 2
+
+def test_fingerprints_are_independent_and_bounded():
+    suppressor = AlertSuppressor(window=60, burst=1, max_keys=2)
+    a = alert_fingerprint({"type": "network_scan", "message": "a"})
+    b = alert_fingerprint({"type": "network_scan", "message": "b"})
+    c = alert_fingerprint({"type": "network_scan", "message": "c"})
+    assert a != b
+    assert suppressor.check(a, now=0)[0]
+    assert suppressor.check(b, now=0)[0]
+    assert not suppressor.check(a, now=1)[0]
+    assert suppressor.check(c, now=1)[0]
+    assert suppressor.metrics() == {"allowed": 3, "suppressed": 1, "evicted": 1, "tracked": 2}
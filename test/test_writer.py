@@ -0,0 +1,47 @@
+# test/test_writer.py
+
+import pytest
+from database import Database
+from servise.writer import WriteBehindWriter, QueueFullError
+
+def test_write_behind_group_commit(tmp_path):
+    database = Database(str(tmp_path / "wb.db"))
+    writer = WriteBehindWriter(database, max_queue=100, batch_size=10, flush_interval_ms=5)
+    for i in range(25):
+        writer.submit([database.event_row({"type": "system_event", "message": f"#{i}"})])
+    assert writer.flush(timeout=5)
+    assert database.fetch_one("SELECT COUNT(*) FROM events")[0] == 25
+    assert writer.stats["batches"] >= 3
+    writer.stop()
+
+def test_write_behind_backpressure(tmp_path):
+    database = Database(str(tmp_path / "wb.db"))
+    # Фоновый поток не запущен: очередь только наполняется
+    writer = WriteBehindWriter(database, max_queue=3, autostart=False)
+    writer.submit([database.event_row({}), database.event_row({})])
+    with pytest.raises(QueueFullError):
+        writer.submit([database.event_row({}), database.event_row({})])
+    assert writer.stats["rejected"] == 2
+    writer.stop()
+    assert database.fetch_one("SELECT COUNT(*) FROM events")[0] == 2
+
+def test_reserved_capacity_is_held_until_submit(tmp_path):
+    database = Database(str(tmp_path / "wb.db"))
+    writer = WriteBehindWriter(database, max_queue=3, autostart=False)
+    reserved = writer.reserve(2)
+    with pytest.raises(QueueFullError):
+        writer.reserve(2)
+    with pytest.raises(QueueFullError):
+        writer.submit([database.event_row({}), database.event_row({})])
+    # Зарезервированное событие принимается вместе с производными сверх резерва
+    writer.submit([database.event_row({}) for _ in range(3)], reserved=reserved)
+    assert writer.qsize() == 3
+    with pytest.raises(QueueFullError):
+        writer.reserve(1)
+    assert writer.stats["rejected"] == 5
+    writer.stop()
+    assert database.fetch_one("SELECT COUNT(*) FROM events")[0] == 3
+
+    writer = WriteBehindWriter(database, max_queue=1, autostart=False)
+    writer.release(writer.reserve(1))
+    writer.reserve(1)
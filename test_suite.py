@@ -40,6 +40,23 @@ class TestEnhancedSecurity(unittest.TestCase):
         result = enhanced_security.authenticate("director", "wrongpassword", "127.0.0.1", "TestAgent")
         self.assertFalse(result["success"])
     
+    def test_password_rehash_on_login(self):
+        """Тест пересчёта пароля в текущей схеме при входе"""
+        from password_hashing import needs_rehash
+        
+        result = enhanced_security.authenticate("director", "admin2024", "127.0.0.1", "TestAgent")
+        self.assertTrue(result["success"])
+        
+        conn = sqlite3.connect('security.db')
+        password_hash, salt = conn.execute("SELECT password_hash, salt FROM users WHERE username = 'director'").fetchone()
+        conn.close()
+        self.assertFalse(needs_rehash(password_hash))
+        self.assertIsNone(salt)
+        
+        # Повторный вход уже по новому хешу
+        self.assertTrue(enhanced_security.authenticate("director", "admin2024", "127.0.0.1", "TestAgent")["success"])
+        self.assertFalse(enhanced_security.authenticate("director", "wrongpassword", "127.0.0.1", "TestAgent")["success"])
+    
     def test_session_validation(self):
         """Тест валидации сессии"""
         auth_result = enhanced_security.authenticate("director", "admin2024", "127.0.0.1", "TestAgent")
@@ -49,6 +66,27 @@ class TestEnhancedSecurity(unittest.TestCase):
         self.assertIsNotNone(session_data)
         self.assertEqual(session_data["username"], "director")
     
+    def test_session_cache_invalidation(self):
+        """Тест кэша сессий: повторная проверка без БД, сброс по версии из другого процесса"""
+        from enhanced_security import EnhancedSecurity
+        
+        session_token = enhanced_security._create_session(1, "127.0.0.1")
+        other = EnhancedSecurity(version_check_interval=0)  # второй процесс с той же базой
+        hits = enhanced_security.session_cache.stats["hits"]
+        self.assertIsNotNone(enhanced_security.validate_session(session_token))
+        self.assertIsNotNone(enhanced_security.validate_session(session_token))
+        self.assertEqual(enhanced_security.session_cache.stats["hits"], hits + 1)
+        self.assertIsNotNone(other.validate_session(session_token))
+        
+        # Неизвестный токен кэшируется как отрицательный
+        self.assertIsNone(other.validate_session("unknown"))
+        self.assertIsNone(other.validate_session("unknown"))
+        self.assertEqual(other.session_cache.stats["negative_hits"], 1)
+        
+        enhanced_security._invalidate_session(session_token)
+        self.assertIsNone(enhanced_security.validate_session(session_token))
+        self.assertIsNone(other.validate_session(session_token))
+    
     def test_data_encryption(self):
         """Тест шифрования данных"""
         original_data = "Секретная информация"
@@ -0,0 +1,62 @@
+# bench_correlation.py
+"""
+Бенчмарк Correlator: события/сек при потоке с заданным числом источников.
+Цель — не меньше 100 000 событий/сек на одном ядре.
+
+    python tools/bench_correlation.py --events 1000000 --sources 5000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.correlation import Correlator, DEFAULT_RULES, build_rules
+
+TYPES = ["login_failure", "login_failure", "network_scan", "unauthorized_access", "system_event", "file_access"]
+
+def make_events(count, sources, seed=42):
+    rnd = random.Random(seed)
+    return [
+        {
+            "type": rnd.choice(TYPES),
+            "source": f"10.0.{(s := rnd.randrange(sources)) // 256}.{s % 256}",
+            "severity": "medium",
+            "message": "bench",
+        }
+        for _ in range(count)
+    ]
+
+def measure(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed
+    print(f"{label:<28} {rate:>14,.0f} событий/сек  ({elapsed:.3f} с)")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--sources", type=int, default=5000)
+    parser.add_argument("--max-sources", type=int, default=10000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    events = make_events(args.events, args.sources)
+    batches = [events[i:i + args.batch] for i in range(0, len(events), args.batch)]
+    print(f"событий: {args.events}, источников: {args.sources}, лимит источников: {args.max_sources}")
+
+    single = Correlator(build_rules(DEFAULT_RULES), max_sources=args.max_sources)
+    measure("observe (поштучно)", args.events, lambda: [single.observe(e) for e in events])
+    batched = Correlator(build_rules(DEFAULT_RULES), max_sources=args.max_sources)
+    rate = measure("feed (пакетами)", args.events, lambda: [batched.feed(b) for b in batches])
+    print(f"производных событий: {batched.metrics()['derived']}, вытеснено источников: {batched.metrics()['evicted']}")
+    if rate < 100000:
+        print("[!] ниже цели 100 000 событий/сек")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_performance_cache.py
+"""
+Бенчмарк кэша PerformanceOptimizer: построение ключей, кодеки значений
+и стоимость попадания (память / L2 по кодекам) против пересчёта.
+
+    python tools/bench_performance_cache.py --rows 5000
+"""
+
+import argparse
+import hashlib
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from performance_optimizer import CODECS, PerformanceOptimizer, msgpack, tuple_key_builder
+
+def analytics_payload(rows, seed=42):
+    """Полезная нагрузка, похожая на выгрузку аналитики: список словарей"""
+    rnd = random.Random(seed)
+    return {
+        "generated_at": "2024-01-01T00:00:00",
+        "rows": [
+            {"id": i, "project": f"project-{i % 97}", "risk": rnd.random(), "events": rnd.randrange(10000),
+             "tags": ["network", "auth"][: 1 + i % 2]}
+            for i in range(rows)
+        ],
+    }
+
+def legacy_key(func_name, args, kwargs):
+    key_data = f"{func_name}:{str(args)}:{str(sorted(kwargs.items()))}"
+    return hashlib.md5(key_data.encode()).hexdigest()
+
+def measure(label, repeat, func):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    per_call = (time.perf_counter() - start) / repeat
+    print(f"{label:<36} {per_call * 1e6:>12,.1f} мкс")
+    return per_call
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print("Ключи")
+    call_args, call_kwargs = ("2024-01-01", 100), {"region": "eu", "limit": 50}
+    measure("  md5(str(args)) (было)", 100000, lambda: legacy_key("report", call_args, call_kwargs))
+    measure("  tuple_key_builder", 100000, lambda: tuple_key_builder("report", call_args, call_kwargs))
+    unhashable = ({"region": "eu", "filters": ["a", "b"]},)
+    measure("  tuple_key_builder (нехэшируемые)", 100000, lambda: tuple_key_builder("report", unhashable, {}))
+
+    payload = analytics_payload(args.rows)
+    print(f"\nКодеки, {args.rows} строк")
+    for name, codec in CODECS.items():
+        if name == "raw" or (name == "msgpack" and msgpack is None):
+            continue
+        data = codec.encode(payload)
+        encode = measure(f"  {name}: encode", args.repeat, lambda: codec.encode(payload))
+        decode = measure(f"  {name}: decode", args.repeat, lambda: codec.decode(data))
+        print(f"  {name}: {len(data):,} байт, encode+decode {(encode + decode) * 1e3:.2f} мс")
+
+    print("\nПопадание против пересчёта")
+    recompute = measure("  пересчёт", args.repeat, lambda: analytics_payload(args.rows))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("json", "pickle", "msgpack"):
+            if name == "msgpack" and msgpack is None:
+                continue
+            optimizer = PerformanceOptimizer(db_path=str(Path(tmp) / f"{name}.db"), codec=name)
+
+            @optimizer.cache_result(ttl=600)
+            def report(rows):
+                return analytics_payload(rows)
+
+            report(args.rows)
+            optimizer.flush_cache_writes()
+            memory = measure(f"  {name}: попадание в память", args.repeat, lambda: report(args.rows))
+            key = tuple_key_builder("report", (args.rows,), {})
+
+            def l2_hit():
+                optimizer.cache.delete(key)
+                optimizer.get_from_cache(key)
+
+            l2 = measure(f"  {name}: попадание в L2", args.repeat, l2_hit)
+            optimizer.flush_cache_writes()
+            print(f"  {name}: память в {recompute / memory:,.0f}×, L2 в {recompute / l2:.1f}× быстрее пересчёта")
+
+if __name__ == "__main__":
+    main()
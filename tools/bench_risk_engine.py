@@ -0,0 +1,57 @@
+# bench_risk_engine.py
+"""
+Бенчмарк RiskEngine: события/сек для поштучной оценки (assess_event)
+и пакетной (assess_batch, score_batch).
+
+    python tools/bench_risk_engine.py --events 100000 --batch 5000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.risk_engine import RiskEngine, np
+
+def make_events(engine, count, distinct_messages=50, seed=42):
+    rnd = random.Random(seed)
+    values = {field: list(table) + ["unlisted"] for field, table in engine.compiled.tables}
+    return [
+        {
+            "type": rnd.choice(values["type"]),
+            "source": rnd.choice(values["source"]),
+            "severity": rnd.choice(values["severity"]),
+            "message": f"bench event {rnd.randrange(distinct_messages)}",
+        }
+        for _ in range(count)
+    ]
+
+def measure(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:>14,.0f} событий/сек  ({elapsed:.3f} с)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policy", default=str(Path(__file__).with_name("risk_policy.json")))
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--distinct-messages", type=int, default=50,
+                        help="число различных сообщений (меньше — больше повторов, как при сканировании)")
+    args = parser.parse_args()
+
+    engine = RiskEngine(args.policy)
+    events = make_events(engine, args.events, args.distinct_messages)
+    batches = [events[i:i + args.batch] for i in range(0, len(events), args.batch)]
+    print(f"numpy: {'да' if np is not None else 'нет'}, событий: {args.events}, пакет: {args.batch}")
+
+    measure("assess_event (поштучно)", args.events, lambda: [engine.assess_event(e) for e in events])
+    measure("assess_batch", args.events, lambda: [engine.assess_batch(b) for b in batches])
+    measure("score_batch (только риск)", args.events, lambda: [engine.compiled.score_batch(b) for b in batches])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# correlation.py
+
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Правила по умолчанию, если в политике нет раздела "correlation_rules"
+DEFAULT_RULES = [
+    {"name": "brute_force", "kind": "threshold", "event_type": "login_failure",
+     "count": 5, "window": 60, "emit": "brute_force", "severity": "critical"},
+    {"name": "scan_then_access", "kind": "sequence", "first": "network_scan",
+     "then": "unauthorized_access", "window": 300, "emit": "scan_then_access", "severity": "critical"},
+]
+
+class ThresholdRule:
+    """N событий одного типа от одного источника за window секунд"""
+
+    kind = "threshold"
+
+    def __init__(self, name, event_type, count, window, emit, severity="critical"):
+        if count < 1 or window <= 0:
+            raise ValueError(f"{name}: count >= 1 и window > 0")
+        self.name = name
+        self.event_type = sys.intern(event_type)
+        self.count = int(count)
+        self.window = float(window)
+        self.emit = emit
+        self.severity = severity
+        self.triggers = (self.event_type,)
+
+    def new_state(self):
+        # Кольцевой буфер последних count отметок времени: память O(count) на источник
+        return deque(maxlen=self.count)
+
+    def observe(self, state, event_type, now):
+        state.append(now)
+        if len(state) == self.count and now - state[0] <= self.window:
+            state.clear()  # следующая серия копится заново, без срабатывания на каждом событии
+            return f"{self.count} × {self.event_type} за {self.window:g} с"
+        return None
+
+
+class SequenceRule:
+    """Событие first, а затем then от того же источника не позже чем через window секунд"""
+
+    kind = "sequence"
+
+    def __init__(self, name, first, then, window, emit, severity="critical"):
+        if window <= 0:
+            raise ValueError(f"{name}: window > 0")
+        self.name = name
+        self.first = sys.intern(first)
+        self.then = sys.intern(then)
+        self.window = float(window)
+        self.emit = emit
+        self.severity = severity
+        self.triggers = (self.first, self.then)
+
+    def new_state(self):
+        return [None]  # время последнего first
+
+    def observe(self, state, event_type, now):
+        if event_type == self.first:
+            state[0] = now
+            return None
+        seen = state[0]
+        if seen is not None and now - seen <= self.window:
+            state[0] = None
+            return f"{self.first} → {self.then} за {now - seen:.0f} с"
+        return None
+
+
+RULE_KINDS = {"threshold": ThresholdRule, "sequence": SequenceRule}
+
+def build_rules(specs):
+    """Правила из описаний политики: [{"name", "kind", ...параметры правила}]"""
+    rules = []
+    for spec in specs:
+        params = dict(spec)
+        kind = params.pop("kind", None)
+        if kind not in RULE_KINDS:
+            raise ValueError(f"неизвестный вид правила корреляции: {kind!r}")
+        rules.append(RULE_KINDS[kind](**params))
+    return rules
+
+def rules_from_policy(policy):
+    return build_rules(policy.get("correlation_rules", DEFAULT_RULES))
+
+
+class Correlator:
+    """
+    Потоковая корреляция поверх RiskEngine.
+    Для каждого источника (поле key_field) хранится состояние только тех правил,
+    которые он уже задел: кольцевые буферы фиксированной длины, обновление O(1)
+    на событие. Число отслеживаемых источников ограничено LRU (max_sources).
+    feed возвращает производные события, которые обрабатываются как обычные.
+    """
+
+    def __init__(self, rules, key_field="source", max_sources=10000, clock=time.monotonic):
+        self.key_field = key_field
+        self.max_sources = max_sources
+        self.clock = clock
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"observed": 0, "derived": 0, "evicted": 0}
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        """Замена правил (перезагрузка политики); состояние окон начинается заново"""
+        rules = list(rules)
+        by_type = {}
+        for index, rule in enumerate(rules):
+            for event_type in rule.triggers:
+                by_type.setdefault(event_type, []).append((index, rule))
+        with self._lock:
+            self.rules = rules
+            self._by_type = by_type
+            self._sources.clear()
+
+    def feed(self, events, now=None):
+        """Учитывает события по порядку; возвращает список производных событий"""
+        if now is None:
+            now = self.clock()
+        sources = self._sources
+        derived = []
+        with self._lock:
+            by_type = self._by_type
+            self.stats["observed"] += len(events)
+            for event in events:
+                rules = by_type.get(event.get("type"))
+                if not rules:
+                    continue
+                key = event.get(self.key_field)
+                if key is None:
+                    continue  # без ключа участника события не связать
+                slots = sources.get(key)
+                if slots is None:
+                    slots = sources[key] = {}
+                    if len(sources) > self.max_sources:
+                        sources.popitem(last=False)
+                        self.stats["evicted"] += 1
+                else:
+                    sources.move_to_end(key)
+                event_type = event["type"]
+                for index, rule in rules:
+                    state = slots.get(index)
+                    if state is None:
+                        state = slots[index] = rule.new_state()
+                    reason = rule.observe(state, event_type, now)
+                    if reason is not None:
+                        derived.append({
+                            self.key_field: key,
+                            "type": rule.emit,
+                            "source": event.get("source", "unknown"),
+                            "severity": rule.severity,
+                            "message": f"Корреляция {rule.name} ({key}): {reason}",
+                        })
+            self.stats["derived"] += len(derived)
+        return derived
+
+    def observe(self, event, now=None):
+        return self.feed([event], now)
+
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, "tracked_sources": len(self._sources)}
@@ -2,11 +2,110 @@
 
 import hashlib
 import json
+import os
+import sys
+import threading
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:  # пакетная оценка работает и без numpy, только медленнее
+    np = None
+
+try:
+    from tools.correlation import build_rules
+except ImportError:  # запуск из каталога tools
+    from correlation import build_rules
+
+# Поля события, участвующие в оценке, в порядке формирования тегов
+SCORED_FIELDS = tuple(sys.intern(f) for f in ("type", "source", "severity"))
+
+# Сколько первых событий пачки смотреть, прежде чем отказаться от мемоизации хэшей
+MEMO_PROBE = 512
+
+class CompiledPolicy:
+    """
+    Скомпилированная политика риска.
+    Вместо трёх вложенных policy.get(...) на каждое событие — плоские таблицы
+    весов с интернированными ключами, а для пакетной оценки — словари
+    категориальных кодов и целочисленные массивы весов (код 0 = вес 0).
+    """
+
+    def __init__(self, policy, digest=None, version=0):
+        self.policy = policy
+        self.digest = digest or hashlib.sha256(json.dumps(policy, sort_keys=True).encode()).hexdigest()
+        self.version = version
+        self.loaded_at = datetime.now().isoformat()
+        self.tables = tuple(
+            (field, {sys.intern(str(k)): int(v) for k, v in policy.get(f"{field}_weights", {}).items()})
+            for field in SCORED_FIELDS
+        )
+        self.codes = {}
+        self.weights = {}
+        for field, table in self.tables:
+            self.codes[field] = {value: code for code, value in enumerate(table, start=1)}
+            weights = [0] + list(table.values())
+            self.weights[field] = np.asarray(weights, dtype=np.int64) if np is not None else weights
+
+    def score(self, event):
+        """Оценка одного события: (score, tags)"""
+        score = 0
+        tags = []
+        for field, table in self.tables:
+            if field in event:
+                value = event[field]
+                score += table.get(value, 0)
+                tags.append(value)
+        return score, tags
+
+    def score_batch(self, events):
+        """Оценки пачки событий: массив int64 (или список без numpy)"""
+        if np is None:
+            return [self.score(event)[0] for event in events]
+        n = len(events)
+        scores = np.zeros(n, dtype=np.int64)
+        for field, _ in self.tables:
+            lookup = self.codes[field].get
+            codes = np.fromiter((lookup(e.get(field), 0) for e in events), dtype=np.intp, count=n)
+            scores += self.weights[field][codes]
+        return scores
+
+def validate_policy(policy):
+    """Проверка структуры политики: {"<поле>_weights": {значение: целый вес}}"""
+    if not isinstance(policy, dict):
+        raise ValueError("политика должна быть JSON-объектом")
+    for field in SCORED_FIELDS:
+        weights = policy.get(f"{field}_weights", {})
+        if not isinstance(weights, dict):
+            raise ValueError(f"{field}_weights должен быть объектом")
+        for key, value in weights.items():
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f"{field}_weights[{key!r}]: вес должен быть целым числом")
+    rules = policy.get("correlation_rules")
+    if rules is not None:
+        if not isinstance(rules, list):
+            raise ValueError("correlation_rules должен быть списком")
+        try:
+            build_rules(rules)
+        except (TypeError, AttributeError) as e:
+            raise ValueError(f"correlation_rules: {e}") from e
+    return policy
+
+def event_hash(event):
+    return hashlib.sha256(json.dumps(event).encode()).hexdigest()
+
 class RiskEngine:
     def __init__(self, policy_path="risk_policy.json"):
-        self.policy = self.load_policy(policy_path)
+        self.policy_path = policy_path
+        self._reload_lock = threading.Lock()
+        self._reload_listeners = []
+        # Стартовая политика проверяется так же, как при перезагрузке: дробные веса не усекаются молча
+        policy = validate_policy(self.load_policy(policy_path))
+        self.compiled = CompiledPolicy(policy, digest=self._file_digest(policy_path))
+
+    @property
+    def policy(self):
+        return self.compiled.policy
 
     def load_policy(self, path):
         try:
@@ -16,28 +115,147 @@ class RiskEngine:
             print("[!] Политика риска не найдена. Используется пустая.")
             return {}
 
-    def assess_event(self, event):
-        score = 0
-        tags = []
+    @staticmethod
+    def _file_digest(path):
+        try:
+            with open(path, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
 
-        if "type" in event:
-            score += self.policy.get("type_weights", {}).get(event["type"], 0)
-            tags.append(event["type"])
+    def add_reload_listener(self, listener):
+        """listener(policy) после применения новой политики (например, пересборка правил корреляции)"""
+        self._reload_listeners.append(listener)
 
-        if "source" in event:
-            score += self.policy.get("source_weights", {}).get(event["source"], 0)
-            tags.append(event["source"])
+    def reload(self):
+        """
+        Перечитывает политику; при изменении проверяет и компилирует её вне горячего
+        пути и атомарно подменяет self.compiled. Ошибочная политика не применяется.
+        Возвращает True, если активная политика сменилась.
+        """
+        with self._reload_lock:
+            try:
+                with open(self.policy_path, "rb") as f:
+                    raw = f.read()
+                digest = hashlib.sha256(raw).hexdigest()
+                if digest == self.compiled.digest:
+                    return False
+                policy = validate_policy(json.loads(raw))
+                compiled = CompiledPolicy(policy, digest=digest, version=self.compiled.version + 1)
+            except (OSError, ValueError) as e:
+                print(f"[!] Политика риска не применена: {e}")
+                return False
+            self.compiled = compiled
+        print(f"[✔] Политика риска обновлена: версия {compiled.version}, sha256 {digest[:12]}")
+        for listener in self._reload_listeners:
+            listener(compiled.policy)
+        return True
+
+    def policy_info(self):
+        compiled = self.compiled
+        return {
+            "version": compiled.version,
+            "hash": compiled.digest,
+            "loaded_at": compiled.loaded_at,
+            "path": self.policy_path,
+        }
 
-        if "severity" in event:
-            score += self.policy.get("severity_weights", {}).get(event["severity"], 0)
-            tags.append(event["severity"])
+    def assess_event(self, event):
+        # self.compiled читается один раз: смена политики не рвёт оценку
+        score, tags = self.compiled.score(event)
 
         result = {
             "timestamp": datetime.now().isoformat(),
             "event": event,
             "risk_score": score,
             "tags": tags,
-            "hash": hashlib.sha256(json.dumps(event).encode()).hexdigest()
+            "hash": event_hash(event)
         }
 
-        return result
\ No newline at end of file
+        return result
+
+    def assess_batch(self, events):
+        """
+        Оценка пачки событий за один проход.
+        Результаты совпадают с assess_event; риск считается векторно,
+        теги и хэш одинаковых событий (типично для всплесков сканирования) — один раз.
+        """
+        compiled = self.compiled
+        fields = [field for field, _ in compiled.tables]
+        scores = compiled.score_batch(events)
+        timestamp = datetime.now().isoformat()
+        memo = {}
+        hits = 0
+        results = []
+        for i, (event, score) in enumerate(zip(events, scores)):
+            # Повторов почти нет — мемоизация только тратит время
+            if i == MEMO_PROBE and hits * 10 < MEMO_PROBE:
+                memo = None
+            cached = key = None
+            if memo is not None:
+                try:
+                    key = tuple(event.items())
+                    cached = memo.get(key)
+                except TypeError:  # нехэшируемые значения — без мемоизации
+                    key = None
+            if cached is None:
+                cached = ([event[f] for f in fields if f in event], event_hash(event))
+                if key is not None:
+                    memo[key] = cached
+            else:
+                hits += 1
+            tags, digest = cached
+            results.append({
+                "timestamp": timestamp,
+                "event": event,
+                "risk_score": int(score),
+                "tags": list(tags),
+                "hash": digest
+            })
+        return results
+
+
+class PolicyWatcher:
+    """
+    Фоновое отслеживание файла политики (опрос mtime/размера) с горячей
+    перезагрузкой через RiskEngine.reload.
+    """
+
+    def __init__(self, engine, path=None, interval=2.0):
+        self.engine = engine
+        self.path = path or engine.policy_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._signature = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def check(self):
+        """Одна проверка: перезагрузка, если файл изменился"""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        return self.engine.reload()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="policy-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)